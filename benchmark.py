@@ -0,0 +1,241 @@
+#!/usr/bin/env python
+# Rendering benchmark of pvflip: loads synthetic images through piio and
+# measures the load, the texture upload, the frames while panning and
+# zooming, and the switch between two images.
+#
+# It runs in an invisible GLFW window, or with --egl in an offscreen EGL
+# context, which with Mesa llvmpipe doesn't need a GPU nor a display:
+#
+#    > ./benchmark.py --egl --sizes 1,4,16 --json bench.json
+#
+# With --replay it replays instead the input events recorded by
+# v.py --record FILE, and reports the frame times and the input latencies.
+#
+#    > ./benchmark.py --egl --replay session.events --json replay.json
+#
+
+from __future__ import print_function
+from __future__ import division
+
+import os
+import sys
+import time
+
+
+def create_egl_context(w, h):
+   ''' offscreen context of size w x h (surfaceless Mesa if available) '''
+   import ctypes
+   from OpenGL import EGL
+   dpy = EGL.EGL_NO_DISPLAY
+   try:
+      from OpenGL.EGL.EXT.platform_base import eglGetPlatformDisplayEXT
+      EGL_PLATFORM_SURFACELESS_MESA = 0x31DD
+      dpy = eglGetPlatformDisplayEXT(EGL_PLATFORM_SURFACELESS_MESA, EGL.EGL_DEFAULT_DISPLAY, None)
+   except Exception:
+      pass
+   if not dpy:
+      dpy = EGL.eglGetDisplay(EGL.EGL_DEFAULT_DISPLAY)
+   major, minor = EGL.EGLint(), EGL.EGLint()
+   if not EGL.eglInitialize(dpy, ctypes.pointer(major), ctypes.pointer(minor)):
+      raise RuntimeError('cannot initialize EGL')
+
+   attributes = [EGL.EGL_SURFACE_TYPE, EGL.EGL_PBUFFER_BIT,
+                 EGL.EGL_RENDERABLE_TYPE, EGL.EGL_OPENGL_BIT,
+                 EGL.EGL_RED_SIZE, 8, EGL.EGL_GREEN_SIZE, 8, EGL.EGL_BLUE_SIZE, 8,
+                 EGL.EGL_NONE]
+   config, n = EGL.EGLConfig(), EGL.EGLint()
+   EGL.eglChooseConfig(dpy, (EGL.EGLint*len(attributes))(*attributes),
+                       ctypes.pointer(config), 1, ctypes.pointer(n))
+   if n.value < 1:
+      raise RuntimeError('no EGL configuration for desktop OpenGL')
+   size = (EGL.EGLint*5)(EGL.EGL_WIDTH, w, EGL.EGL_HEIGHT, h, EGL.EGL_NONE)
+   surface = EGL.eglCreatePbufferSurface(dpy, config, size)
+   EGL.eglBindAPI(EGL.EGL_OPENGL_API)
+   context = EGL.eglCreateContext(dpy, config, EGL.EGL_NO_CONTEXT, None)
+   if not context or not EGL.eglMakeCurrent(dpy, surface, surface, context):
+      raise RuntimeError('cannot create the EGL context')
+   return None
+
+
+def create_glfw_window(w, h):
+   ''' invisible window of size w x h '''
+   from glfw import glfw
+   if not glfw.init():
+      raise RuntimeError('cannot initialize GLFW')
+   glfw.window_hint(glfw.VISIBLE, False)
+   window = glfw.create_window(w, h, "pvflip benchmark", None, None)
+   if not window:
+      raise RuntimeError('cannot create the GLFW window')
+   glfw.make_context_current(window)
+   glfw.swap_interval(0)
+   return window
+
+
+def write_synthetic_image(filename, w, h, nch, sample_type):
+   ''' writes a raw w x h x nch image of 'float' or 'uint8' samples and
+       returns the name that piio reads it with '''
+   from array import array
+   typecode = 'f' if sample_type == 'float' else 'B'
+   # a diagonal ramp: each row is the previous one shifted by one pixel
+   n = w*nch
+   ramp = array(typecode, [((i//nch)*nch + i*37) % 256 for i in range(2*n)]).tobytes()
+   itemsize = array(typecode).itemsize
+   with open(filename, 'wb') as f:
+      for y in range(h):
+         start = (y % w)*nch*itemsize
+         f.write(ramp[start:start + n*itemsize])
+   return 'RAW[w%d,h%d,p%d,t%s]:%s'%(w, h, nch, 'FLOAT' if sample_type == 'float' else 'UINT8', filename)
+
+
+def percentiles(samples):
+   samples = sorted(samples)
+   at = lambda p: 1000*samples[min(int(p/100.0*len(samples)), len(samples)-1)]
+   return {'mean': 1000*sum(samples)/len(samples), 'p50': at(50), 'p90': at(90), 'p99': at(99), 'max': at(100)}
+
+
+def upload_all(v):
+   ''' uploads the pending tiles, returns the time it took '''
+   from OpenGL.GL import glFinish
+   t0 = time.time()
+   while v.U.upload_step():
+      pass
+   glFinish()
+   return time.time() - t0
+
+
+def benchmark_case(v, window, names, frames):
+   ''' times for the images names (two of them, the second for the switch) '''
+   from OpenGL.GL import glFinish
+   v.S = v.Stats()
+   v.DD.clear()
+   v.D = v.ImageState()
+   sys.argv[:] = ['v.py'] + names
+   result = {}
+
+   t0 = time.time()
+   v.current_image_idx = v.change_image(0)
+   result['load_s'] = time.time() - t0
+   for name in ('decode', 'minmax', 'tiling'):
+      result[name+'_s'] = v.S.timers[name][1]
+   v.V.reset_scale_bias()
+
+   result['upload_s'] = upload_all(v)
+   nbytes = sum(tile[3]*tile[4]*tile[5]*4 for tile in v.D.imageBitmapTiles)
+   result['upload_MBps'] = nbytes/1e6/max(result['upload_s'], 1e-9)
+
+   # pan and zoom around the image
+   v.V.reset_zoom()
+   times = []
+   for i in range(frames):
+      f = i/float(max(frames-1, 1))
+      v.V.zoom_param = 0.25 + 1.75*f
+      v.V.dx = (v.D.w - v.V.winx/v.V.zoom_param)*f
+      v.V.dy = (v.D.h - v.V.winy/v.V.zoom_param)*(1-f)
+      t0 = time.time()
+      v.display(window)
+      glFinish()
+      times.append(time.time() - t0)
+   result['frame_ms'] = percentiles(times)
+
+   # switch to an image not read yet, and back to the cached one
+   for key, idx in (('switch_cold_s', 1), ('switch_cached_s', 0)):
+      t0 = time.time()
+      v.current_image_idx = v.change_image(idx)
+      upload_all(v)
+      v.display(window)
+      glFinish()
+      result[key] = time.time() - t0
+
+   v.DD.clear()
+   return result
+
+
+def main():
+   import argparse, tempfile, shutil, platform
+   parser = argparse.ArgumentParser(description='pvflip rendering benchmark')
+   parser.add_argument('--egl', action='store_true',
+         help='render offscreen with EGL (no window nor display needed)')
+   parser.add_argument('--sizes', default='1,4,16',
+         help='image sizes in megapixels, comma separated (default 1,4,16)')
+   parser.add_argument('--channels', default='1,2,3,4', help='default 1,2,3,4')
+   parser.add_argument('--types', default='float,uint8', help='default float,uint8')
+   parser.add_argument('--frames', type=int, default=60,
+         help='frames drawn while panning and zooming (default 60)')
+   parser.add_argument('--window', default='1024x768', help='default 1024x768')
+   parser.add_argument('--tmpdir', default=None, help='where the synthetic images are written')
+   parser.add_argument('--replay', default=None,
+         help='replay the events recorded with v.py --record (--sizes, --channels, --types and --frames are ignored)')
+   parser.add_argument('--json', default=None, help='write the results to this file')
+   args = parser.parse_args()
+
+   winx, winy = [int(x) for x in args.window.split('x')]
+   if args.replay:
+      # the size of the recorded window (first line of the file)
+      import json
+      with open(args.replay) as f:
+         winx, winy = json.loads(f.readline())['window']
+   if args.egl:
+      # must be set before OpenGL is imported
+      os.environ['PYOPENGL_PLATFORM'] = 'egl'
+      window = create_egl_context(winx, winy)
+   else:
+      window = create_glfw_window(winx, winy)
+
+   sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+   import v
+   from OpenGL.GL import glGetString, GL_RENDERER, GL_VERSION
+   v.V.winx, v.V.winy = winx, winy
+   v.V.display_hud = 0
+
+   report = { 'renderer': glGetString(GL_RENDERER).decode(), 'gl_version': glGetString(GL_VERSION).decode(),
+              'python': platform.python_version(), 'window': [winx, winy], 'frames': args.frames,
+              'context': 'egl' if args.egl else 'glfw', 'cases': [] }
+   print('%s (%s)'%(report['renderer'], report['gl_version']))
+
+   if args.replay:
+      v.replay_trace(window, args.replay)
+      print(v.S.text())
+      report.update(v.S.summary())
+      report['replay'] = args.replay
+      del report['cases'], report['frames']
+      write_report(report, args.json)
+      return
+
+   print('%6s %3s %6s %8s %8s %8s %9s %9s %8s %8s'%('MP', 'nch', 'type', 'load s', 'upload s', 'MB/s',
+         'frame p50', 'frame p99', 'cold s', 'cached s'))
+
+   tmpdir = tempfile.mkdtemp(dir=args.tmpdir, prefix='pvflip-bench-')
+   try:
+      for mp in [float(x) for x in args.sizes.split(',')]:
+         w = h = int(round((mp*1e6)**0.5))
+         for nch in [int(x) for x in args.channels.split(',')]:
+            for sample_type in args.types.split(','):
+               names = [write_synthetic_image(os.path.join(tmpdir, 'im%d.raw'%i), w, h, nch, sample_type)
+                        for i in range(2)]
+               r = benchmark_case(v, window, names, args.frames)
+               for name in names:
+                  os.remove(name.split(':', 1)[1])
+               r.update({'megapixels': mp, 'w': w, 'h': h, 'channels': nch, 'type': sample_type})
+               report['cases'].append(r)
+               print('%6g %3d %6s %8.3f %8.3f %8.1f %9.2f %9.2f %8.3f %8.3f'%(mp, nch, sample_type,
+                     r['load_s'], r['upload_s'], r['upload_MBps'], r['frame_ms']['p50'],
+                     r['frame_ms']['p99'], r['switch_cold_s'], r['switch_cached_s']))
+   finally:
+      shutil.rmtree(tmpdir)
+
+   write_report(report, args.json)
+
+
+def write_report(report, filename):
+   import json, resource
+   # kilobytes on linux, bytes on mac
+   rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+   report['peak_rss_MB'] = rss/(1e6 if sys.platform == 'darwin' else 1e3)
+   if filename:
+      with open(filename, 'w') as f:
+         json.dump(report, f, indent=1, sort_keys=True)
+         f.write('\n')
+      print('results written to %s'%filename)
+
+
+if __name__ == '__main__': main()
@@ -153,6 +153,77 @@ def _glfw_get_version(filename):
     else:
         return None
 
+def _library_version(library_handle):
+    """
+    Returns the version tuple of a loaded library, or None.
+    """
+    if not hasattr(library_handle, 'glfwGetVersion'):
+        return None
+    major, minor, rev = ctypes.c_int(0), ctypes.c_int(0), ctypes.c_int(0)
+    library_handle.glfwGetVersion(ctypes.byref(major), ctypes.byref(minor),
+                                  ctypes.byref(rev))
+    return (major.value, minor.value, rev.value)
+
+
+def _library_cache_filename():
+    cachedir = os.environ.get('XDG_CACHE_HOME',
+                              os.path.join(os.path.expanduser('~'), '.cache'))
+    return os.path.join(cachedir, 'pvflip', 'glfw-library.json')
+
+
+def _mtimes(filenames):
+    """
+    The modification times of the files (None for the missing ones).
+    """
+    mtimes = {}
+    for filename in filenames:
+        try:
+            mtimes[filename] = os.stat(filename).st_mtime
+        except OSError:
+            mtimes[filename] = None
+    return mtimes
+
+
+def _load_library_cached(library_names, library_file_extensions,
+                         library_search_paths, version_check_callback):
+    """
+    Like _load_library, but the path and version of the library found are
+    cached in a file, which is valid while the library and the search
+    directories keep their modification times. The current directory ('')
+    is not part of the key. With a valid cache the import costs one CDLL.
+    """
+    import json
+    cachefile = _library_cache_filename()
+    directories = [os.path.realpath(p) for p in library_search_paths if p]
+    try:
+        with open(cachefile) as f:
+            cache = json.load(f)
+        if cache['mtimes'] == _mtimes(directories + [cache['path']]):
+            library = ctypes.CDLL(cache['path'])
+            if list(_library_version(library) or []) == cache['version']:
+                return library
+    except (IOError, OSError, ValueError, KeyError, TypeError):
+        pass
+
+    library = _load_library(library_names, library_file_extensions,
+                            library_search_paths, version_check_callback)
+    if library is not None:
+        path = library._name
+        cache = {'path': path, 'version': list(_library_version(library)),
+                 'mtimes': _mtimes(directories + [path])}
+        try:
+            if not os.path.isdir(os.path.dirname(cachefile)):
+                os.makedirs(os.path.dirname(cachefile))
+            # write and rename, so that concurrent imports never read half a file
+            tmpname = '%s.%d' % (cachefile, os.getpid())
+            with open(tmpname, 'w') as f:
+                json.dump(cache, f)
+            os.rename(tmpname, cachefile)
+        except (IOError, OSError):
+            pass
+    return library
+
+
 here = os.path.dirname(__file__)
 if sys.platform.startswith('win'):
     # try the procompiled winXX libraries
@@ -183,7 +254,7 @@ else:   # not Windows -> Linux or Mac
 
     # if failed search it on the system (slower)
     if _glfw == None:
-        _glfw = _load_library(['glfw', 'glfw3'], ['.so', '.dylib'],
+        _glfw = _load_library_cached(['glfw', 'glfw3'], ['.so', '.dylib'],
                      ['',
                       here,
                       os.path.join(here,'glfw-3.3.bin.MAC64/'),
@@ -199,7 +270,7 @@ else:   # not Windows -> Linux or Mac
             os.system("make -j -C %s/glfw_src" % here)
             os.system("cp %s/glfw_src/libglfw.so %s" % (here,here))
         try:
-           _glfw = _load_library(['glfw', 'glfw3'], ['.so', '.dylib'],
+           _glfw = _load_library_cached(['glfw', 'glfw3'], ['.so', '.dylib'],
                           ['', here,], _glfw_get_version)
            if _glfw == None:
               raise OSError('Library file not found')
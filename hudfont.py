@@ -0,0 +1,241 @@
+# Bitmap fonts for the pvflip HUD
+#
+# The glyphs of the printable ASCII characters (32 to 126) were rasterized
+# from DejaVu Sans Mono at 12 and 24 pixels and thresholded to one bit.
+# Each glyph is a hex string with one row per cell line (1 byte per row for 
+# the 8 pixels wide cells, 2 bytes for the 16 pixels wide cells), the most
+# significant bit is the leftmost pixel.
+#
+# DejaVu fonts: Copyright (c) 2003 by Bitstream, Inc. All Rights Reserved.
+# Bitstream Vera is a trademark of Bitstream, Inc. DejaVu changes are in 
+# public domain. Distributed under the Bitstream Vera Fonts license, 
+# see https://dejavu-fonts.github.io/License.html
+
+FIRST_CHAR = 32
+NUM_CHARS  = 95
+
+
+# 8x13 cells, baseline at row 10
+GLYPHS_8X13 = (
+   '00000000000000000000000000',  # ' '
+   '00101010101010001010000000',  # '!'
+   '00282828000000000000000000',  # '"'
+   '00001434fe2c28fe4858000000',  # '#'
+   '00103c7450701c16563c101000',  # '$'
+   '0060909066386e1a120e000000',  # '%'
+   '003860602070dacece7e000000',  # '&'
+   '00101010000000000000000000',  # "'"
+   '08181010303030101018080000',  # '('
+   '20101018181818181010200000',  # ')'
+   '00105438385410000000000000',  # '*'
+   '000000101010fe101010000000',  # '+'
+   '00000000000000001810300000',  # ','
+   '00000000000038000000000000',  # '-'
+   '00000000000000001818000000',  # '.'
+   '00040c08181030302060400000',  # '/'
+   '00386c44465646446c38000000',  # '0'
+   '0078181818181818187e000000',  # '1'
+   '00784c04040c1830607c000000',  # '2'
+   '00384c040c380c044c78000000',  # '3'
+   '000c1c3c2c6c4cfe0c0c000000',  # '4'
+   '007c4040780c04044c78000000',  # '5'
+   '003864407c644646643c000000',  # '6'
+   '007c040c081818103030000000',  # '7'
+   '003c6c4464386446643c000000',  # '8'
+   '00386c44466e3e044c38000000',  # '9'
+   '00000000181800001818000000',  # ':'
+   '00000000181800001810300000',  # ';'
+   '000000061c70701c0600000000',  # '<'
+   '0000000000fe00fe0000000000',  # '='
+   '000000c0780e0e78c000000000',  # '>'
+   '003c6c040c1810001010000000',  # '?'
+   '00003c66c29eb2b29ec0603c00',  # '@'
+   '001838382c6c647cc6c6000000',  # 'A'
+   '007c4446447c4646467c000000',  # 'B'
+   '003c646040404060643c000000',  # 'C'
+   '00784c44464646444c78000000',  # 'D'
+   '007e6060607c6060607e000000',  # 'E'
+   '007e6060607c60606060000000',  # 'F'
+   '003c644040ce4646663c000000',  # 'G'
+   '00464646467e46464646000000',  # 'H'
+   '007c101010101010107c000000',  # 'I'
+   '003c0c0c0c0c0c0ccc78000000',  # 'J'
+   '00464c587070584c4446000000',  # 'K'
+   '0060606060606060607e000000',  # 'L'
+   '00c6eeeeeefed6c6c6c6000000',  # 'M'
+   '0066666656565e4e4e46000000',  # 'N'
+   '00386c46464646466c38000000',  # 'O'
+   '007c6666667c60606060000000',  # 'P'
+   '00386c46464646466c380c0400',  # 'Q'
+   '00784c444c784c444642000000',  # 'R'
+   '00386440603c0406447c000000',  # 'S'
+   '00fe1010101010101010000000',  # 'T'
+   '0046464646464644643c000000',  # 'U'
+   '00c64644646c2c283818000000',  # 'V'
+   '0082c2dadefe6e6c6c64000000',  # 'W'
+   '0046642c3818386c44c6000000',  # 'X'
+   '00c6446c381810101010000000',  # 'Y'
+   '007e060c08183020607e000000',  # 'Z'
+   '18101010101010101010180000',  # '['
+   '0040602030301018080c040000',  # '\\'
+   '38181818181818181818380000',  # ']'
+   '00382c46000000000000000000',  # '^'
+   '000000000000000000000000fe',  # '_'
+   '20100000000000000000000000',  # '`'
+   '000000780c047c444c7c000000',  # 'a'
+   '4040407c64664666647c000000',  # 'b'
+   '0000003c64606060643c000000',  # 'c'
+   '0404043c6c4444446c3c000000',  # 'd'
+   '0000003c64467e40643c000000',  # 'e'
+   '1c10107c101010101010000000',  # 'f'
+   '0000003c6c4444446c3c044c38',  # 'g'
+   '4040407c644444444444000000',  # 'h'
+   '1000007010101010107e000000',  # 'i'
+   '18000078181818181818181870',  # 'j'
+   '606060646870786c6466000000',  # 'k'
+   '7030303030303010101c000000',  # 'l'
+   '000000fcded6d6d6d6d6000000',  # 'm'
+   '0000007c644444444444000000',  # 'n'
+   '000000386c4446446c38000000',  # 'o'
+   '0000007c64664666647c404040',  # 'p'
+   '0000003c6c4444446c3c040404',  # 'q'
+   '0000003e303020202020000000',  # 'r'
+   '00000038646038044c38000000',  # 's'
+   '0030307c30303030301c000000',  # 't'
+   '00000044444444446c3c000000',  # 'u'
+   '0000004644642c283818000000',  # 'v'
+   '00000082c2d65e6c6c6c000000',  # 'w'
+   '000000442c3818386c46000000',  # 'x'
+   '0000004644642c383818103060',  # 'y'
+   '0000007c0c081030607c000000',  # 'z'
+   '1c1810101070101010181c0000',  # '{'
+   '10101010101010101010101000',  # '|'
+   '70101010181c18101010700000',  # '}'
+   '0000000000729c000000000000',  # '~'
+   )
+
+# 16x26 cells, baseline at row 20
+GLYPHS_16X26 = (
+   '00000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000',  # ' '
+   '00000000038003800380038003800380038003800380038003000300000000000000038003800380000000000000000000000000',  # '!'
+   '000000000ce00ce00ce00ce00ce00ce00ce000000000000000000000000000000000000000000000000000000000000000000000',  # '"'
+   '00000000031803380730063006307ffe7ffe0c600c600ce01cc0fff8fff819c03980318031803180000000000000000000000000',  # '#'
+   '000000000100010001000fe01ff03d303900390039001f000fe003f001380118013831383ff01fe0010001000100010000000000',  # '$'
+   '000000003c007e00e700c300e7007e1c3c3800e0018007001c0038f061fc018c030c018c01fc00f8000000000000000000000000',  # '%'
+   '000000000fc01fc01c401800180018001c001e003f00770c638c61cc60ec6078707878f83ffc0f9c000000000000000000000000',  # '&'
+   '00000000030003000300030003000300030000000000000000000000000000000000000000000000000000000000000000000000',  # "'"
+   '0000000000c001c00180038003800300070007000700070006000700070007000700030003800380018001c000c0000000000000',  # '('
+   '000000000c000600070003000300038003800180018001c001c001c0018001800380038003000300070006000c00000000000000',  # ')'
+   '000000000300030033101f7007c007c01f7033100300030000000000000000000000000000000000000000000000000000000000',  # '*'
+   '000000000000000000000000030003000300030003007ffc7ffc0300030003000300030000000000000000000000000000000000',  # '+'
+   '00000000000000000000000000000000000000000000000000000000000000000380038003800700070006000600000000000000',  # ','
+   '0000000000000000000000000000000000000000000000000fc00fc0000000000000000000000000000000000000000000000000',  # '-'
+   '00000000000000000000000000000000000000000000000000000000000000000380038003800380000000000000000000000000',  # '.'
+   '00000000003800300070006000e000c001c0018003800300070007000e000e000c001c0018003800300070000000000000000000',  # '/'
+   '0000000007c01fe01cf03870383830383038703873b873b8703830383038383838701cf01fe007c0000000000000000000000000',  # '0'
+   '000000000f801f801d8001800180018001800180018001800180018001800180018001801ff81ff8000000000000000000000000',  # '1'
+   '000000001fc03fe030f00070003000300070007000e000c001c0038007000e001c0038003ff83ff8000000000000000000000000',  # '2'
+   '000000001fc03fe030f0007000300030007000f00fe00fe000f0003000380038003870f07fe01fc0000000000000000000000000',  # '3'
+   '0000000000e001e001e003e007e006e00ce00ce018e038e030e070e07ff87ff800e000e000e000e0000000000000000000000000',  # '4'
+   '000000003fe03fe038003800380038003fc03fe030f000700038003800380038007030f07fe01f80000000000000000000000000',  # '5'
+   '0000000007e00ff01e3038003800300037c07ff07c707838783830383038383838381c701ff007c0000000000000000000000000',  # '6'
+   '000000007ff87ff800300070007000e000e000c001c001c00180038003800700070006000e000e00000000000000000000000000',  # '7'
+   '000000000fc01fe03c7038383838383838301c700fe01fe03c7030387038703878383c781ff00fc0000000000000000000000000',  # '8'
+   '000000000fc01fe03cf03870703870387038703838783cf81ff80fb800380030007010e01fe01f80000000000000000000000000',  # '9'
+   '00000000000000000000000000000000038003800380038000000000000000000380038003800380000000000000000000000000',  # ':'
+   '00000000000000000000000000000000038003800380038000000000000000000380038003800700070006000600000000000000',  # ';'
+   '0000000000000000000000000000000c007c01f80fc03f00780078003f000fc001f8007c000c0000000000000000000000000000',  # '<'
+   '0000000000000000000000000000000000007ffc7ffc0000000000007ffc7ffc0000000000000000000000000000000000000000',  # '='
+   '0000000000000000000000000000600078007f000fc001f8007c007c01f80fc07f00780060000000000000000000000000000000',  # '>'
+   '0000000007c01fe01cf0107000300070007000e001c0038003000300030000000000030003000300000000000000000000000000',  # '?'
+   '000000000000000007e00ff01c38381c700c61ec63fce71cc60cc60cc60cc60ce71c63fc61ec700038001e000ff003f000000000',  # '@'
+   '000000000780078007c007c00ec00ec00ce01ce01c601c70387038703ff83ff870387018701ce01c000000000000000000000000',  # 'A'
+   '000000003fc03ff03870383838383838383838703fe03fe03878383838183818383838783ff03fe0000000000000000000000000',  # 'B'
+   '0000000003f00ff81e181c0038003800300030007000700030003000380038001c001e180ff803f0000000000000000000000000',  # 'C'
+   '000000007f807fc071e070707030703870387038703870387038703870387030707071e07fe07f80000000000000000000000000',  # 'D'
+   '000000003ff83ff83800380038003800380038003ff83ff83800380038003800380038003ff83ff8000000000000000000000000',  # 'E'
+   '000000001ff81ff81800180018001800180018001ff01ff018001800180018001800180018001800000000000000000000000000',  # 'F'
+   '0000000007f00ff81e1838003800700070007000700070f870f870387038383838381e380ff807e0000000000000000000000000',  # 'G'
+   '00000000703870387038703870387038703870387ff87ff870387038703870387038703870387038000000000000000000000000',  # 'H'
+   '000000003ff03ff0038003800380038003800380038003800380038003800380038003803ff03ff0000000000000000000000000',  # 'I'
+   '000000000fe00fe000600060006000600060006000600060006000600060006040e071e07fc03f80000000000000000000000000',  # 'J'
+   '00000000701c7038707070e071c0738077007f007f007f8079c071c070e070f070707038703c701c000000000000000000000000',  # 'K'
+   '0000000038003800380038003800380038003800380038003800380038003800380038003ffc3ffc000000000000000000000000',  # 'L'
+   '00000000783c783c787c787c6c7c6cdc6cdc66dc679c679c639c631c601c601c601c601c601c601c000000000000000000000000',  # 'M'
+   '00000000783878387c387c387e38763876387738733873b871b871b871f870f870f8707870787078000000000000000000000000',  # 'N'
+   '000000000fc01fe01c703830383870387038703870387038703870387038383838303c701fe00fc0000000000000000000000000',  # 'O'
+   '000000003fe03ff038783838381c381c383838783ff03fe038003800380038003800380038003800000000000000000000000000',  # 'P'
+   '000000000fc01fe01c703830383870387038703870387038703870387038383838303c701fe00fc000e000700020000000000000',  # 'Q'
+   '000000007fc07fe070f0707070387038707070f07fe07fc070e070707070703870387018701c701c000000000000000000000000',  # 'R'
+   '000000000fe01ff03c3030003000700038003e001fc00ff000f8003800380038003830703ff01fc0000000000000000000000000',  # 'S'
+   '00000000fffcfffc0380038003800380038003800380038003800380038003800380038003800380000000000000000000000000',  # 'T'
+   '000000003038303830383038303830383038303830383038303830383038303838383c701ff00fc0000000000000000000000000',  # 'U'
+   '00000000601c701c70387038303838303870187018701c601ce00ce00ec00ec007c007c007800780000000000000000000000000',  # 'V'
+   '00000000e00ee00ce00ce00ce01c639c679c679c679876d876d87cd83cf83cf83c783c7038703870000000000000000000000000',  # 'W'
+   '00000000701c383838301c700c600ee007c007800380078007c00ee01ce01c7038303038701ce01c000000000000000000000000',  # 'X'
+   '00000000601c7038303838701c701ce00ee00fc00780038003800380038003800380038003800380000000000000000000000000',  # 'Y'
+   '000000003ffc3ffc00380038007000e000e001c003800380070006000e001c00180038003ffc3ffc000000000000000000000000',  # 'Z'
+   '0000000007e007e00700070007000700070007000700070007000700070007000700070007000700070007e007e0000000000000',  # '['
+   '0000000070003000380018001c000c000e000e000700070003000380018001c000c000e000600070003000380000000000000000',  # '\\'
+   '000000000f800f80018001800180018001800180018001800180018001800180018001800180018001800f800f80000000000000',  # ']'
+   '00000000038007c00fc01ce018703038701800000000000000000000000000000000000000000000000000000000000000000000',  # '^'
+   '000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000fffefffe',  # '_'
+   '00000c000e0007000380000000000000000000000000000000000000000000000000000000000000000000000000000000000000',  # '`'
+   '00000000000000000000000000001fc03fe03870003000380ff83ff838387038707838f83ff81fb8000000000000000000000000',  # 'a'
+   '00000000380038003800380038003bc03ff03c7038383838381838183818383838383c703ff03bc0000000000000000000000000',  # 'b'
+   '000000000000000000000000000003f00ff81e181c00380038003800380038001c001e180ff803f0000000000000000000000000',  # 'c'
+   '00000000003000300030003000300fb01ff03cf038707030703070307030703038703cf01ff00fb0000000000000000000000000',  # 'd'
+   '000000000000000000000000000007c01ff03c70383830187ff87ff87000700038003c381ff807f0000000000000000000000000',  # 'e'
+   '0000000001f803f80380030003003ff83ff803000300030003000300030003000300030003000300000000000000000000000000',  # 'f'
+   '00000000000000000000000000000fb01ff03cf038707030703070307030703038703cf01ff00fb00030007018f01fe00fc00000',  # 'g'
+   '00000000380038003800380038003be03ff03c703830383038303838383838383838383838383838000000000000000000000000',  # 'h'
+   '00000000038003800380000000001f801f800380038003800380038003800380038003803ff83ff8000000000000000000000000',  # 'i'
+   '00000000018001800180000000001f801f80018001800180018001800180018001800180018001800180018003803f003e000000',  # 'j'
+   '00000000180018001800180018001838187018e019c01b801f801f801dc018e0187018701838181c000000000000000000000000',  # 'k'
+   '000000003f003f000700070007000700070007000700070007000700070007000700038003f001f0000000000000000000000000',  # 'l'
+   '00000000000000000000000000007e707ff873987398631863186318631863186318631863186318000000000000000000000000',  # 'm'
+   '00000000000000000000000000003be03ff03c703830383038303838383838383838383838383838000000000000000000000000',  # 'n'
+   '00000000000000000000000000000fc01fe03c7038383038703870387038303838383c701fe00fc0000000000000000000000000',  # 'o'
+   '00000000000000000000000000003bc03ff03c7038383838383838183838383838383c703ff03bc0380038003800380038000000',  # 'p'
+   '00000000000000000000000000000fb81ff83cf838783038703870387038303838783cf81ff80fb8003800380038003800380000',  # 'q'
+   '00000000000000000000000000000ef80ffc0f8c0e000e000e000e000e000e000e000e000e000e00000000000000000000000000',  # 'r'
+   '00000000000000000000000000000fe01ff01c30380038001f000fe001f00070003038703fe01fc0000000000000000000000000',  # 's'
+   '00000000000006000600060006007ff07ff006000600060006000600060006000700070007f003f0000000000000000000000000',  # 't'
+   '000000000000000000000000000038383838383838383838383838383838383838783cf81ff80fb8000000000000000000000000',  # 'u'
+   '0000000000000000000000000000701830383038383018701c601c600ce00ec00ec007c007800780000000000000000000000000',  # 'v'
+   '0000000000000000000000000000c00ee00ce00c601c631c73987798379836f83cf03cf01c701870000000000000000000000000',  # 'w'
+   '0000000000000000000000000000303838701c600ee007c00780038007c00ec01ce0187038387018000000000000000000000000',  # 'x'
+   '0000000000000000000000000000701c30383838383018701c700c600ee00ec007c007c0038003800300070007003e003c000000',  # 'y'
+   '00000000000000000000000000003ff03ff0007000e000c00180038007000e001c0018003ff03ff0000000000000000000000000',  # 'z'
+   '0000000000f001f0038003800380038003800380030007003e003e000700030003800380038003800380038001f000f000000000',  # '{'
+   '00000000030003000300030003000300030003000300030003000300030003000300030003000300030003000300030003000300',  # '|'
+   '000000003e003f000700030003000300030003000380038001f001f0038003800300030003000300030007003f003e0000000000',  # '}'
+   '000000000000000000000000000000000000000000003f0c7ffc61f8000000000000000000000000000000000000000000000000',  # '~'
+   )
+
+# display scale : (glyphs, cell width, cell height, baseline)
+FONTS = {
+      1 : (GLYPHS_8X13,   8, 13, 10),
+      2 : (GLYPHS_16X26, 16, 26, 20),
+      }
+
+
+def build_atlas(scale=1, columns=16):
+   '''
+   returns pixels, atlas_w, atlas_h, cell_w, cell_h, baseline
+   pixels is a bytearray of atlas_w*atlas_h values (0 or 255) with the 
+   glyphs arranged in a grid of columns cells per row, in character order
+   '''
+   glyphs, cw, ch, baseline = FONTS[2 if scale > 1 else 1]
+   rows = (NUM_CHARS + columns - 1)//columns
+   aw, ah = cw*columns, ch*rows
+   pixels = bytearray(aw*ah)
+   row_nibbles = (cw+7)//8*2
+   for n, glyph in enumerate(glyphs):
+      x0, y0 = (n % columns)*cw, (n // columns)*ch
+      for j in range(ch):
+         bits = int(glyph[j*row_nibbles:(j+1)*row_nibbles], 16)
+         for i in range(cw):
+            if bits & (1 << (row_nibbles*4-1-i)):
+               pixels[x0+i + (y0+j)*aw] = 255
+   return pixels, aw, ah, cw, ch, baseline
@@ -1,2 +1,3 @@
-from .piio import read, write, read_buffer, write_buffer_uint8, minmax, read_tiled_buffers
-
+from .piio import read, write, read_buffer, write_buffer, write_buffer_uint8, minmax, read_tiled_buffers, read_preview
+from .piio import jpeg_size, read_jpeg_scaled, read_raw_thumbnail, tile_buffer, read_frame, convert_samples
+from .piio import tile_stats_summary, new_region_stats, tile_region_stats, tile_region_histogram
@@ -0,0 +1,220 @@
+#!/usr/bin/env python
+# Micro-benchmark of the iio decoders and encoders: writes synthetic images
+# in every format that iio can both write and read, and times
+#    iio_read_image_float_vec   (the C decoder alone)
+#    read_buffer                (+ copy to a ctypes buffer)
+#    read_tiled_buffers         (+ minmax and the 1024x1024 tiles of pvflip)
+#    write_buffer
+# for several sizes and channel counts. Throughputs are given in MB/s of
+# decoded float samples (w*h*nch*4 bytes), the peak RSS of each case is
+# measured in a forked process.
+#
+#    > ./benchmark_piio.py --sizes 0.25,1,4 --formats png,pfm --json piio.json
+#
+
+from __future__ import print_function
+from __future__ import division
+
+import os
+import sys
+import time
+import ctypes
+
+import piio
+from piio import libiio
+
+
+# name: (file suffix, sample type, channel counts, library needed)
+FORMATS = [
+   ('png',     '.png', ctypes.c_uint8,  (1,2,3,4), 'png_create_read_struct'),
+   ('tiff8',   '.tif', ctypes.c_uint8,  (1,2,3,4), 'TIFFOpen'),
+   ('tiff16',  '.tif', ctypes.c_uint16, (1,2,3,4), 'TIFFOpen'),
+   ('tiff32f', '.tif', ctypes.c_float,  (1,2,3,4), 'TIFFOpen'),
+   ('pfm',     '.pfm', ctypes.c_float,  (1,3),     None),
+   ('flo',     '.flo', ctypes.c_float,  (2,),      None),
+   ('ppm',     '.ppm', ctypes.c_float,  (1,3),     None),
+   ('csv',     '.csv', ctypes.c_float,  (1,),      None),
+   ('asc',     '.asc', ctypes.c_float,  (1,2,3,4), None),
+   ('rim',     '.mw',  ctypes.c_float,  (1,),      None),
+]
+
+
+# the bits of each sample replaced by noise, in the order of the memory
+NOISE_MASKS = { ctypes.c_uint8: b'\x0f', ctypes.c_uint16: b'\xff\x00',
+                ctypes.c_float: b'\xff\x0f\x00\x00' }
+
+def add_noise(data, sample_type, seed=0):
+   ''' xors the low bits of each sample of the ctypes array data (the low
+       4 bits of bytes, 8 of uint16, 12 of the mantissa of floats) with
+       seeded pseudo-random bits, one chunk at a time '''
+   import random, binascii
+   mask = NOISE_MASKS[sample_type]
+   if sys.byteorder == 'big':
+      mask = mask[::-1]
+   if hasattr(int, 'from_bytes'):
+      from_bytes = lambda b: int.from_bytes(b, 'big')
+      to_bytes = lambda x, k: x.to_bytes(k, 'big')
+   else:   # python 2
+      from_bytes = lambda b: int(binascii.hexlify(b), 16)
+      to_bytes = lambda x, k: binascii.unhexlify('%0*x'%(2*k, x))
+   rng = random.Random(seed)
+   nbytes, chunk = ctypes.sizeof(data), 1 << 20
+   bits = from_bytes(mask*(chunk//len(mask)))
+   for start in range(0, nbytes, chunk):
+      k = min(chunk, nbytes - start)
+      address = ctypes.addressof(data) + start
+      value = from_bytes(ctypes.string_at(address, k))
+      value ^= rng.getrandbits(8*k) & (bits >> 8*(chunk - k))
+      ctypes.memmove(address, to_bytes(value, k), k)
+
+
+def synthetic_buffer(w, h, nch, sample_type):
+   ''' ctypes array with a diagonal ramp plus seeded noise, so that the
+       compressed formats don't shrink it to nothing, floats have a 
+       fractional part so that iio doesn't store them as bytes '''
+   n = w*nch
+   if sample_type == ctypes.c_float:
+      row = [((i//nch)*nch + i*37) % 256 + 0.25 for i in range(2*n)]
+   elif sample_type == ctypes.c_uint16:
+      row = [((i//nch)*nch + i*37)*251 % 65536 for i in range(2*n)]
+   else:
+      row = [((i//nch)*nch + i*37) % 256 for i in range(2*n)]
+   row = (sample_type*(2*n))(*row)
+   data = (sample_type*(n*h))()
+   itemsize = ctypes.sizeof(sample_type)
+   for y in range(h):
+      # each row is the previous one shifted by one pixel
+      ctypes.memmove(ctypes.addressof(data) + y*n*itemsize,
+                     ctypes.addressof(row) + (y % w)*nch*itemsize, n*itemsize)
+   add_noise(data, sample_type)
+   return data
+
+
+def read_float_vec(filename):
+   ''' the bare decoder call '''
+   w, h, nch = ctypes.c_int(), ctypes.c_int(), ctypes.c_int()
+   libiio.iio_read_image_float_vec.restype = ctypes.c_void_p
+   ptr = libiio.iio_read_image_float_vec(filename.encode('ascii'), ctypes.byref(w),
+                                         ctypes.byref(h), ctypes.byref(nch))
+   if not ptr:
+      raise IOError('PIIO: the file %s cannot be read'%filename)
+   libiio.freemem(ctypes.c_void_p(ptr))
+
+
+def best_time(f, repeat):
+   ''' minimum over repeat runs '''
+   best = float('inf')
+   for i in range(repeat):
+      t0 = time.time()
+      f()
+      best = min(best, time.time() - t0)
+   return best
+
+
+def peak_rss_MB():
+   import resource
+   rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+   # kilobytes on linux, bytes on mac
+   return rss/(1e6 if sys.platform == 'darwin' else 1e3)
+
+
+def benchmark_case(filename, data, w, h, nch, repeat):
+   result = {}
+   result['write_s'] = best_time(lambda: piio.write_buffer(filename, data, w, h, nch), repeat)
+   result['file_MB'] = os.path.getsize(filename)/1e6
+   for name, f in (('iio_read_image_float_vec', read_float_vec),
+                   ('read_buffer', piio.read_buffer),
+                   ('read_tiled_buffers', piio.read_tiled_buffers)):
+      result[name+'_s'] = best_time(lambda: f(filename), repeat)
+   result['peak_rss_MB'] = peak_rss_MB()
+   return result
+
+
+def run_isolated(f):
+   ''' runs f in a forked process (for its peak RSS), returns its result '''
+   import json
+   if not hasattr(os, 'fork'):
+      return f()
+   r, wr = os.pipe()
+   pid = os.fork()
+   if pid == 0:
+      os.close(r)
+      try:
+         out = json.dumps(f())
+      except Exception as e:
+         out = json.dumps({'error': str(e)})
+      os.write(wr, out.encode('ascii'))
+      os._exit(0)
+   os.close(wr)
+   chunks = []
+   while True:
+      chunk = os.read(r, 65536)
+      if not chunk:
+         break
+      chunks.append(chunk)
+   os.close(r)
+   os.waitpid(pid, 0)
+   if not chunks:
+      return {'error': 'the benchmark process died'}
+   return json.loads(b''.join(chunks).decode('ascii'))
+
+
+def main():
+   import argparse, json, tempfile, shutil, platform
+   names = [f[0] for f in FORMATS]
+   parser = argparse.ArgumentParser(description='iio decoder benchmark')
+   parser.add_argument('--sizes', default='0.25,1,4',
+         help='image sizes in megapixels, comma separated (default 0.25,1,4)')
+   parser.add_argument('--channels', default='1,2,3,4', help='default 1,2,3,4')
+   parser.add_argument('--formats', default=','.join(names), help='default %s'%','.join(names))
+   parser.add_argument('--repeat', type=int, default=3,
+         help='each timing is the best of REPEAT runs (default 3)')
+   parser.add_argument('--tmpdir', default=None, help='where the synthetic images are written')
+   parser.add_argument('--json', default=None, help='write the results to this file')
+   args = parser.parse_args()
+
+   report = { 'python': platform.python_version(), 'platform': platform.platform(),
+              'repeat': args.repeat, 'baseline_rss_MB': peak_rss_MB(), 'cases': [] }
+   print('%-8s %6s %3s %8s %8s %8s %8s %8s %8s'%('format', 'MP', 'nch', 'file MB',
+         'vec MB/s', 'buf MB/s', 'tile MB/s', 'wr MB/s', 'peak MB'))
+
+   tmpdir = tempfile.mkdtemp(dir=args.tmpdir, prefix='piio-bench-')
+   try:
+      for fmt, suffix, sample_type, channels, symbol in FORMATS:
+         if fmt not in args.formats.split(','):
+            continue
+         if symbol and not hasattr(libiio, symbol):
+            print('%-8s not available in this build of iio'%fmt)
+            continue
+         for mp in [float(x) for x in args.sizes.split(',')]:
+            w = h = int(round((mp*1e6)**0.5))
+            for nch in [int(x) for x in args.channels.split(',')]:
+               if nch not in channels:
+                  continue
+               filename = os.path.join(tmpdir, 'im' + suffix)
+               r = run_isolated(lambda: benchmark_case(filename,
+                     synthetic_buffer(w, h, nch, sample_type), w, h, nch, args.repeat))
+               if os.path.exists(filename):
+                  os.remove(filename)
+               r.update({'format': fmt, 'megapixels': mp, 'w': w, 'h': h, 'channels': nch})
+               report['cases'].append(r)
+               if 'error' in r:
+                  print('%-8s %6g %3d  error: %s'%(fmt, mp, nch, r['error']))
+                  continue
+               MB = w*h*nch*4/1e6
+               for name in ('iio_read_image_float_vec', 'read_buffer', 'read_tiled_buffers', 'write'):
+                  r[name+'_MBps'] = MB/max(r[name+'_s'], 1e-9)
+               print('%-8s %6g %3d %8.2f %8.1f %8.1f %8.1f %8.1f %8.1f'%(fmt, mp, nch, r['file_MB'],
+                     r['iio_read_image_float_vec_MBps'], r['read_buffer_MBps'],
+                     r['read_tiled_buffers_MBps'], r['write_MBps'], r['peak_rss_MB']))
+   finally:
+      shutil.rmtree(tmpdir)
+
+   if args.json:
+      with open(args.json, 'w') as f:
+         json.dump(report, f, indent=1, sort_keys=True)
+         f.write('\n')
+      print('results written to %s'%args.json)
+
+
+if __name__ == '__main__': main()
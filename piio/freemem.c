@@ -2,6 +2,7 @@
 #include <stdlib.h>
 #include <math.h>
 #include <stdint.h>
+#include <string.h>
 
 void freemem(void *ptr){
    free(ptr);
@@ -37,6 +38,19 @@ void copy_tile(float *src, int nc, int nr, int nch, float *dst, int x0, int y0,
    }
 }
 
+// samples of size 1 (uint8), 2 (uint16) or 4 (float) bytes to floats,
+// swap reverses the bytes of each sample (used by piio.read_frame)
+void convert_samples(const uint8_t *src, size_t n, int size, int swap, float *dst) {
+   for (size_t i = 0; i < n; i++) {
+      uint8_t b[4];
+      for (int k = 0; k < size; k++)
+         b[k] = src[i*size + (swap ? size - 1 - k : k)];
+      if (size == 4) { float t; memcpy(&t, b, 4); dst[i] = t; }
+      else if (size == 2) { uint16_t t; memcpy(&t, b, 2); dst[i] = t; }
+      else dst[i] = b[0];
+   }
+}
+
 #define swap_uint8(x,y) {uint8_t t = x; x = y; y = t;}
 // OpenGL screen buffers are bottom-to-top, files are top-to-bottom
 void reverse_vertically_uint8_buffer_inplace(uint8_t *buff, int w, int h, int nch) {
@@ -46,3 +60,232 @@ void reverse_vertically_uint8_buffer_inplace(uint8_t *buff, int w, int h, int nc
       swap_uint8(buff[nch*(i + (h-j-1)*w)+c] ,  buff[nch*(i + j*w)+c]);
    }
 }
+
+
+// REGION STATISTICS
+//
+// A tile of w x h pixels is summarized by blocks of bs x bs pixels:
+// integral images of the block sums, sums of squares and number of finite
+// values (each of size (bw+1)*(bh+1)*nch, with bw = ceil(w/bs), bh = ceil(h/bs))
+// and the min/max of each block (bw*bh*nch).
+// Then the statistics of any rectangle are computed from the integral
+// images for the blocks that it covers completely, and from the pixels only
+// for the partially covered blocks along its border.
+
+void tile_block_stats(float *tile, int w, int h, int nch, int bs,
+      double *isum, double *isum2, int *icount, float *bmin, float *bmax) {
+   int bw = (w + bs - 1) / bs;
+   int bh = (h + bs - 1) / bs;
+   int iw = bw + 1;
+
+   for (int i = 0; i < iw*(bh+1)*nch; i++) {
+      isum[i] = isum2[i] = 0;
+      icount[i] = 0;
+   }
+
+   for (int by = 0; by < bh; by++)
+   for (int bx = 0; bx < bw; bx++)
+   for (int c = 0; c < nch; c++) {
+      double s = 0, s2 = 0;
+      int n = 0;
+      float imin = +INFINITY, imax = -INFINITY;
+      for (int j = by*bs; j < (by+1)*bs && j < h; j++)
+      for (int i = bx*bs; i < (bx+1)*bs && i < w; i++) {
+         float v = tile[(i + j*w)*nch + c];
+         if (isfinite(v)) {
+            s += v; s2 += (double) v * v; n++;
+            imin = fmin(imin, v);
+            imax = fmax(imax, v);
+         }
+      }
+      bmin[(bx + by*bw)*nch + c] = imin;
+      bmax[(bx + by*bw)*nch + c] = imax;
+
+      // integral image: I(bx+1,by+1) = block + I(bx,by+1) + I(bx+1,by) - I(bx,by)
+      int o  = ((bx+1) + (by+1)*iw)*nch + c;
+      int ol = ((bx  ) + (by+1)*iw)*nch + c;
+      int ou = ((bx+1) + (by  )*iw)*nch + c;
+      int oul= ((bx  ) + (by  )*iw)*nch + c;
+      isum[o]   = s  + isum[ol]   + isum[ou]   - isum[oul];
+      isum2[o]  = s2 + isum2[ol]  + isum2[ou]  - isum2[oul];
+      icount[o] = n  + icount[ol] + icount[ou] - icount[oul];
+   }
+}
+
+static void accumulate_pixels(float *tile, int w, int nch,
+      int x0, int y0, int x1, int y1,
+      double *sum, double *sum2, double *count, float *vmin, float *vmax) {
+   for (int j = y0; j < y1; j++)
+   for (int i = x0; i < x1; i++)
+   for (int c = 0; c < nch; c++) {
+      float v = tile[(i + j*w)*nch + c];
+      if (isfinite(v)) {
+         sum[c] += v; sum2[c] += (double) v * v; count[c] += 1;
+         vmin[c] = fmin(vmin[c], v);
+         vmax[c] = fmax(vmax[c], v);
+      }
+   }
+}
+
+// accumulates the statistics of the rectangle [x0,x1) x [y0,y1) (in tile
+// coordinates) into sum, sum2, count (of the finite values), vmin and vmax
+void tile_region_stats(float *tile, int w, int h, int nch, int bs,
+      double *isum, double *isum2, int *icount, float *bmin, float *bmax,
+      int x0, int y0, int x1, int y1,
+      double *sum, double *sum2, double *count, float *vmin, float *vmax) {
+   int bw = (w + bs - 1) / bs;
+   int iw = bw + 1;
+
+   // range of the completely covered blocks
+   int bx0 = (x0 + bs - 1) / bs, bx1 = x1 == w ? bw : x1 / bs;
+   int by0 = (y0 + bs - 1) / bs, by1 = y1 == h ? (h + bs - 1) / bs : y1 / bs;
+
+   if (bx0 >= bx1 || by0 >= by1) {
+      accumulate_pixels(tile, w, nch, x0, y0, x1, y1, sum, sum2, count, vmin, vmax);
+      return;
+   }
+
+   for (int c = 0; c < nch; c++) {
+#define II(a,x,y) a[((x) + (y)*iw)*nch + c]
+      sum[c]   += II(isum,  bx1,by1) - II(isum,  bx0,by1) - II(isum,  bx1,by0) + II(isum,  bx0,by0);
+      sum2[c]  += II(isum2, bx1,by1) - II(isum2, bx0,by1) - II(isum2, bx1,by0) + II(isum2, bx0,by0);
+      count[c] += II(icount,bx1,by1) - II(icount,bx0,by1) - II(icount,bx1,by0) + II(icount,bx0,by0);
+#undef II
+      for (int by = by0; by < by1; by++)
+      for (int bx = bx0; bx < bx1; bx++) {
+         vmin[c] = fmin(vmin[c], bmin[(bx + by*bw)*nch + c]);
+         vmax[c] = fmax(vmax[c], bmax[(bx + by*bw)*nch + c]);
+      }
+   }
+
+   // the pixels around the covered blocks
+   int X0 = bx0*bs, X1 = bx1*bs < w ? bx1*bs : w;
+   int Y0 = by0*bs, Y1 = by1*bs < h ? by1*bs : h;
+   accumulate_pixels(tile, w, nch, x0, y0, x1, Y0, sum, sum2, count, vmin, vmax);
+   accumulate_pixels(tile, w, nch, x0, Y1, x1, y1, sum, sum2, count, vmin, vmax);
+   accumulate_pixels(tile, w, nch, x0, Y0, X0, Y1, sum, sum2, count, vmin, vmax);
+   accumulate_pixels(tile, w, nch, X1, Y0, x1, Y1, sum, sum2, count, vmin, vmax);
+}
+
+// accumulates into hist (nbins per channel) the finite values of the
+// rectangle [x0,x1) x [y0,y1), the bins split the range [lo,hi]
+void tile_region_histogram(float *tile, int w, int h, int nch,
+      int x0, int y0, int x1, int y1, float lo, float hi, int nbins, double *hist) {
+   float scale = hi > lo ? nbins / (hi - lo) : 0;
+   for (int j = y0; j < y1; j++)
+   for (int i = x0; i < x1; i++)
+   for (int c = 0; c < nch; c++) {
+      float v = tile[(i + j*w)*nch + c];
+      if (isfinite(v)) {
+         int b = (int) ((v - lo) * scale);
+         if (b < 0) b = 0;
+         if (b >= nbins) b = nbins - 1;
+         hist[c*nbins + b] += 1;
+      }
+   }
+}
+
+
+// PREVIEWS
+//
+// Low resolution copies of an image, made by keeping one pixel out of 
+// step x step (the center of each block). decimate_image works on a decoded
+// image, read_preview_strips reads only the needed rows of an uncompressed 
+// PFM or binary PGM/PPM file.
+
+void decimate_image(float *src, int w, int h, int nch, float *dst, int step, int dst_nch) {
+   int pw = (w + step - 1) / step;
+   int ph = (h + step - 1) / step;
+   for (int j = 0; j < ph; j++) {
+      int jj = j*step + step/2 < h ? j*step + step/2 : h - 1;
+      for (int i = 0; i < pw; i++) {
+         int ii = i*step + step/2 < w ? i*step + step/2 : w - 1;
+         for (int c = 0; c < dst_nch; c++)
+            dst[(i + j*pw)*dst_nch + c] = c < nch ? src[(ii + jj*w)*nch + c] : 0;
+      }
+   }
+}
+
+// reads the next number of a PNM header, skipping the # comments
+static int pnm_header_number(FILE *f, double *x) {
+   int c;
+   while ((c = fgetc(f)) != EOF) {
+      if (c == '#')
+         while ((c = fgetc(f)) != EOF && c != '\n');
+      else if (c != ' ' && c != '\t' && c != '\r' && c != '\n') {
+         ungetc(c, f);
+         return fscanf(f, "%lf", x) == 1;
+      }
+   }
+   return 0;
+}
+
+// returns a malloc'ed preview of at most max_size x max_size pixels, or NULL
+// if the file is not an uncompressed PFM/PGM/PPM. full_w, full_h: image size
+float *read_preview_strips(const char *filename, int max_size, int *w, int *h,
+      int *nch, int *full_w, int *full_h) {
+   FILE *f = fopen(filename, "rb");
+   if (!f) return NULL;
+
+   char magic[2];
+   double W, H, maxval;
+   int pd, bytes, pfm;
+   if (fread(magic, 1, 2, f) != 2 || magic[0] != 'P' ||
+         !pnm_header_number(f, &W) || !pnm_header_number(f, &H) ||
+         !pnm_header_number(f, &maxval) || W < 1 || H < 1) {
+      fclose(f);
+      return NULL;
+   }
+   switch (magic[1]) {
+      case 'f': pd = 1; pfm = 1; break;
+      case 'F': pd = 3; pfm = 1; break;
+      case '5': pd = 1; pfm = 0; break;
+      case '6': pd = 3; pfm = 0; break;
+      default: fclose(f); return NULL;
+   }
+   bytes = pfm ? 4 : (maxval < 256 ? 1 : 2);
+   fgetc(f);     // the single whitespace before the data
+   long offset = ftell(f);
+
+   int iw = W, ih = H;
+   int step = 1;
+   while ((iw + step - 1) / step > max_size || (ih + step - 1) / step > max_size)
+      step++;
+   int pw = (iw + step - 1) / step;
+   int ph = (ih + step - 1) / step;
+   size_t row_bytes = (size_t) iw * pd * bytes;
+   unsigned char *row = malloc(row_bytes);
+   float *out = malloc((size_t) pw * ph * pd * sizeof(float));
+   // as iio reads them: PFM in the native byte order and from top to 
+   // bottom (the scale is ignored), 16 bit PNM in big endian
+   uint16_t one = 1;
+   int swap = !pfm && *(uint8_t *) &one;
+
+   for (int j = 0; j < ph; j++) {
+      int jj = j*step + step/2 < ih ? j*step + step/2 : ih - 1;
+      if (fseek(f, offset + (long) (jj * row_bytes), SEEK_SET) ||
+            fread(row, 1, row_bytes, f) != row_bytes) {
+         free(row); free(out); fclose(f);
+         return NULL;
+      }
+      for (int i = 0; i < pw; i++) {
+         int ii = i*step + step/2 < iw ? i*step + step/2 : iw - 1;
+         for (int c = 0; c < pd; c++) {
+            unsigned char *p = row + ((size_t) ii * pd + c) * bytes;
+            unsigned char b[4];
+            for (int k = 0; k < bytes; k++)
+               b[k] = p[swap && bytes > 1 ? bytes - 1 - k : k];
+            float v;
+            if (bytes == 4) { float t; memcpy(&t, b, 4); v = t; }
+            else if (bytes == 2) { uint16_t t; memcpy(&t, b, 2); v = t; }
+            else v = b[0];
+            out[(i + j*pw)*pd + c] = v;
+         }
+      }
+   }
+   free(row);
+   fclose(f);
+   *w = pw; *h = ph; *nch = pd;
+   *full_w = iw; *full_h = ih;
+   return out;
+}
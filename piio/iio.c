@@ -1104,22 +1104,21 @@ static void iio_hacky_uncolorizea(struct iio_image *x)
 // Implementation: re-invent the wheel
 static void *load_rest_of_file(long *on, FILE *f, void *buf, size_t bufn)
 {
-	size_t n = bufn, ntop = n + 0x3000;
+	// read by blocks into a buffer that doubles its size when it is full
+	size_t n = bufn, ntop = n + 0x10000;
 	char *t =  xmalloc(ntop);
 	if (!t) fail("out of mem (%zu) while loading file", ntop);
 	memcpy(t, buf, bufn);
 	while (1) {
 		if (n >= ntop) {
-			ntop = 1000 + 2*(ntop + 1);
+			ntop = 2*ntop;
 			t = xrealloc(t, ntop);
 			if (!t) fail("out of mem (%zu) loading file", ntop);
-
 		}
-		int r = fgetc(f);
-		if (r == EOF)
+		size_t r = fread(t + n, 1, ntop - n, f);
+		n += r;
+		if (n < ntop) // end of file (or error)
 			break;
-		t[n] = r;//iw810
-		n += 1;
 	}
 	*on = n;
 	return t;
@@ -1428,6 +1427,119 @@ static int read_beheaded_jpeg(struct iio_image *x,
 
 	return 0;
 }
+
+// Reduced JPEG decoding: libjpeg decodes at 1/2, 1/4 or 1/8 of the size by
+// using only the low frequencies of each DCT block, which is much faster
+// than decoding the whole image.  These functions are not part of the iio
+// interface (they are used by piio) and they don't use the global jump
+// buffer, so that they can run while another thread reads an image.
+
+#include <setjmp.h>
+
+struct jpeg_scaled_error {
+	struct jpeg_error_mgr pub;
+	jmp_buf jump;
+};
+
+static void on_jpeg_scaled_error(j_common_ptr cinfo)
+{
+	struct jpeg_scaled_error *e = (struct jpeg_scaled_error *)cinfo->err;
+	(*cinfo->err->output_message)(cinfo);
+	longjmp(e->jump, 1);
+}
+
+// if denom is 0 only the header is read, if it is -min_size the largest
+// reduction that keeps the longest side above min_size is used.  Returns 0
+// if f is not a readable JPEG stream
+static int jpeg_scaled(FILE *f, int denom, float **out,
+		int *w, int *h, int *pd, int *full_w, int *full_h)
+{
+	unsigned char magic[2];
+	if (2 != fread(magic, 1, 2, f) || magic[0] != 0xff || magic[1] != 0xd8)
+		return 0;
+	rewind(f);
+
+	struct jpeg_decompress_struct cinfo[1];
+	struct jpeg_scaled_error jerr[1];
+	float *volatile data = NULL;
+	unsigned char *volatile row = NULL;
+	cinfo->err = jpeg_std_error(&jerr->pub);
+	jerr->pub.error_exit = on_jpeg_scaled_error;
+	if (setjmp(jerr->jump)) {
+		// corrupt or truncated file, or not enough memory
+		jpeg_destroy_decompress(cinfo);
+		free(row);
+		free(data);
+		return 0;
+	}
+	jpeg_create_decompress(cinfo);
+	jpeg_stdio_src(cinfo, f);
+	jpeg_read_header(cinfo, 1);
+	*full_w = cinfo->image_width;
+	*full_h = cinfo->image_height;
+
+	// a copy: the arguments live across setjmp must not be modified
+	int scale = denom;
+	if (scale < 0) {
+		int min_size = -denom;
+		int side = *full_w > *full_h ? *full_w : *full_h;
+		scale = 8;
+		while (scale > 1 && (side + scale - 1) / scale < min_size)
+			scale /= 2;
+	}
+	if (scale > 0) {
+		cinfo->scale_num = 1;
+		cinfo->scale_denom = scale;
+		jpeg_start_decompress(cinfo);
+		int ow = cinfo->output_width;
+		int oh = cinfo->output_height;
+		int nc = cinfo->output_components;
+		row = malloc((size_t)ow * nc);
+		data = malloc((size_t)ow * oh * nc * sizeof(float));
+		if (!row || !data)
+			longjmp(jerr->jump, 1);
+		for (int j = 0; j < oh; j++) {
+			JSAMPROW scanline[1] = { row };
+			if (1 != jpeg_read_scanlines(cinfo, scanline, 1))
+				longjmp(jerr->jump, 1);
+			float *o = data + (size_t)j * ow * nc;
+			for (int i = 0; i < ow * nc; i++)
+				o[i] = row[i];
+		}
+		jpeg_finish_decompress(cinfo);
+		*w = ow;
+		*h = oh;
+		*pd = nc;
+		*out = data;
+	}
+	jpeg_destroy_decompress(cinfo);
+	free(row);
+	return 1;
+}
+
+// size of a JPEG image from its header, returns 0 if it is not a JPEG file
+int jpeg_image_size(const char *fname, int *w, int *h)
+{
+	FILE *f = fopen(fname, "rb");
+	if (!f) return 0;
+	int r = jpeg_scaled(f, 0, NULL, NULL, NULL, NULL, w, h);
+	fclose(f);
+	return r;
+}
+
+// the JPEG image decoded at 1/denom of its size (denom is 1, 2, 4 or 8) as
+// interleaved floats, or NULL.  full_w, full_h: size of the whole image
+float *read_jpeg_scaled(const char *fname, int denom, int *w, int *h, int *pd,
+		int *full_w, int *full_h)
+{
+	float *data = NULL;
+	if (denom < 1) return NULL;
+	FILE *f = fopen(fname, "rb");
+	if (!f) return NULL;
+	int r = jpeg_scaled(f, denom, &data, w, h, pd, full_w, full_h);
+	fclose(f);
+	return r ? data : NULL;
+}
 #endif//I_CAN_HAS_LIBJPEG
 
 // TIFF reader                                                              {{{2
@@ -1460,15 +1572,11 @@ static TIFF *tiffopen_fancy(const char *filename, char *mode)
 	return tif;
 }
 
-static int read_whole_tiff(struct iio_image *x, const char *filename)
+// reads the current directory of tif, and closes it
+static int read_tiff(struct iio_image *x, TIFF *tif)
 {
 	// tries to read data in the correct format (via scanlines)
 	// if it fails, it tries to read ABGR data
-	TIFFSetWarningHandler(NULL);//suppress warnings
-
-	//fprintf(stderr, "TIFFOpen \"%s\"\n", filename);
-	TIFF *tif = tiffopen_fancy(filename, "rm");
-	if (!tif) fail("could not open TIFF file \"%s\"", filename);
 	uint32_t w, h;
 	uint16_t spp, bps, fmt;
 	int r = 0, fmt_iio=-1;
@@ -1660,10 +1768,75 @@ static int read_whole_tiff(struct iio_image *x, const char *filename)
 	return 0;
 }
 
-// Note: TIFF library only reads from a named file.  The only way to use the
-// library if you have your image in a stream, is to write the data to a
-// temporary file, and read it from there.  This can be optimized in the future
-// by recovering the original filename through hacks, in case it was not a pipe.
+static int read_whole_tiff(struct iio_image *x, const char *filename)
+{
+	TIFFSetWarningHandler(NULL);//suppress warnings
+
+	//fprintf(stderr, "TIFFOpen \"%s\"\n", filename);
+	TIFF *tif = tiffopen_fancy(filename, "rm");
+	if (!tif) fail("could not open TIFF file \"%s\"", filename);
+	return read_tiff(x, tif);
+}
+
+// a TIFF file in memory, read by libtiff through the following procedures
+struct tiff_memory {
+	unsigned char *data;
+	toff_t size, pos;
+};
+
+static tsize_t tiff_memory_read(thandle_t h, tdata_t buf, tsize_t n)
+{
+	struct tiff_memory *m = (struct tiff_memory *)h;
+	if (m->pos >= m->size) return 0;
+	if ((toff_t)n > m->size - m->pos) n = m->size - m->pos;
+	memcpy(buf, m->data + m->pos, n);
+	m->pos += n;
+	return n;
+}
+
+static tsize_t tiff_memory_write(thandle_t h, tdata_t buf, tsize_t n)
+{
+	(void)h; (void)buf; (void)n;
+	return -1;
+}
+
+static toff_t tiff_memory_seek(thandle_t h, toff_t off, int whence)
+{
+	struct tiff_memory *m = (struct tiff_memory *)h;
+	switch (whence) {
+	case SEEK_SET: m->pos = off; break;
+	case SEEK_CUR: m->pos += off; break;
+	case SEEK_END: m->pos = m->size + off; break;
+	}
+	return m->pos;
+}
+
+static int tiff_memory_close(thandle_t h)
+{
+	(void)h;
+	return 0;
+}
+
+static toff_t tiff_memory_size(thandle_t h)
+{
+	return ((struct tiff_memory *)h)->size;
+}
+
+static int tiff_memory_map(thandle_t h, tdata_t *base, toff_t *size)
+{
+	struct tiff_memory *m = (struct tiff_memory *)h;
+	*base = m->data;
+	*size = m->size;
+	return 1;
+}
+
+static void tiff_memory_unmap(thandle_t h, tdata_t base, toff_t size)
+{
+	(void)h; (void)base; (void)size;
+}
+
+// Note: a TIFF coming from a stream (a pipe) is loaded in memory and
+// decoded from there with TIFFClientOpen, without a temporary file.
 static int read_beheaded_tiff(struct iio_image *x,
 		FILE *fin, char *header, int nheader)
 {
@@ -1676,15 +1849,212 @@ static int read_beheaded_tiff(struct iio_image *x,
 
 	long filesize;
 	void *filedata = load_rest_of_file(&filesize, fin, header, nheader);
-	char *filename = put_data_into_temporary_file(filedata, filesize);
+	struct tiff_memory m = { filedata, filesize, 0 };
+
+	TIFFSetWarningHandler(NULL);//suppress warnings
+	TIFF *tif = TIFFClientOpen("stream", "r", (thandle_t)&m,
+			tiff_memory_read, tiff_memory_write, tiff_memory_seek,
+			tiff_memory_close, tiff_memory_size,
+			tiff_memory_map, tiff_memory_unmap);
+	if (!tif) fail("could not read the TIFF data");
+	int r = read_tiff(x, tif);
+	if (r) fail("read tiff returned %d", r);
 	xfree(filedata);
 
-	int r = read_whole_tiff(x, filename);
-	if (r) fail("read whole tiff returned %d", r);
+	return 0;
+}
 
-	delete_temporary_file(filename);
+// TIFF preview: the rows of a low resolution copy of the image are sampled
+// from the strips (or rows of tiles) that contain them, the others are not
+// decoded, or from the smallest reduced resolution directory (overview) that
+// is large enough.  Like read_jpeg_scaled, it is used by piio and it doesn't
+// fail() on errors, so that it can run while another thread reads an image.
 
-	return 0;
+// sample c of the pixel i of a decoded row
+static float tiff_preview_sample(const unsigned char *row, int i, int spp,
+		int c, int bps, int fmt)
+{
+	const unsigned char *p = row + ((size_t)i * spp + c) * (bps / 8);
+	if (fmt == SAMPLEFORMAT_IEEEFP) {
+		if (bps == 32) { float t; memcpy(&t, p, 4); return t; }
+		double t; memcpy(&t, p, 8); return t;
+	}
+	if (fmt == SAMPLEFORMAT_INT) switch (bps) {
+	case 8: return *(const int8_t *)p;
+	case 16: { int16_t t; memcpy(&t, p, 2); return t; }
+	default: { int32_t t; memcpy(&t, p, 4); return t; }
+	}
+	switch (bps) {
+	case 8: return *p;
+	case 16: { uint16_t t; memcpy(&t, p, 2); return t; }
+	default: { uint32_t t; memcpy(&t, p, 4); return t; }
+	}
+}
+
+// samples the current directory of tif every step pixels, so that the
+// preview has at most max_size pixels on each side.  Returns NULL if the
+// layout of the samples is not supported or on errors
+static float *tiff_preview_sampled(TIFF *tif, int max_size,
+		int *w, int *h, int *pd)
+{
+	uint32_t iw = 0, ih = 0, tw = 0, th = 0, rps = 0;
+	uint16_t spp, bps, fmt, planar, photo = PHOTOMETRIC_MINISBLACK;
+	TIFFGetField(tif, TIFFTAG_IMAGEWIDTH, &iw);
+	TIFFGetField(tif, TIFFTAG_IMAGELENGTH, &ih);
+	TIFFGetFieldDefaulted(tif, TIFFTAG_SAMPLESPERPIXEL, &spp);
+	TIFFGetFieldDefaulted(tif, TIFFTAG_BITSPERSAMPLE, &bps);
+	TIFFGetFieldDefaulted(tif, TIFFTAG_SAMPLEFORMAT, &fmt);
+	TIFFGetFieldDefaulted(tif, TIFFTAG_PLANARCONFIG, &planar);
+	TIFFGetField(tif, TIFFTAG_PHOTOMETRIC, &photo);
+	int ok_format = fmt == SAMPLEFORMAT_IEEEFP ? bps == 32 || bps == 64 :
+		(fmt == SAMPLEFORMAT_UINT || fmt == SAMPLEFORMAT_INT) &&
+		(bps == 8 || bps == 16 || bps == 32);
+	if (!iw || !ih || !ok_format || (spp > 1 && planar != PLANARCONFIG_CONTIG)
+			|| photo == PHOTOMETRIC_PALETTE || photo == PHOTOMETRIC_YCBCR)
+		return NULL;
+
+	int tiled = TIFFIsTiled(tif);
+	size_t pixel_bytes = (size_t)spp * (bps / 8);
+	size_t row_bytes, buf_bytes;
+	unsigned char *buf, *band = NULL;
+	if (tiled) {
+		// a band of the rows of a row of tiles
+		TIFFGetField(tif, TIFFTAG_TILEWIDTH, &tw);
+		TIFFGetField(tif, TIFFTAG_TILELENGTH, &th);
+		if (!tw || !th) return NULL;
+		row_bytes = (size_t)(iw + tw - 1) / tw * tw * pixel_bytes;
+		buf_bytes = TIFFTileSize(tif);
+		band = malloc(row_bytes * th);
+	} else {
+		TIFFGetFieldDefaulted(tif, TIFFTAG_ROWSPERSTRIP, &rps);
+		if (rps > ih) rps = ih;
+		row_bytes = TIFFScanlineSize(tif);
+		buf_bytes = TIFFStripSize(tif);
+	}
+	buf = malloc(buf_bytes);
+
+	int step = (iw + max_size - 1) / max_size;
+	if (step < (int)((ih + max_size - 1) / max_size))
+		step = (ih + max_size - 1) / max_size;
+	int pw = (iw + step - 1) / step;
+	int ph = (ih + step - 1) / step;
+	float *out = malloc((size_t)pw * ph * spp * sizeof(float));
+	if (!buf || !out || (tiled && !band)) goto fail;
+
+	int64_t cached = -1;   // the strip, or the row of tiles, in buf/band
+	for (int j = 0; j < ph; j++) {
+		uint32_t jj = j*step + step/2 < (int)ih ? j*step + step/2 : (int)ih - 1;
+		unsigned char *row;
+		if (tiled) {
+			uint32_t y0 = jj / th * th;
+			if (cached != y0) {
+				size_t tile_row = (size_t)tw * pixel_bytes;
+				for (uint32_t x0 = 0; x0 < iw; x0 += tw) {
+					uint32_t t = TIFFComputeTile(tif, x0, y0, 0, 0);
+					if (TIFFReadEncodedTile(tif, t, buf, buf_bytes) < 0)
+						goto fail;
+					for (uint32_t k = 0; k < th; k++)
+						memcpy(band + k*row_bytes + x0*pixel_bytes,
+							buf + k*tile_row, tile_row);
+				}
+				cached = y0;
+			}
+			row = band + (jj - y0) * row_bytes;
+		} else {
+			uint32_t s = TIFFComputeStrip(tif, jj, 0);
+			if (cached != s) {
+				if (TIFFReadEncodedStrip(tif, s, buf, buf_bytes) < 0)
+					goto fail;
+				cached = s;
+			}
+			row = buf + (jj - (size_t)s * rps) * row_bytes;
+		}
+		for (int i = 0; i < pw; i++) {
+			int ii = i*step + step/2 < (int)iw ? i*step + step/2 : (int)iw - 1;
+			for (int c = 0; c < spp; c++)
+				out[(i + j*pw)*spp + c] =
+					tiff_preview_sample(row, ii, spp, c, bps, fmt);
+		}
+	}
+	free(buf);
+	free(band);
+	*w = pw;
+	*h = ph;
+	*pd = spp;
+	return out;
+
+fail:
+	free(buf);
+	free(band);
+	free(out);
+	return NULL;
+}
+
+// goes to the smallest overview of the current image whose longest side is
+// at least min_size (the overviews are the reduced resolution directories
+// that follow it), returns 0 if there is none
+static int tiff_preview_overview(TIFF *tif, int min_size)
+{
+	tdir_t best = 0;
+	uint32_t best_side = 0;
+	while (TIFFReadDirectory(tif)) {
+		uint32_t type = 0, ow = 0, oh = 0;
+		TIFFGetField(tif, TIFFTAG_SUBFILETYPE, &type);
+		if (!(type & FILETYPE_REDUCEDIMAGE))
+			break;
+		TIFFGetField(tif, TIFFTAG_IMAGEWIDTH, &ow);
+		TIFFGetField(tif, TIFFTAG_IMAGELENGTH, &oh);
+		uint32_t side = ow > oh ? ow : oh;
+		if (side >= (uint32_t)min_size && (!best_side || side < best_side)) {
+			best = TIFFCurrentDirectory(tif);
+			best_side = side;
+		}
+	}
+	return best_side && TIFFSetDirectory(tif, best);
+}
+
+// returns a malloc'ed preview of at most max_size x max_size pixels of the
+// TIFF image, or NULL if the file is not a TIFF, if it has less than
+// min_pixels pixels or no more than max_size on each side, or if its samples
+// are not supported.  full_w, full_h: size of the image
+float *read_tiff_preview(const char *fname, int max_size, int min_pixels,
+		int *w, int *h, int *pd, int *full_w, int *full_h)
+{
+	// only the TIFF files, without the errors of libtiff on the others
+	unsigned char m[4];
+	FILE *f = fopen(fname, "rb");
+	if (!f) return NULL;
+	int n = fread(m, 1, 4, f);
+	fclose(f);
+	if (n != 4 || !((m[0] == 'I' && m[1] == 'I' && (m[2] == 42 || m[2] == 43)
+				&& m[3] == 0) ||
+			(m[0] == 'M' && m[1] == 'M' && m[2] == 0
+				&& (m[3] == 42 || m[3] == 43))))
+		return NULL;
+
+	TIFFSetWarningHandler(NULL);//suppress warnings
+	TIFF *tif = TIFFOpen(fname, "r");
+	if (!tif) return NULL;
+	uint32_t iw = 0, ih = 0;
+	TIFFGetField(tif, TIFFTAG_IMAGEWIDTH, &iw);
+	TIFFGetField(tif, TIFFTAG_IMAGELENGTH, &ih);
+	float *out = NULL;
+	if ((double)iw * ih >= min_pixels && (iw > (uint32_t)max_size
+				|| ih > (uint32_t)max_size)) {
+		tdir_t main = TIFFCurrentDirectory(tif);
+		if (tiff_preview_overview(tif, max_size)) {
+			out = tiff_preview_sampled(tif, max_size, w, h, pd);
+			if (!out)
+				TIFFSetDirectory(tif, main);
+		} else
+			TIFFSetDirectory(tif, main);
+		if (!out)
+			out = tiff_preview_sampled(tif, max_size, w, h, pd);
+	}
+	TIFFClose(tif);
+	*full_w = iw;
+	*full_h = ih;
+	return out;
 }
 
 #endif//I_CAN_HAS_LIBTIFF
@@ -2919,7 +3289,41 @@ static int read_beheaded_whatever(struct iio_image *x,
 #ifdef I_USE_LIBRAW
 int try_reading_file_with_libraw(const char *fname, struct iio_image *x);
 int try_reading_file_with_libraw_4channels(const char *fname, struct iio_image *x);
-#endif
+int try_reading_libraw_thumbnail(const char *fname, unsigned char **data,
+		int *size, int *is_jpeg, int *w, int *h, int *pd,
+		int *full_w, int *full_h);
+
+// the thumbnail embedded in a RAW file, read without unpacking the mosaic,
+// as interleaved floats (or NULL if there is none).  A JPEG thumbnail is
+// decoded at the largest reduction that keeps its longest side above
+// min_size.  full_w, full_h: size of the mosaic
+float *read_raw_thumbnail(const char *fname, int min_size, int *w, int *h,
+		int *pd, int *full_w, int *full_h)
+{
+	unsigned char *thumb;
+	int size, is_jpeg, tw, th;
+	if (!try_reading_libraw_thumbnail(fname, &thumb, &size, &is_jpeg,
+				w, h, pd, full_w, full_h))
+		return NULL;
+	float *data = NULL;
+	if (is_jpeg && size > 0) {
+#ifdef I_CAN_HAS_LIBJPEG
+		FILE *f = iio_fmemopen(thumb, size);
+		if (!jpeg_scaled(f, -(min_size > 1 ? min_size : 1), &data,
+					w, h, pd, &tw, &th))
+			data = NULL;
+		fclose(f);
+#endif//I_CAN_HAS_LIBJPEG
+	} else if (!is_jpeg) {
+		int n = *w * *h * *pd;
+		data = malloc(n * sizeof*data);
+		for (int i = 0; data && i < n; i++)
+			data[i] = thumb[i];
+	}
+	free(thumb);
+	return data;
+}
+#endif//I_USE_LIBRAW
 
 
 // individual format writers                                                {{{1
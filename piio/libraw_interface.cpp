@@ -37,6 +37,9 @@
 
 extern "C" {
 #include "iio.h"
+#ifndef IIO_MAX_DIMENSION
+#define IIO_MAX_DIMENSION 20   // as in iio.c
+#endif
    struct iio_image {
       int dimension;        // 1, 2, 3 or 4, typically
       int sizes[IIO_MAX_DIMENSION];
@@ -59,6 +62,8 @@ extern "C" {
 extern "C" {
    int try_reading_file_with_libraw(const char *fname, struct iio_image *x);
    int try_reading_file_with_libraw_4channels(const char *fname, struct iio_image *x);
+   int try_reading_libraw_thumbnail(const char *fname, unsigned char **data,
+         int *size, int *is_jpeg, int *w, int *h, int *pd, int *full_w, int *full_h);
 }
 
 
@@ -104,7 +109,11 @@ int try_reading_file_with_libraw(const char *fname, struct iio_image *x)
    for(int f=0;f<P1.raw_count; f++) {
    
       // select each frame in turn (assuming that all frames are the same size)
+#if LIBRAW_COMPILE_CHECK_VERSION_NOTLESS(0,21)
+      RawProcessor.imgdata.rawparams.shot_select=f;
+#else
       OUT.shot_select=f;
+#endif
 
       if(verbose) fprintf(stderr,"LIBRAW: Processing file %s\n",fname);
       if( (ret = RawProcessor.open_file(fname)) != LIBRAW_SUCCESS)
@@ -238,3 +247,62 @@ int try_reading_file_with_libraw_4channels(const char *fname, struct iio_image *
    return 1;
 }
 
+
+
+
+// reads the thumbnail embedded in the RAW without unpacking the mosaic: 
+// a JPEG stream (is_jpeg, size bytes) or an 8 bit bitmap of w x h x pd.
+// full_w, full_h are the size of the mosaic read by try_reading_file_with_libraw.
+// The data is malloc'ed. Returns 0 if there is no usable thumbnail
+int try_reading_libraw_thumbnail(const char *fname, unsigned char **data,
+      int *size, int *is_jpeg, int *w, int *h, int *pd, int *full_w, int *full_h)
+{
+   int ret;
+   int verbose=0;
+
+   LibRaw RawProcessor;
+
+#define S RawProcessor.imgdata.sizes
+#define T RawProcessor.imgdata.thumbnail
+
+   if( (ret = RawProcessor.open_file(fname)) != LIBRAW_SUCCESS)
+   {
+      if(verbose) fprintf(stderr,"LIBRAW: Cannot open %s: %s\n",fname,libraw_strerror(ret));
+      return 0;
+   }
+
+   // the same files as the readers above
+   if(!(RawProcessor.imgdata.idata.filters || RawProcessor.imgdata.idata.colors == 1))
+      return 0;
+
+   if( (ret = RawProcessor.unpack_thumb() ) != LIBRAW_SUCCESS)
+   {
+      if(verbose) fprintf(stderr,"LIBRAW: Cannot unpack the thumbnail of %s: %s\n",fname,libraw_strerror(ret));
+      return 0;
+   }
+
+   *full_w = S.raw_width;
+   *full_h = S.raw_height;
+   *w = T.twidth;
+   *h = T.theight;
+   *pd = T.tcolors;
+   if (T.tformat == LIBRAW_THUMBNAIL_JPEG) {
+      *is_jpeg = 1;
+      *size = T.tlength;
+   } else if (T.tformat == LIBRAW_THUMBNAIL_BITMAP && (T.tcolors == 1 || T.tcolors == 3) &&
+              T.tlength >= (unsigned) T.twidth*T.theight*T.tcolors) {
+      *is_jpeg = 0;
+      *size = T.twidth*T.theight*T.tcolors;
+   } else {
+      if(verbose) fprintf(stderr,"LIBRAW: Unsupported thumbnail format in %s\n",fname);
+      return 0;
+   }
+   *data = (unsigned char*) malloc(*size);
+   if (!*data) return 0;
+   memcpy(*data, T.thumb, *size);
+
+#undef T
+
+   if(verbose) fprintf(stderr,"LIBRAW: Thumbnail %dx%d sent to IIO\n",*w,*h);
+   return 1;
+}
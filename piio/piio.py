@@ -165,12 +165,22 @@ def read_buffer(filename):
 
 
 
-def read_tiled_buffers(filename):
+def read_tiled_buffers(filename, timings=None, preview=None):
    '''
-   IIO: float_buffer, w, h, nch = read_buffer(filename)
+   IIO: tiles, w, h, nch, vmin, vmax = read_tiled_buffers(filename)
+   if timings is a dict the seconds spent in 'decode', 'preview', 'minmax' and 'tiling' are added to it
+   if preview is a function, preview(tile, w, h) is called with a decimated copy 
+   of the image (see read_preview) as soon as it is decoded, before the tiling
    '''
    from ctypes import c_int, c_float, c_void_p, POINTER, cast, byref, c_char, memmove, create_string_buffer, sizeof
-   
+   from time import time
+
+   def lap(name, t0):
+      if timings is not None:
+         timings[name] = timings.get(name, 0) + time() - t0
+      return time()
+
+   t0 = time()
    w=c_int()
    h=c_int()
    nch=c_int()
@@ -183,6 +193,37 @@ def read_tiled_buffers(filename):
    ptr = cast(tptr, c_float_p)
    #print w,h,nch
    w,h,nch=w.value,h.value,nch.value
+   lap('decode', t0)
+
+   result = tile_buffer(ptr, w, h, nch, timings, preview)
+
+   # free the memory
+   libiio.freemem(ptr)
+   return result
+
+
+def tile_buffer(ptr, w, h, nch, timings=None, preview=None):
+   '''
+   IIO: tiles, w, h, nch, vmin, vmax = tile_buffer(ptr, w, h, nch)
+   the tiles of the image of w x h x nch floats at ptr, as read_tiled_buffers
+   '''
+   from ctypes import c_int, c_float, c_void_p, POINTER, byref
+   from time import time
+
+   def lap(name, t0):
+      if timings is not None:
+         timings[name] = timings.get(name, 0) + time() - t0
+      return time()
+
+   t0 = time()
+   c_float_p = POINTER(c_float)
+   if preview:
+      step = (max(w,h) + PREVIEW_SIZE - 1) // PREVIEW_SIZE
+      pw, ph, out_nch = (w + step - 1) // step, (h + step - 1) // step, min(nch,4)
+      data = ctypes.ARRAY(ctypes.c_float, pw*ph*out_nch)()
+      libiio.decimate_image(ptr, w, h, nch, data, step, out_nch)
+      preview([data, 0, 0, pw, ph, out_nch, -1], w, h)
+      t0 = lap('preview', t0)
    
    # compute min and max of the data
    vmin=c_float()
@@ -192,6 +233,7 @@ def read_tiled_buffers(filename):
    libiio.minmax.argtypes = [c_float_p,c_int,c_float_p,c_float_p]
    libiio.minmax(ptr,N,byref(vmin),byref(vmax))
    vmin,vmax=vmin.value,vmax.value
+   t0 = lap('minmax', t0)
 
    tiles   = []
    out_nch = min(nch,4)
@@ -208,13 +250,209 @@ def read_tiled_buffers(filename):
          libiio.copy_tile(ptr, w, h, nch, data, x, y, ww, hh, out_nch)  # only allow up to 4 channels
          tiles.append( [data, x, y, ww,hh, out_nch, -1] )  # -1 (the last field is a placeholder for the textureID)
          
-
-   # free the memory
-   libiio.freemem(ptr)
+   lap('tiling', t0)
 
    return (tiles,w,h,out_nch,vmin,vmax)
 
 
+# maximum size of the previews
+PREVIEW_SIZE = 512
+
+def read_preview(filename, max_size=PREVIEW_SIZE, min_pixels=0):
+   '''
+   IIO: tile, w, h = read_preview(filename)
+   low resolution copy of the image (at most max_size x max_size) read without
+   decoding the whole image, or None if the format doesn't allow it (only the 
+   uncompressed PFM, PGM and PPM files, the JPEG files decoded at 1/8 of 
+   their size, and the TIFF files, of which only the strips or tiles of the 
+   sampled rows, or a small enough overview, are decoded) or if the image has 
+   less than min_pixels pixels. The tile is like those of read_tiled_buffers, 
+   w and h are the size of the full image
+   '''
+   from ctypes import c_int, c_float, c_void_p, POINTER, cast, byref, memmove, sizeof
+
+   size = jpeg_size(filename)
+   if size:
+      if size[0]*size[1] < max(min_pixels, 1) or max(size) <= max_size:
+         return None
+      jpeg = read_jpeg_scaled(filename, 8)
+      if not jpeg:
+         return None
+      tile, full_w, full_h = jpeg
+      step = (max(tile[3], tile[4]) + max_size - 1) // max_size
+      if step > 1:
+         pw, ph = (tile[3] + step - 1) // step, (tile[4] + step - 1) // step
+         data = ctypes.ARRAY(ctypes.c_float, pw*ph*tile[5])()
+         libiio.decimate_image(tile[0], tile[3], tile[4], tile[5], data, step, tile[5])
+         tile = [data, 0, 0, pw, ph, tile[5], -1]
+      return tile, full_w, full_h
+
+   w, h, nch, full_w, full_h = c_int(), c_int(), c_int(), c_int(), c_int()
+   ptr = None
+   if hasattr(libiio, 'read_tiff_preview'):
+      libiio.read_tiff_preview.restype = c_void_p
+      ptr = libiio.read_tiff_preview(str(filename).encode('ascii'), max_size,
+            min_pixels, byref(w), byref(h), byref(nch), byref(full_w), byref(full_h))
+   if not ptr:
+      libiio.read_preview_strips.restype = c_void_p
+      ptr = libiio.read_preview_strips(str(filename).encode('ascii'), max_size,
+            byref(w), byref(h), byref(nch), byref(full_w), byref(full_h))
+   if not ptr:
+      return None
+   N = w.value*h.value*nch.value
+   data = ctypes.ARRAY(ctypes.c_float, N)()
+   memmove(data, ptr, N*sizeof(c_float))
+   libiio.freemem(c_void_p(ptr))
+   if full_w.value*full_h.value < min_pixels:
+      return None
+   return [data, 0, 0, w.value, h.value, nch.value, -1], full_w.value, full_h.value
+
+
+def jpeg_size(filename):
+   '''
+   IIO: w, h = jpeg_size(filename)
+   size of a JPEG image read from its header, None if the file is not a JPEG
+   (or if iio was built without libjpeg)
+   '''
+   from ctypes import c_int, byref
+   if not hasattr(libiio, 'jpeg_image_size'):
+      return None
+   w, h = c_int(), c_int()
+   if not libiio.jpeg_image_size(str(filename).encode('ascii'), byref(w), byref(h)):
+      return None
+   return w.value, h.value
+
+
+def read_jpeg_scaled(filename, denom):
+   '''
+   IIO: tile, w, h = read_jpeg_scaled(filename, denom)
+   the JPEG image decoded by libjpeg at 1/denom of its size (denom is 1, 2, 4
+   or 8), which is up to 10 times faster than decoding the whole image. None if 
+   the file cannot be read. The tile is like those of read_tiled_buffers, 
+   w and h are the size of the full image
+   '''
+   from ctypes import c_int, c_float, c_void_p, byref, memmove, sizeof
+   if not hasattr(libiio, 'read_jpeg_scaled'):
+      return None
+   w, h, nch, full_w, full_h = c_int(), c_int(), c_int(), c_int(), c_int()
+   libiio.read_jpeg_scaled.restype = c_void_p
+   ptr = libiio.read_jpeg_scaled(str(filename).encode('ascii'), denom,
+         byref(w), byref(h), byref(nch), byref(full_w), byref(full_h))
+   if not ptr:
+      return None
+   N = w.value*h.value*nch.value
+   data = ctypes.ARRAY(ctypes.c_float, N)()
+   memmove(data, ptr, N*sizeof(c_float))
+   libiio.freemem(c_void_p(ptr))
+   return [data, 0, 0, w.value, h.value, nch.value, -1], full_w.value, full_h.value
+
+
+def read_raw_thumbnail(filename, min_size=0):
+   '''
+   IIO: tile, w, h = read_raw_thumbnail(filename, min_size)
+   the thumbnail embedded in a camera RAW file, read by LibRaw without 
+   unpacking the mosaic. A JPEG thumbnail is decoded at 1/2, 1/4 or 1/8 of 
+   its size if it stays larger than min_size. None if there is no thumbnail
+   (or iio was built without LibRaw). The tile is like those of 
+   read_tiled_buffers, w and h are the size of the mosaic
+   '''
+   from ctypes import c_int, c_float, c_void_p, byref, memmove, sizeof
+   if not hasattr(libiio, 'read_raw_thumbnail'):
+      return None
+   w, h, nch, full_w, full_h = c_int(), c_int(), c_int(), c_int(), c_int()
+   libiio.read_raw_thumbnail.restype = c_void_p
+   ptr = libiio.read_raw_thumbnail(str(filename).encode('ascii'), min_size,
+         byref(w), byref(h), byref(nch), byref(full_w), byref(full_h))
+   if not ptr:
+      return None
+   N = w.value*h.value*nch.value
+   data = ctypes.ARRAY(ctypes.c_float, N)()
+   memmove(data, ptr, N*sizeof(c_float))
+   libiio.freemem(c_void_p(ptr))
+   return [data, 0, 0, w.value, h.value, nch.value, -1], full_w.value, full_h.value
+
+
+def _read_exactly(f, n):
+   ''' n bytes of f, fewer only at the end of the stream '''
+   chunks = []
+   while n > 0:
+      chunk = f.read(n)
+      if not chunk:
+         break
+      chunks.append(chunk)
+      n -= len(chunk)
+   return b''.join(chunks)
+
+
+def _pnm_header_number(f):
+   ''' the next number of a PNM header, skipping the # comments '''
+   token = b''
+   while True:
+      c = f.read(1)
+      if c == b'#' and not token:
+         while c not in (b'\n', b''):
+            c = f.read(1)
+      elif c.isspace() or not c:
+         if token or not c:
+            return float(token)
+      else:
+         token += c
+
+
+def read_frame(f):
+   '''
+   IIO: data, w, h, nch = read_frame(f)
+   the next image of a sequence of concatenated binary PGM/PPM, PFM or 
+   farbfeld images read from the binary file f (a pipe or a named pipe),
+   with the samples converted to floats as iio reads these formats. 
+   Returns None at the end of the stream, raises IOError for other formats
+   '''
+   import struct
+   from ctypes import c_char_p
+
+   magic = f.read(1)
+   while magic.isspace():   # between the images
+      magic = f.read(1)
+   if not magic:
+      return None
+   magic += _read_exactly(f, 1)
+   try:
+      if magic == b'fa':
+         if _read_exactly(f, 6) != b'rbfeld':
+            raise IOError('PIIO: bad farbfeld header')
+         w, h = struct.unpack('>II', _read_exactly(f, 8))
+         nch, size, swap = 4, 2, sys.byteorder == 'little'
+      elif magic in (b'P5', b'P6', b'Pf', b'PF'):
+         w, h, maxval = [int(_pnm_header_number(f)) if i < 2 else _pnm_header_number(f) for i in range(3)]
+         nch = 1 if magic in (b'P5', b'Pf') else 3
+         if magic in (b'Pf', b'PF'):
+            # like iio: in the native byte order and the first row on top
+            size, swap = 4, False
+         else:
+            size, swap = (1 if maxval < 256 else 2), sys.byteorder == 'little'
+      else:
+         raise IOError('PIIO: the stream is not a sequence of PGM/PPM, PFM or farbfeld images')
+   except (ValueError, struct.error):
+      raise IOError('PIIO: truncated image header in the stream')
+
+   n = w*h*nch
+   raw = _read_exactly(f, n*size)
+   if len(raw) < n*size:
+      raise IOError('PIIO: truncated image in the stream (%d of %d bytes)'%(len(raw), n*size))
+   return convert_samples(c_char_p(raw), n, size, swap), w, h, nch
+
+
+def convert_samples(src, n, size, swap=False):
+   '''
+   IIO: data = convert_samples(src, n, size, swap=False)
+   ctypes array of the n samples of size 1 (uint8), 2 (uint16) or 4 (float)
+   bytes at src converted to floats, swap reverses the bytes of each sample
+   '''
+   data = ctypes.ARRAY(ctypes.c_float, n)()
+   libiio.convert_samples(src, ctypes.c_size_t(n), size, int(swap), data)
+   return data
+
+
 def minmax(data):
    '''
    : minmax(data)
@@ -236,6 +474,67 @@ def minmax(data):
 
 
 
+# size of the blocks summarized by tile_stats_summary
+STATS_BLOCK = 32
+
+def tile_stats_summary(tile):
+   '''
+   IIO: summary = tile_stats_summary(tile)
+   block integral images (sum, sum of squares, number of finite values)
+   and block min/max of a tile returned by read_tiled_buffers
+   '''
+   from ctypes import c_int, c_float, c_double
+
+   data,x0,y0,w,h,nch = tile[:6]
+   bs = STATS_BLOCK
+   bw,bh = (w+bs-1)//bs, (h+bs-1)//bs
+   N = (bw+1)*(bh+1)*nch
+   isum, isum2, icount = (c_double*N)(), (c_double*N)(), (c_int*N)()
+   bmin, bmax = (c_float*(bw*bh*nch))(), (c_float*(bw*bh*nch))()
+
+   libiio.tile_block_stats.restype = None
+   libiio.tile_block_stats(data, w, h, nch, bs, isum, isum2, icount, bmin, bmax)
+   return (isum, isum2, icount, bmin, bmax)
+
+
+def new_region_stats(nch):
+   '''
+   IIO: acc = new_region_stats(nch)
+   empty accumulator [sum, sum2, count, vmin, vmax] for tile_region_stats
+   '''
+   from ctypes import c_float, c_double
+   return [(c_double*nch)(), (c_double*nch)(), (c_double*nch)(),
+           (c_float*nch)(*[float('inf')]*nch), (c_float*nch)(*[float('-inf')]*nch)]
+
+
+def tile_region_stats(tile, summary, x0, y0, x1, y1, acc):
+   '''
+   IIO: tile_region_stats(tile, summary, x0, y0, x1, y1, acc)
+   accumulates in acc the statistics of the finite values in the 
+   rectangle [x0,x1)x[y0,y1) of the tile (in tile coordinates)
+   '''
+   data,tx,ty,w,h,nch = tile[:6]
+   libiio.tile_region_stats.restype = None
+   libiio.tile_region_stats(data, w, h, nch, STATS_BLOCK, *(list(summary) + 
+         [x0, y0, x1, y1] + acc))
+
+
+def tile_region_histogram(tile, x0, y0, x1, y1, lo, hi, hist):
+   '''
+   IIO: tile_region_histogram(tile, x0, y0, x1, y1, lo, hi, hist)
+   accumulates in hist (ctypes array of nch*nbins doubles) the histogram 
+   of the rectangle [x0,x1)x[y0,y1) of the tile, with nbins bins in [lo,hi]
+   '''
+   from ctypes import c_float
+
+   data,tx,ty,w,h,nch = tile[:6]
+   nbins = len(hist)//nch
+   libiio.tile_region_histogram.restype = None
+   libiio.tile_region_histogram(data, w, h, nch, x0, y0, x1, y1, 
+         c_float(lo), c_float(hi), nbins, hist)
+
+
+
 def buffer_to_numpy(data,w,h,nch):
    '''
    IIO: numpyarray = buffer_to_numpy(float_buffer,w,h,nch)
@@ -267,6 +566,21 @@ def write(filename,data):
    iiowrite(str(filename).encode('ascii'), data.astype('float32'), w, h, nch)
 
 
+def write_buffer(filename,data,w,h,nch):
+   '''
+   IIO: write_buffer(filename,data,w,h,nch)
+   data is a ctypes array of c_float, c_uint8 or c_uint16 (interleaved channels)
+   '''
+   from ctypes import c_char_p, c_int, c_float, c_uint8, c_uint16
+
+   iiowrite = {c_float:  libiio.iio_write_image_float_vec,
+               c_uint8:  libiio.iio_write_image_uint8_vec,
+               c_uint16: libiio.iio_write_image_uint16_vec}[data._type_]
+
+   iiowrite.restype = None
+   iiowrite(str(filename).encode('ascii'), data, c_int(w), c_int(h), c_int(nch))
+
+
 def write_buffer_uint8(filename,data,w,h,nch):
    '''
    IIO: write_buffer_byte(filename,data,w,h,nch)
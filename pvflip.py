@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+# Shows arrays in pvflip from a python script or a notebook without blocking:
+#
+#    >>> import pvflip
+#    >>> pvflip.show(image)                  # h x w or h x w x nch array
+#    >>> pvflip.show(result, name='solver')  # another window
+#
+# Each name has its own viewer (v.py --shm NAME), started in a separate
+# process the first time it is shown, as OpenGL and the window events run in
+# the main thread of their process. The arrays are written to the shared
+# memory feed NAME (see shmfeed.py), so the next calls with the same name
+# update the same window in place within milliseconds: the samples are copied
+# into the shared memory, without encoding nor files, and the viewer uploads
+# the float32 frames from it; the producer doesn't rewrite the frames the
+# viewer holds, so a frame is never shown mixed with the next ones. The
+# viewer stays open when the script ends, and
+# removes the feed when it is closed.
+#
+# Any C-contiguous buffer of float32, uint8 or uint16 samples with 2 or 3
+# dimensions is accepted (numpy arrays, memoryviews...), numpy arrays of
+# other types are converted to float32.
+#
+
+from __future__ import print_function
+
+import os
+import sys
+import atexit
+
+import shmfeed
+
+# buffer format: dtype of the feed
+FORMATS = { 'f': 'float32', 'B': 'uint8', 'H': 'uint16' }
+
+feeds = {}      # name: shmfeed.Producer
+viewers = {}    # name: viewer process
+
+
+def frame_of(array):
+   ''' data, w, h, nch, dtype of the h x w or h x w x nch array '''
+   if hasattr(array, 'astype') and hasattr(array, 'flags'):   # numpy
+      if not array.dtype.isnative:    # '>u2', '>f4'... in native byte order
+         array = array.astype(array.dtype.newbyteorder('='))
+      if array.dtype.char not in FORMATS:
+         array = array.astype('float32')
+      if not array.flags['C_CONTIGUOUS']:
+         array = array.copy()
+   view = memoryview(array)
+   fmt = view.format.lstrip('@=<')
+   if fmt not in FORMATS:
+      raise TypeError('pvflip: samples of type %s are not supported (float32, uint8 or uint16)'%view.format)
+   if view.ndim == 2:
+      (h, w), nch = view.shape, 1
+   elif view.ndim == 3:
+      h, w, nch = view.shape
+   else:
+      raise ValueError('pvflip: the array must be h x w or h x w x nch, not %s'%(view.shape,))
+   return view, w, h, nch, FORMATS[fmt]
+
+
+def viewer_script():
+   ''' v.py next to this module, or in the PATH (installed) '''
+   script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'v.py')
+   if os.path.exists(script):
+      return script
+   for d in os.environ.get('PATH', '').split(os.pathsep):
+      if os.path.exists(os.path.join(d, 'v.py')):
+         return os.path.join(d, 'v.py')
+   raise IOError('pvflip: v.py not found')
+
+
+def show(array, name='pvflip'):
+   ''' shows the array in the viewer of name, starts it if needed. The
+       samples are copied, the array can be modified once show returns '''
+   import subprocess
+   data, w, h, nch, dtype = frame_of(array)
+   nbytes = w*h*nch*shmfeed.DTYPES[dtype][1]
+   # a larger frame needs a new feed, the viewer follows it
+   if name not in feeds or feeds[name].slot_size < nbytes:
+      if name in feeds:
+         feeds[name].close()
+      feeds[name] = shmfeed.Producer(name, nbytes)
+   feeds[name].write(data, w, h, nch, dtype)
+
+   if name not in viewers or viewers[name].poll() is not None:
+      viewers[name] = subprocess.Popen([sys.executable, viewer_script(), '--shm', name])
+
+
+def close(name=None):
+   ''' stops writing to the feed name (all of them by default), the viewers
+       keep showing the last frame '''
+   for n in ([name] if name is not None else list(feeds)):
+      if n in feeds:
+         feeds.pop(n).close()
+
+atexit.register(close)
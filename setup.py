@@ -110,6 +110,7 @@ setup_info = {
     ],
     
     "packages": ['glfw', 'piio'],
+    "py_modules": ['hudfont', 'shmfeed', 'pvflip'],
     "ext_modules": [iiomodule],
     "package_data": package_data,
     "scripts" : ['v.py'],
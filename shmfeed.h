@@ -0,0 +1,166 @@
+// Producer of a live frame feed of pvflip (v.py --shm NAME), in C.
+// The layout of the shared memory is described in shmfeed.py.
+//
+//	#include "shmfeed.h"
+//
+//	struct shmfeed *feed = shmfeed_open("solver", w*h*sizeof(float), 4);
+//	for (...) {
+//		...
+//		shmfeed_write(feed, image, w, h, 1, SHMFEED_FLOAT32);
+//	}
+//	shmfeed_close(feed, 0);
+//
+// POSIX only (mmap), the memory barriers use the GCC/clang builtins.
+
+#ifndef _SHMFEED_H
+#define _SHMFEED_H
+
+#include <stdint.h>
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+#include <fcntl.h>
+#include <unistd.h>
+#include <sys/mman.h>
+#include <sys/stat.h>
+
+#define SHMFEED_FLOAT32 0
+#define SHMFEED_UINT8   1
+#define SHMFEED_UINT16  2
+
+#define SHMFEED_HEADER_SIZE 64
+#define SHMFEED_SLOT_HEADER_SIZE 64
+
+struct shmfeed {
+	unsigned char *base;
+	size_t size, slot_size;
+	uint32_t nslots, slot;
+	uint64_t sequence;
+	char path[FILENAME_MAX];
+};
+
+// same rule as feed_path of shmfeed.py
+static void shmfeed_path(char *out, size_t n, const char *name)
+{
+	struct stat st;
+	const char *tmp = getenv("TMPDIR");
+	if (strchr(name, '/'))
+		snprintf(out, n, "%s", name);
+	else if (!stat("/dev/shm", &st) && S_ISDIR(st.st_mode))
+		snprintf(out, n, "/dev/shm/pvflip-%s", name);
+	else
+		snprintf(out, n, "%s/pvflip-%s", tmp ? tmp : "/tmp", name);
+}
+
+// creates the feed name for frames of at most max_bytes, or returns NULL
+// (nslots is at least 4, the reader can hold three frames)
+static struct shmfeed *shmfeed_open(const char *name, size_t max_bytes,
+		int nslots)
+{
+	char tmp[FILENAME_MAX + 32];
+	if (nslots < 4) return NULL;
+	struct shmfeed *s = malloc(sizeof *s);
+	if (!s) return NULL;
+	shmfeed_path(s->path, sizeof s->path, name);
+	snprintf(tmp, sizeof tmp, "%s.XXXXXX", s->path);
+	s->nslots = nslots;
+	s->slot = nslots - 1;
+	s->slot_size = (max_bytes + 63) / 64 * 64;
+	s->sequence = 0;
+	s->size = SHMFEED_HEADER_SIZE
+		+ nslots * (SHMFEED_SLOT_HEADER_SIZE + s->slot_size);
+
+	// a new file, renamed over the previous one: its readers keep their
+	// mapping (created by mkstemp, not at a predictable path)
+	int fd = mkstemp(tmp);
+	if (fd < 0) { free(s); return NULL; }
+	if (ftruncate(fd, s->size)) { close(fd); unlink(tmp); free(s); return NULL; }
+	s->base = mmap(NULL, s->size, PROT_READ|PROT_WRITE, MAP_SHARED, fd, 0);
+	close(fd);
+	if (s->base == MAP_FAILED) { unlink(tmp); free(s); return NULL; }
+
+	uint32_t version = 2, closed = 0;
+	uint64_t slot_size = s->slot_size, sequence = 0;
+	memcpy(s->base, "PVFLIPSM", 8);
+	memcpy(s->base + 8, &version, 4);
+	memcpy(s->base + 12, &s->nslots, 4);
+	memcpy(s->base + 16, &slot_size, 8);
+	memcpy(s->base + 24, &sequence, 8);
+	memcpy(s->base + 32, &closed, 4);
+	if (rename(tmp, s->path)) {
+		munmap(s->base, s->size);
+		unlink(tmp);
+		free(s);
+		return NULL;
+	}
+	return s;
+}
+
+// the frame n is held by the reader
+static int shmfeed_held(struct shmfeed *s, uint64_t n)
+{
+	uint64_t held[3];
+	memcpy(held, s->base + 40, sizeof held);
+	return n && (held[0] == n || held[1] == n || held[2] == n);
+}
+
+// the next slot whose frame is not held by the reader, its sequence is
+// set to 0 (like free_slot of shmfeed.py)
+static unsigned char *shmfeed_free_slot(struct shmfeed *s)
+{
+	uint64_t old, zero = 0;
+	for (uint32_t k = 1; k <= s->nslots; k++) {
+		uint32_t i = (s->slot + k) % s->nslots;
+		unsigned char *slot = s->base + SHMFEED_HEADER_SIZE
+			+ i * (SHMFEED_SLOT_HEADER_SIZE + s->slot_size);
+		memcpy(&old, slot, 8);
+		if (shmfeed_held(s, old)) continue;
+		memcpy(slot, &zero, 8);
+		// the reader holds a frame before checking the sequence of its slot
+		__sync_synchronize();
+		if (shmfeed_held(s, old)) {
+			memcpy(slot, &old, 8);
+			continue;
+		}
+		s->slot = i;
+		return slot;
+	}
+	return NULL;
+}
+
+// writes a frame of w x h x nch samples of type dtype (SHMFEED_*),
+// returns its sequence number, or 0 if it doesn't fit in the slots (or
+// they are all held)
+static uint64_t shmfeed_write(struct shmfeed *s, const void *data,
+		int w, int h, int nch, int dtype)
+{
+	static const int sample_size[] = {4, 1, 2};
+	if (dtype < 0 || dtype > 2) return 0;
+	size_t nbytes = (size_t)w * h * nch * sample_size[dtype];
+	if (nbytes > s->slot_size) return 0;
+
+	unsigned char *slot = shmfeed_free_slot(s);
+	if (!slot) return 0;
+	uint64_t n = ++s->sequence;
+	uint32_t size[4] = {w, h, nch, dtype};
+	memcpy(slot + SHMFEED_SLOT_HEADER_SIZE, data, nbytes);
+	memcpy(slot + 8, size, sizeof size);
+	__sync_synchronize();
+	memcpy(slot, &n, 8);
+	__sync_synchronize();
+	memcpy(s->base + 24, &n, 8);
+	return n;
+}
+
+// the readers keep the last frame, if remove the file is deleted
+static void shmfeed_close(struct shmfeed *s, int remove)
+{
+	uint32_t closed = 1;
+	memcpy(s->base + 32, &closed, 4);
+	munmap(s->base, s->size);
+	if (remove)
+		unlink(s->path);
+	free(s);
+}
+
+#endif//_SHMFEED_H
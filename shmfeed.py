@@ -0,0 +1,211 @@
+#!/usr/bin/env python
+# Live frame feed of pvflip through shared memory: a producer (an iterative
+# solver, a camera...) writes its frames in a ring buffer that v.py --shm NAME
+# reads and shows as they arrive, without files nor pipes.
+#
+# The feed NAME is the file /dev/shm/pvflip-NAME ($TMPDIR/pvflip-NAME, or /tmp,
+# where there is no /dev/shm), or the path NAME if it contains a '/'. Both
+# sides map it in memory. Its layout (native byte order):
+#
+#    header, 64 bytes
+#       0   char[8]  magic "PVFLIPSM"
+#       8   uint32   version (2)
+#      12   uint32   nslots, number of slots of the ring (at least 4)
+#      16   uint64   slot_size, bytes of samples of each slot (multiple of 64)
+#      24   uint64   sequence, number of the last complete frame (0: none yet)
+#      32   uint32   closed, 1 once the producer has finished
+#      40   uint64[3] held, the frames used by the reader (0: none)
+#    nslots slots of 64 + slot_size bytes
+#       0   uint64   sequence, the number of its frame (0 while it is written)
+#       8   uint32   w
+#      12   uint32   h
+#      16   uint32   nch
+#      20   uint32   dtype, 0: float32, 1: uint8, 2: uint16
+#      64            w*h*nch samples, interleaved channels, rows top to bottom
+#
+# The producer writes the frame n (n = 1, 2, ...) in the next slot that
+# doesn't contain a held frame: it sets the sequence of the slot to 0, checks
+# again that the old frame of the slot is not held (otherwise it restores the
+# sequence and tries the next slot), writes the samples and the size, then
+# the sequence of the slot to n and finally the sequence of the header to n.
+# The reader takes the frame of the sequence of the header: it sets one of
+# the held sequences to n and then checks that a slot still has the sequence
+# n. From then on the producer leaves that slot alone, so the reader uses
+# the samples in place, without copies, until it holds another frame (v.py
+# holds the frame shown, the next one and the one it is reading). The file
+# is replaced, not rewritten, by a new producer.
+#
+#    > python
+#    >>> import shmfeed
+#    >>> feed = shmfeed.Producer('solver', 512*512*4)
+#    >>> feed.write(samples, 512, 512)        # any buffer of float32
+#
+# shmfeed.h is the same producer in C.
+#
+
+from __future__ import print_function
+
+import os
+import mmap
+import struct
+import tempfile
+
+MAGIC = b'PVFLIPSM'
+VERSION = 2
+HEADER_SIZE = 64
+SLOT_HEADER_SIZE = 64
+HEADER_FORMAT = '=8sIIQQI'
+SLOT_FORMAT = '=QIIII'
+HELD_OFFSET = 40
+HELD_FORMAT = '=QQQ'
+
+# dtype: (code, bytes per sample)
+DTYPES = { 'float32': (0, 4), 'uint8': (1, 1), 'uint16': (2, 2) }
+DTYPE_NAMES = dict((code, name) for name, (code, size) in DTYPES.items())
+
+
+def feed_path(name):
+   ''' the file of the feed name '''
+   if '/' in name:
+      return name
+   if os.path.isdir('/dev/shm'):
+      return '/dev/shm/pvflip-' + name
+   return os.path.join(os.environ.get('TMPDIR', '/tmp'), 'pvflip-' + name)
+
+
+def _as_bytes(data):
+   ''' the bytes of a contiguous buffer (bytes, array, ctypes, numpy...) '''
+   try:
+      return memoryview(data).cast('B')
+   except AttributeError:    # python 2
+      return bytes(buffer(data))
+
+
+class Producer:
+   ''' Writes frames of at most max_bytes to the feed name '''
+
+   def __init__(self, name, max_bytes, nslots=4):
+      if nslots < 4:
+         raise ValueError('a feed needs at least 4 slots, 3 can be held by the reader')
+      self.path = feed_path(name)
+      self.nslots = nslots
+      self.slot_size = (max_bytes + 63)//64*64
+      self.sequence = 0
+      self.slot = nslots - 1    # the slot of the last frame
+      size = HEADER_SIZE + nslots*(SLOT_HEADER_SIZE + self.slot_size)
+      # a new file, renamed over the previous one: its readers keep their mapping
+      # (created by mkstemp, not at a predictable path)
+      fd, tmp = tempfile.mkstemp(prefix=os.path.basename(self.path) + '.',
+                                 dir=os.path.dirname(self.path) or '.')
+      try:
+         os.ftruncate(fd, size)
+         self.mm = mmap.mmap(fd, size)
+      except (IOError, OSError, ValueError):
+         os.remove(tmp)
+         raise
+      finally:
+         os.close(fd)
+      struct.pack_into(HEADER_FORMAT, self.mm, 0, MAGIC, VERSION, nslots, self.slot_size, 0, 0)
+      os.rename(tmp, self.path)
+
+   def write(self, data, w, h, nch=1, dtype='float32'):
+      ''' writes the frame of w x h x nch samples of dtype in data,
+          returns its sequence number '''
+      code, sample_size = DTYPES[dtype]
+      data = _as_bytes(data)
+      nbytes = w*h*nch*sample_size
+      if len(data) != nbytes:
+         raise ValueError('%d bytes given for a %dx%dx%d %s frame'%(len(data), w, h, nch, dtype))
+      if nbytes > self.slot_size:
+         raise ValueError('the frame of %d bytes is larger than the slots of the feed (%d)'%(nbytes, self.slot_size))
+      self.sequence += 1
+      slot = self.free_slot()
+      self.mm[slot + SLOT_HEADER_SIZE:slot + SLOT_HEADER_SIZE + nbytes] = data
+      struct.pack_into(SLOT_FORMAT, self.mm, slot, self.sequence, w, h, nch, code)
+      struct.pack_into('=Q', self.mm, 24, self.sequence)
+      return self.sequence
+
+   def free_slot(self):
+      ''' offset of the next slot whose frame is not held by the reader, its
+          sequence is set to 0 '''
+      for k in range(1, self.nslots + 1):
+         s = (self.slot + k) % self.nslots
+         slot = HEADER_SIZE + s*(SLOT_HEADER_SIZE + self.slot_size)
+         old = struct.unpack_from('=Q', self.mm, slot)[0]
+         if old and old in struct.unpack_from(HELD_FORMAT, self.mm, HELD_OFFSET):
+            continue
+         struct.pack_into('=Q', self.mm, slot, 0)
+         # the reader holds a frame before checking the sequence of its slot
+         if old and old in struct.unpack_from(HELD_FORMAT, self.mm, HELD_OFFSET):
+            struct.pack_into('=Q', self.mm, slot, old)
+            continue
+         self.slot = s
+         return slot
+      raise RuntimeError('all the slots of %s are held'%self.path)
+
+   def close(self, remove=False):
+      ''' the readers keep the last frame, remove deletes the file '''
+      struct.pack_into('=I', self.mm, 32, 1)
+      self.mm.close()
+      if remove:
+         os.remove(self.path)
+
+
+class Feed:
+   ''' Read side of the feed name (used by v.py --shm) '''
+
+   def __init__(self, name):
+      self.path = feed_path(name)
+      with open(self.path, 'r+b') as f:
+         self.inode = os.fstat(f.fileno()).st_ino
+         self.mm = mmap.mmap(f.fileno(), 0)
+      magic, version, self.nslots, self.slot_size = struct.unpack_from(HEADER_FORMAT, self.mm, 0)[:4]
+      if magic != MAGIC or version != VERSION:
+         raise ValueError('%s is not a pvflip feed (version %d)'%(self.path, VERSION))
+      if len(self.mm) < HEADER_SIZE + self.nslots*(SLOT_HEADER_SIZE + self.slot_size):
+         raise ValueError('%s is truncated'%self.path)
+
+   def sequence(self):
+      ''' number of the last complete frame '''
+      return struct.unpack_from('=Q', self.mm, 24)[0]
+
+   def closed(self):
+      ''' the producer has finished '''
+      return struct.unpack_from('=I', self.mm, 32)[0] == 1
+
+   def replaced(self):
+      ''' the file has been replaced by another producer, or removed '''
+      try:
+         return os.stat(self.path).st_ino != self.inode
+      except OSError:
+         return True
+
+   def slot_of(self, n):
+      ''' offset of the slot of the frame n, or None if it has been rewritten '''
+      for s in range(self.nslots):
+         slot = HEADER_SIZE + s*(SLOT_HEADER_SIZE + self.slot_size)
+         if struct.unpack_from('=Q', self.mm, slot)[0] == n:
+            return slot
+      return None
+
+   def hold(self, n, which):
+      ''' the producer doesn't rewrite the frame n while it is held (which is
+          0, 1 or 2, the reader can hold three frames), returns False if it
+          has already been rewritten. Holding another frame releases it '''
+      struct.pack_into('=Q', self.mm, HELD_OFFSET + 8*which, n)
+      return self.slot_of(n) is not None
+
+   def frame(self, n):
+      ''' offset, w, h, nch, dtype of the frame n, or None if its slot has
+          been rewritten '''
+      slot = self.slot_of(n)
+      if slot is None:
+         return None
+      sequence, w, h, nch, code = struct.unpack_from(SLOT_FORMAT, self.mm, slot)
+      if sequence != n or code not in DTYPE_NAMES or w*h*nch*DTYPES[DTYPE_NAMES[code]][1] > self.slot_size:
+         return None
+      return slot + SLOT_HEADER_SIZE, w, h, nch, DTYPE_NAMES[code]
+
+   def valid(self, n):
+      ''' the samples of the frame n are still in its slot '''
+      return self.slot_of(n) is not None
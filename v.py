@@ -24,10 +24,148 @@ from __future__ import unicode_literals
 import sys
 sys.modules['numpy']=None
 
+
+#### STARTUP
+# The first image is decoded in a thread (start_loading) while OpenGL is 
+# imported and the window is created. --startup-profile prints the time 
+# spent in each step until the first frame.
+def startup_mark(name):
+   import time
+   STARTUP_MARKS.append((name, time.time()))
+
+STARTUP_MARKS = []
+startup_mark('start')
+
+def process_start_time():
+   ''' when the python interpreter was started (linux only, 10ms precision) '''
+   import os, time
+   try:
+      with open('/proc/self/stat') as f:
+         ticks = int(f.read().rsplit(')', 1)[1].split()[19])
+      with open('/proc/uptime') as f:
+         uptime = float(f.read().split()[0])
+      return time.time() - uptime + ticks/float(os.sysconf('SC_CLK_TCK'))
+   except (IOError, OSError, ValueError, IndexError):
+      return None
+
+def print_startup_profile():
+   start = process_start_time()
+   total = STARTUP_MARKS[-1][1] - (start or STARTUP_MARKS[0][1])
+   if start:
+      print('%-26s %8.1f ms'%('python startup', 1000*(STARTUP_MARKS[0][1] - start)))
+   for (name0, t0), (name, t1) in zip(STARTUP_MARKS, STARTUP_MARKS[1:]):
+      print('%-26s %8.1f ms'%(name, 1000*(t1 - t0)))
+   for name in ('decode', 'minmax', 'tiling'):
+      if name in S.timers:
+         print('%-26s %8.1f ms'%('  %s (in the thread)'%name, 1000*S.timers[name][1]))
+   print('%-26s %8.1f ms'%('time to first frame', 1000*total))
+
+
+# --option value
+OPTIONS_WITH_VALUE = ('--colormap', '--stats-file', '--record', '--replay', '--stream', '--shm')
+
+def first_image_argument(args):
+   skip = False
+   for a in args:
+      if skip:
+         skip = False
+      elif a in OPTIONS_WITH_VALUE:
+         skip = True
+      elif not a.startswith('--'):
+         return a
+   return None
+
+LOADING = {}     # filename : the thread decoding it
+PREVIEW_MIN_PIXELS = 16*1024*1024   # smaller images are decoded without preview
+
+def start_loading(filename, preview=True):
+   ''' decodes the image in a thread, load_image collects the result.
+       job['preview'] is set to a low resolution (tile, w, h) as soon as
+       possible: read without decoding the image if the format allows 
+       it, otherwise decimated from the decoded image '''
+   import threading
+   def work(job):
+      try:
+         import piio
+         if preview:
+            job['preview'] = piio.read_preview(filename, min_pixels=PREVIEW_MIN_PIXELS)
+         def set_preview(tile, w, h):
+            if not job['preview']:
+               job['preview'] = (tile, w, h)
+         job['result'] = piio.read_tiled_buffers(filename, job['timings'],
+               set_preview if preview else None)
+      except (SystemError, IOError) as e:
+         job['error'] = e
+   job = {'timings': {}, 'preview': None}
+   job['thread'] = threading.Thread(target=work, args=(job,))
+   job['thread'].daemon = True
+   job['thread'].start()
+   LOADING[filename] = job
+   return job
+
+
+#### SINGLE INSTANCE
+# With --reuse the images are sent through a unix socket to a viewer that is 
+# already running (see ViewerServer), this is tried before importing OpenGL
+# so the new invocation exits immediately.
+def viewer_socket_path():
+   ''' the socket, in $XDG_RUNTIME_DIR or in a directory of the temporary 
+       directory, or None if that directory is accessible to other users '''
+   import os, stat, tempfile
+   if not hasattr(os, 'getuid'):
+      return None
+   uid = os.getuid()
+   directory = os.environ.get('XDG_RUNTIME_DIR')
+   if not directory:
+      directory = os.path.join(tempfile.gettempdir(), 'pvflip-%d'%uid)
+      try:
+         os.mkdir(directory, 0o700)
+      except OSError:
+         pass
+   # another user could have created it first, and taken the socket
+   try:
+      st = os.lstat(directory)
+   except OSError:
+      return None
+   if not stat.S_ISDIR(st.st_mode) or st.st_uid != uid or st.st_mode & 0o077:
+      print('--reuse: %s is not a private directory'%directory)
+      return None
+   return os.path.join(directory, 'pvflip-%d.sock'%uid)
+
+def send_to_running_viewer(filenames):
+   ''' returns True if a running viewer has received the filenames '''
+   import os, socket, json
+   path = viewer_socket_path()
+   if not hasattr(socket, 'AF_UNIX') or not path:
+      return False
+   # the viewer runs in another directory
+   filenames = [os.path.abspath(f) if os.path.exists(f) else f for f in filenames]
+   s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+   s.settimeout(2)
+   try:
+      s.connect(path)
+      s.sendall((json.dumps(filenames) + '\n').encode('utf-8'))
+      return s.recv(16).startswith(b'ok')
+   except (socket.error, OSError):
+      return False
+   finally:
+      s.close()
+
+# the other options would be lost, and stdin can't be handed over
+if __name__ == '__main__' and '--reuse' in sys.argv[1:]:
+   images = [a for a in sys.argv[1:] if a != '--reuse']
+   if images and '-' not in images and not [a for a in images if a.startswith('--')]:
+      if send_to_running_viewer(images):
+         sys.exit(0)
+
+# the images of a replay are in the recorded file
+if __name__ == '__main__' and not [a for a in sys.argv[1:] if a.startswith('--replay')]:
+   first_image = first_image_argument(sys.argv[1:])
+   if first_image and first_image != '-':
+      start_loading(first_image)
+
+
 from OpenGL.GL import *
-from OpenGL.GL.shaders import *
-# TODO REMOVE GLUT: only needed for the text
-import OpenGL.GLUT as glut
 from glfw import glfw
 
 ### SYSTEM SPECIFIC STUFF
@@ -41,53 +179,22 @@ global HELPstr
 HELPstr=""
 
 oflow_shader = """
-    vec4 hsvtorgb(vec4 colo)
-    {
-       vec4 outp;
-       float r, g, b, h, s, v; 
-       r=g=b=h=s=v=0.0;
-       h = colo.x; s = colo.y; v = colo.z;
-       if (s == 0.0) { r = g = b = v; }
-       else {
-          float H = mod(floor(h/60.0) , 6.0);
-          float p, q, t, f = h/60.0 - H;
-          p = v * (1.0 - s);
-          q = v * (1.0 - f*s);
-          t = v * (1.0 - (1.0 - f)*s);
-          if(H == 6.0 || H == 0.0) { r = v; g = t; b = p; }
-          else if(H == -1.0 || H == 5.0) { r = v; g = p; b = q; } 
-          else if(H == 1.0) { r = q; g = v; b = p; }
-          else if(H == 2.0) { r = p; g = v; b = t; }
-          else if(H == 3.0) { r = p; g = q; b = v; }
-          else if(H == 4.0) { r = t; g = p; b = v; }
-       }
-       outp.x = r; outp.y = g; outp.z = b; outp.w=colo.w;
-       return outp;
-    }
-
-   float M_PI = 3.1415926535897932;
-   float M_PI_2 = 1.5707963267948966;
-    float atan2(float x, float y)
-    {
-       if (x>0.0) { return atan(y/x); }
-       else if(x<0.0 && y>0.0) { return atan(y/x) + M_PI; }
-       else if(x<0.0 && y<=0.0 ) { return atan(y/x) - M_PI; }
-       else if(x==0.0 && y>0.0 ) { return M_PI_2; }
-       else if(x==0.0 && y<0.0 ) { return -M_PI_2; }
-       return 0.0;
-    }
-
+  // the hue of the flow direction is read from the 'hue' colormap
   uniform sampler2D src;
+  uniform sampler1D lut;
+  uniform float _lutsz;
   uniform float shader_a;
   uniform float shader_b;
 
+  float M_PI = 3.1415926535897932;
+
   void main (void)
   {
        vec4 p = texture2D(src, gl_TexCoord[0].xy);
-       float a = (180.0/M_PI)*(atan2(-p.x,p.w) + M_PI);
-       float r = sqrt(p.x*p.x+p.w*p.w)*shader_a;
-       vec4 q = vec4(a, clamp(r,0.0,1.0),clamp(r,0.0,1.0),0.0);
-       p = hsvtorgb(q);
+       float h = (atan(p.w, -p.x) + M_PI)/(2.0*M_PI);
+       float r = clamp(sqrt(p.x*p.x+p.w*p.w)*shader_a, 0.0, 1.0);
+       vec3 hue = texture1D(lut, (1.5 + h*(_lutsz - 3.0))/_lutsz).rgb;
+       p = vec4(r*mix(vec3(1.0), hue, r), 0.0);
 
        gl_FragColor = clamp(p, 0.0, 1.0) ;
 
@@ -95,49 +202,19 @@ oflow_shader = """
    """
 
 hsv_shader = """
-    // OLD AND WRONG
-    vec4 hsvtorgb(vec4 colo)
-    {
-       vec4 outp;
-       float r, g, b, h, s, v; 
-       r=g=b=h=s=v=0.0;
-       h = colo.x; s = colo.y; v = colo.z;
-       if (s == 0.0) { r = g = b = v; }
-       else {
-          float H = mod(floor(h/60.0) , 6.0);
-          float p, q, t, f = h/60.0 - H;
-          p = v * (1.0 - s);
-          q = v * (1.0 - f*s);
-          t = v * (1.0 - (1.0 - f)*s);
-          if(H == 6.0 || H == 0.0) { r = v; g = t; b = p; }
-          else if(H == -1.0 || H == 5.0) { r = v; g = p; b = q; } 
-          else if(H == 1.0) { r = q; g = v; b = p; }
-          else if(H == 2.0) { r = p; g = v; b = t; }
-          else if(H == 3.0) { r = p; g = q; b = v; }
-          else if(H == 4.0) { r = t; g = p; b = v; }
-       }
-       outp.x = r; outp.y = g; outp.z = b; outp.w=colo.w;
-       return outp;
-    }
-
-    vec3 hsv2rgb(vec3 c)
-    {
-        vec4 K = vec4(1.0, 2.0 / 3.0, 1.0 / 3.0, 3.0);
-        vec3 p = abs(fract(c.xxx + K.xyz) * 6.0 - K.www);
-        return c.z * mix(K.xxx, clamp(p - K.xxx, 0.0, 1.0), c.y);
-    }
-
+  // the hue is read from the 'hue' colormap
   uniform sampler2D src;
+  uniform sampler1D lut;
+  uniform float _lutsz;
   uniform float shader_a;
   uniform float shader_b;
 
   void main (void)
   {
        vec4 q = texture2D(src, gl_TexCoord[0].xy);
-       //vec4 p = hsvtorgb(q);
-       q = vec4(q.x/360.0,q.y,q.z,q.w);
-       vec3 pp = hsv2rgb(q.xyz);
-       vec4 p = vec4(pp.x,pp.y,pp.z,q.w);
+       float h = fract(q.x/360.0);
+       vec3 hue = texture1D(lut, (1.5 + h*(_lutsz - 3.0))/_lutsz).rgb;
+       vec4 p = vec4(q.z*mix(vec3(1.0), hue, q.y), q.w);
 
        gl_FragColor = clamp(p * shader_a + shader_b, 0.0, 1.0);
 
@@ -293,227 +370,107 @@ depth_shader_hsv = """
   }
    """
 
-depth_shader_jet = """
-/*
-// translate value x in [0..1] into color triplet using "jet" color map
-// if out of range, use darker colors
-// variation of an idea by http://www.metastine.com/?p=7
-void jet(float x, int& r, int& g, int& b)
-{
-    if (x < 0) x = -0.05;
-    if (x > 1) x =  1.05;
-    x = x / 1.15 + 0.1; // use slightly asymmetric range to avoid darkest shade
- of blue.
-    r = max(0, min(255, round(255 * (1.5 - 4*fabs(x - .75)))));
-    g = max(0, min(255, round(255 * (1.5 - 4*fabs(x - .5 )))));
-    b = max(0, min(255, round(255 * (1.5 - 4*fabs(x - .25)))));
-}
-*/
-
-  uniform sampler2D src;
-  uniform float shader_a;
-  uniform float shader_b;
-  uniform int   shader_c;
-
-  void main (void)
-  {
-       vec4 q = texture2D(src, gl_TexCoord[0].xy);
-       q = 1.0 - (q * shader_a + shader_b);
-       if (shader_c > 0)
-         q = 1.0 - q;
-       if(q.x < 0.0) q.x = -0.05;
-       if(q.x > 1.0) q.x =  1.05;
-       q.x = q.x/1.15 + 0.1;
-       vec4 p;
-       p.x = 1.5 - abs(q.x - .75)*4.0;
-       p.y = 1.5 - abs(q.x - .50)*4.0;
-       p.z = 1.5 - abs(q.x - .25)*4.0;
-       p.w = 1.0;
-
-       gl_FragColor = clamp(p, 0.0, 1.0);
-
-  }
-   """
-
-depth_shader_dirt = """
-/*
-// translate value x in [0..1] into color triplet using "dirt" color map
-*/
-
-  uniform sampler2D src;
-  uniform float shader_a;
-  uniform float shader_b;
-  uniform int   shader_c;
-
-  void main (void)
-  {
-
-float Rx[7], Ry[7];
-Rx[0]=0.; Rx[1]=35.; Rx[2]=82.5; Rx[3]= 91.; Rx[4]=97.5; Rx[5]=100.; Rx[6]=100.;
-Ry[0]=1.; Ry[1]=1.;  Ry[2]=.54;  Ry[3]= .41; Ry[4]=.25;  Ry[5]=.2;   Ry[6]=.2;
-float Gx[7], Gy[7];
-Gx[0]=0.; Gx[1]=4.; Gx[2]=15.; Gx[3]=25.; Gx[4]=85. ; Gx[5]=91. ; Gx[5]=100.;
-Gy[0]=1.; Gy[1]=1.; Gy[2]=0.8; Gy[3]=0.7; Gy[4]=0.22; Gy[5]=0.15; Gy[5]=0.;
-float Bx[7], By[7];
-Bx[0]= 0.; Bx[1]= 10. ; Bx[2]= 21. ; Bx[3]=24. ; Bx[4]=100.; Bx[5]=100.; Bx[6]=100.;
-By[0]= 1.; By[1]= 0.35; By[2]= 0.4 ; By[3]=0.  ; By[4]=0.;   By[5]=0.;   By[6]=0.;
-
-
-       vec4 q = texture2D(src, gl_TexCoord[0].xy);
-       q = 1.0 - (q * shader_a + shader_b);
-       if (shader_c > 0)
-         q = 1.0 - q;
-
-       q = clamp(q, 0.0, 1.0);
-
-       vec4 p;
-       p.w = 1.0;
-
-       for(int i=1;i<7;i++) {
-        if(i<6 && q.x >= Rx[i-1]/100.0 && q.x <= Rx[i]/100.0){
-               float cc = (Rx[i] - q.x*100.0) / (Rx[i] -  Rx[i-1]);
-               p.x = cc * Ry[i-1] + (1.0 - cc)*Ry[i];
-        }
-        if(q.y >= Gx[i-1]/100.0 && q.y <= Gx[i]/100.0){
-               float cc = (Gx[i] - q.y*100.0) / (Gx[i] -  Gx[i-1]);
-               p.y = cc * Gy[i-1] + (1.0 - cc)*Gy[i];
-        }
-        if(i<5 && q.z >= Bx[i-1]/100.0 && q.z <= Bx[i]/100.0){
-               float cc = (Bx[i] - q.z*100.0) / (Bx[i] -  Bx[i-1]);
-               p.z = cc * By[i-1] + (1.0 - cc)*By[i];
-        }
-       }
-
-       gl_FragColor = clamp(p, 0.0, 1.0);
+lut_shader = """
+   // single channel colormaps baked in a 1D texture (see COLORMAPS):
+   // the entries 1.._lutsz-2 of the lut cover [0,1], the first
+   // and the last entries are the colors below and above the range
+   uniform sampler2D src;
+   uniform sampler1D lut;
+   uniform float _lutsz;
+   uniform int   _lutraw;   // the pixel values are the indices of the lut
+   uniform vec4  _lutnan;   // color of the NaN pixels
+   uniform float shader_a;
+   uniform float shader_b;
+   uniform int   shader_c;
 
-  }
+   void main (void)
+   {
+      float v = texture2D(src, gl_TexCoord[0].xy).x;
+      float t = v * shader_a + shader_b;
+      if (shader_c > 0)
+         t = 1.0 - t;
+      if (_lutraw > 0)
+         t = floor(v)/(_lutsz - 3.0);
+      // NaN fails all the comparisons
+      if (t < 0.0)
+         gl_FragColor = texture1D(lut, 0.5/_lutsz);
+      else if (t > 1.0)
+         gl_FragColor = texture1D(lut, 1.0 - 0.5/_lutsz);
+      else if (t >= 0.0 && t <= 1.0)
+         gl_FragColor = texture1D(lut, (1.5 + t*(_lutsz - 3.0))/_lutsz);
+      else
+         gl_FragColor = _lutnan;
+   }
    """
 
-
-DEM_shader = """
+# the passes of the viewport reduction (see ViewportReduction)
+viewport_range_shader = """
+   // (min, max, mean) of the finite channels of each visible pixel
+   // a pixel without finite channels gets min > max
    uniform sampler2D src;
-  uniform float shader_a;
-  uniform float shader_b;
-  uniform int   shader_c;
-  
-  bool isnan( float val )
-  {
-    return ( val < 0.0 || 0.0 < val || val == 0.0 ) ? false : true;
-    // important: some nVidias failed to cope with version below.
-    // Probably wrong optimization.
-    /*return ( val <= 0.0 || 0.0 <= val ) ? false : true;*/
-  }
-
-
+   uniform int shader_c;    // number of channels of the image
 
    void main (void)
    {
-
-//http://soliton.vm.bytemark.co.uk/pub/cpt-city/td/tn/DEM_screen.png.index.html
-//float palI[8], palR[8], palG[8], palB[8];
-//int N=6;
-//palI[0]=0.00000; palR[0]=0.00000; palG[0]=0.51765; palB[0]=0.20784;  
-//palI[1]=0.12500; palR[1]=0.20000; palG[1]=0.80000; palB[1]=0.00000;
-//palI[2]=0.25000; palR[2]=0.95686; palG[2]=0.94118; palB[2]=0.44314;
-//palI[3]=0.50000; palR[3]=0.95686; palG[3]=0.74118; palB[3]=0.27059;
-//palI[4]=0.75000; palR[4]=0.60000; palG[4]=0.39216; palB[4]=0.16863;
-//palI[5]=1.00000; palR[5]=1.00000; palG[5]=1.00000; palB[5]=1.00000;
-
-////http://soliton.vm.bytemark.co.uk/pub/cpt-city/td/DEM_print.gpf
-//float palI[8], palR[8], palG[8], palB[8];
-//int N=7;
-//palI[0]=0.00000; palR[0]=0.20000; palG[0]=0.40000; palB[0]=0.00000;  
-//palI[1]=0.12500; palR[1]=0.50588; palG[1]=0.76471; palB[1]=0.12157;
-//palI[2]=0.25000; palR[2]=1.00000; palG[2]=1.00000; palB[2]=0.80000;
-//palI[3]=0.50000; palR[3]=0.95686; palG[3]=0.74118; palB[3]=0.27059;
-//palI[4]=0.62500; palR[4]=0.40000; palG[4]=0.20000; palB[4]=0.04706;
-//palI[5]=0.75000; palR[5]=0.40000; palG[5]=0.20000; palB[5]=0.00000;
-//palI[6]=1.00000; palR[6]=1.00000; palG[6]=1.00000; palB[6]=1.00000;
-   
-      
-
-//http://soliton.vm.bytemark.co.uk/pub/cpt-city/td/tn/DEM_poster.png.index.html
-float palI[8], palR[8], palG[8], palB[8];
- int N = 8;
-palI[0]=0.00000; palR[0]=0.00000; palG[0]=0.38039; palB[0]=0.27843;  
-palI[1]=0.01020; palR[1]=0.06275; palG[1]=0.47843; palB[1]=0.18431;
-palI[2]=0.10200; palR[2]=0.90980; palG[2]=0.84314; palB[2]=0.49020;
-palI[3]=0.24490; palR[3]=0.63137; palG[3]=0.26275; palB[3]=0.00000;
-palI[4]=0.34690; palR[4]=0.61961; palG[4]=0.00000; palB[4]=0.00000;
-palI[5]=0.57140; palR[5]=0.43137; palG[5]=0.43137; palB[5]=0.43137;
-palI[6]=0.81630; palR[6]=1.00000; palG[6]=1.00000; palB[6]=1.00000;
-palI[7]=1.00000; palR[7]=1.00000; palG[7]=1.00000; palB[7]=1.00000;
-
-
-       vec4 q = texture2D(src, gl_TexCoord[0].xy);
-       q = 1.0 - (q * shader_a + shader_b);
-       if (shader_c > 0)
-         q = 1.0 - q;
-
-       vec4 p;
-       p.w = 1.0;
-
-       if(isnan(q.x)) {
-           p.x = 0.0;
-           p.y = 0.0;
-           p.z = 0.0;
-       } else {
-
-          q = clamp(q, 0.0, 1.0);
-
-          p.x = palR[0]; 
-          p.y = palG[0]; 
-          p.z = palB[0]; 
-   
-          for(int i=1;i<N;i++) {
-           if(q.x >= palI[i-1] && q.x <= palI[i]){
-                  float cc = (palI[i] - q.x) / (palI[i] -  palI[i-1]);
-                  p.x = cc * palR[i-1] + (1.0 - cc)*palR[i];
-                  p.y = cc * palG[i-1] + (1.0 - cc)*palG[i];
-                  p.z = cc * palB[i-1] + (1.0 - cc)*palB[i];
-            }
-          }
-          if(q.x >= palI[N-1]){
-              p.x = palR[N-1];
-              p.y = palG[N-1];
-              p.z = palB[N-1];
-          }
+      vec4 p = texture2D(src, gl_TexCoord[0].xy);
+      if (shader_c == 2)
+         p = vec4(p.x, p.w, 0.0, 0.0);
+      float vmin = 3.4e38, vmax = -3.4e38, sum = 0.0, n = 0.0;
+      for (int i = 0; i < 4; i++) {
+         float v = p[i];
+         if (i < shader_c && v == v && abs(v) < 3.4e38) {
+            vmin = min(vmin, v);
+            vmax = max(vmax, v);
+            sum += v;
+            n += 1.0;
+         }
       }
+      gl_FragColor = vec4(vmin, vmax, sum/max(n, 1.0), 1.0);
+   }
+   """
 
+viewport_reduce_shader = """
+   // each pixel gets the min and max of a 4x4 block of the previous level
+   uniform sampler2D src;
+   uniform vec2 _srcsz;     // size of the previous level
+   uniform vec2 _texsz;     // size of the texture holding it
 
-       gl_FragColor = clamp(p, 0.0, 1.0);
+   void main (void)
+   {
+      vec2 base = floor(gl_FragCoord.xy)*4.0;
+      vec2 r = vec2(3.4e38, -3.4e38);
+      for (int j = 0; j < 4; j++)
+         for (int i = 0; i < 4; i++) {
+            vec2 q = min(base + vec2(float(i), float(j)), _srcsz - 1.0) + 0.5;
+            vec4 p = texture2D(src, q/_texsz);
+            r = vec2(min(r.x, p.x), max(r.y, p.y));
+         }
+      gl_FragColor = vec4(r, 0.0, 1.0);
    }
    """
 
-sentinel2_shader = """
+viewport_histogram_shader = """
+   // pixel i counts the visible pixels whose mean falls in the bin i,
+   // the image is sampled on a grid of 64x64 points
    uniform sampler2D src;
+   uniform vec2 _srcsz;
+   uniform vec2 _texsz;
+   uniform float shader_a;  // bins per unit
+   uniform float shader_b;  // start of the first bin
+   uniform float _nbins;
 
    void main (void)
    {
-      float palette[36];
-      palette[0]  = 0.0; palette[1]  = 0.0; palette[2]  = 0.0;  // black
-      palette[3]  = 1.0; palette[4]  = 0.0; palette[5]  = 0.0;  // red
-      palette[6]  = 0.2; palette[7]  = 0.2; palette[8]  = 0.2;  // dark grey
-      palette[9]  = 0.4; palette[10] = 0.2; palette[11] = 0.2;  // brown
-      palette[12] = 0.1; palette[13] = 0.9; palette[14] = 0.1;  // green
-      palette[15] = 1.0; palette[16] = 1.0; palette[17] = 0.0;  // yellow
-      palette[18] = 0.0; palette[19] = 0.0; palette[20] = 1.0;  // blue
-      palette[21] = 0.4; palette[22] = 0.4; palette[23] = 0.4;  // medium grey
-      palette[24] = 0.6; palette[25] = 0.6; palette[26] = 0.6;  // light grey
-      palette[27] = 0.9; palette[28] = 0.9; palette[29] = 0.9;  // white
-      palette[30] = 0.0; palette[31] = 1.0; palette[32] = 1.0;  // light blue
-      palette[33] = 1.0; palette[34] = 0.0; palette[35] = 1.0;  // pink
-
-      vec4 p = texture2D(src, gl_TexCoord[0].xy);
-      float t = p.x;
-      int i = int(t);
-      if (i < 0) i = 0;
-      if (i > 11) i = 11;
-      p.x = palette[3*i+0];
-      p.y = palette[3*i+1];
-      p.z = palette[3*i+2];
-      p.w = 1.0;
-      gl_FragColor = p;
+      float bin = floor(gl_FragCoord.x), count = 0.0;
+      for (int j = 0; j < 64; j++)
+         for (int i = 0; i < 64; i++) {
+            vec2 q = floor((vec2(float(i), float(j)) + 0.5)/64.0*_srcsz) + 0.5;
+            vec4 p = texture2D(src, q/_texsz);
+            float b = clamp(floor((p.z - shader_b)*shader_a), 0.0, _nbins - 1.0);
+            if (p.x <= p.y && b == bin)
+               count += 1.0;
+         }
+      gl_FragColor = vec4(count, 0.0, 0.0, 1.0);
    }
    """
 
@@ -524,14 +481,297 @@ SHADERS = {
       'oflow': oflow_shader,
       'rb'   : rb_shader, 
       'dhsv' : depth_shader_hsv,
-      'djet' : depth_shader_jet,
-      'ddirt': depth_shader_dirt,
-      'dem'  : DEM_shader,
+      'lut'  : lut_shader,
       'rgb'  : rgb_shader,
-      's2l2a': sentinel2_shader,
+      'vrange' : viewport_range_shader,
+      'vreduce': viewport_reduce_shader,
+      'vhist'  : viewport_histogram_shader,
       }
 SHADER_PROGRAMS = {}
 
+# palettes available for each number of channels: (shader or colormap name, inv_param)
+# the key 1 cycles through them
+PALETTES = {
+      1 : [('rgba',0), ('djet',0), ('dhsv',0), ('djet',1), ('dem',1), ('rgba',1), ('bayer',0), ('s2l2a',0)],
+      2 : [('rb',0), ('oflow',0)],
+      3 : [('rgba',0), ('hsv',0), ('rgba',1), ('rgb',0)],
+      }
+
+
+##### COLORMAPS
+# the colormaps are baked in a 1D texture and drawn with the lut shader,
+# or read by the shaders listed in SHADER_COLORMAPS
+class Colormap:
+   ''' the colors of n samples of [0,1], the colors below and above the
+       range and the color of NaN. A raw colormap is indexed by the pixel
+       values instead (categories) '''
+   def __init__(self, colors, under=None, over=None, nan=(0,0,0), raw=0):
+      self.colors = colors
+      self.under  = under if under else colors[0]
+      self.over   = over if over else colors[-1]
+      self.nan    = nan
+      self.raw    = raw
+
+def interpolate_points(points, x):
+   ''' piecewise linear function through the sorted points (x, value) '''
+   if x <= points[0][0]:
+      return points[0][1]
+   for (x0,y0), (x1,y1) in zip(points[:-1], points[1:]):
+      if x <= x1:
+         return y0 + (y1-y0)*(x-x0)/(x1-x0) if x1 > x0 else y1
+   return points[-1][1]
+
+def colormap_from_points(points, n=1024, **kw):
+   ''' Colormap sampling n colors from the control points (x, (r,g,b)) '''
+   colors = []
+   for i in range(n):
+      x = i/(n-1.0)
+      colors.append(tuple(interpolate_points([(p[0],p[1][c]) for p in points], x) for c in range(3)))
+   return Colormap(colors, **kw)
+
+def jet_color(x):
+   # the values out of range use darker colors, avoiding the darkest shade of blue
+   x = x/1.15 + 0.1
+   return tuple(min(max(1.5 - 4*abs(x - c), 0.0), 1.0) for c in (.75, .5, .25))
+
+def hue_color(h):
+   return tuple(min(max(abs((h + k) % 1.0 * 6 - 3) - 1, 0.0), 1.0) for k in (1.0, 2/3.0, 1/3.0))
+
+def dirt_colormap():
+   R = [(0,1.), (35,1.), (82.5,.54), (91,.41), (97.5,.25), (100,.2)]
+   G = [(0,1.), (4,1.), (15,.8), (25,.7), (85,.22), (100,0.)]
+   B = [(0,1.), (10,.35), (21,.4), (24,0.), (100,0.)]
+   colors = [tuple(interpolate_points([(x/100.0, y) for x,y in ch], 1-i/1023.0) for ch in (R,G,B))
+             for i in range(1024)]
+   return Colormap(colors)
+
+# the 'd*' colormaps show the high values with the first colors: their
+# control points are given for 1-t
+COLORMAPS = {
+      'djet' : Colormap([jet_color(1-i/1023.0) for i in range(1024)], 
+                        under=jet_color(1.05), over=jet_color(-0.05)),
+      'ddirt': dirt_colormap(),
+      # http://soliton.vm.bytemark.co.uk/pub/cpt-city/td/tn/DEM_poster.png.index.html
+      'dem'  : colormap_from_points([(1-x, c) for x, c in [
+                  (0.00000, (0.00000, 0.38039, 0.27843)), (0.01020, (0.06275, 0.47843, 0.18431)),
+                  (0.10200, (0.90980, 0.84314, 0.49020)), (0.24490, (0.63137, 0.26275, 0.00000)),
+                  (0.34690, (0.61961, 0.00000, 0.00000)), (0.57140, (0.43137, 0.43137, 0.43137)),
+                  (0.81630, (1.00000, 1.00000, 1.00000)), (1.00000, (1.00000, 1.00000, 1.00000))][::-1]]),
+      # sentinel-2 L2A scene classification, indexed by the pixel values
+      's2l2a': Colormap([(0.0,0.0,0.0), (1.0,0.0,0.0), (0.2,0.2,0.2), (0.4,0.2,0.2),
+                         (0.1,0.9,0.1), (1.0,1.0,0.0), (0.0,0.0,1.0), (0.4,0.4,0.4),
+                         (0.6,0.6,0.6), (0.9,0.9,0.9), (0.0,1.0,1.0), (1.0,0.0,1.0)], raw=1),
+      # one sample per degree
+      'hue'  : Colormap([hue_color(i/360.0) for i in range(361)]),
+      }
+
+# colormaps read by other shaders
+SHADER_COLORMAPS = { 'oflow': 'hue', 'hsv': 'hue' }
+
+
+def load_colormap(filename):
+   ''' reads a colormap from a text file and adds it to the palettes of the
+       single channel images. Each line has either the r g b values of 
+       evenly spaced samples of [0,1], or x r g b control points. Values 
+       above 1 are taken in [0,255]. Lines starting with 'under', 'over' 
+       or 'nan' followed by r g b set those colors, # starts a comment. 
+       The palette is named file:BASENAME, apart from the built-in ones. '''
+   import os
+   name = 'file:' + os.path.splitext(os.path.basename(filename))[0]
+   if name in COLORMAPS:
+      raise ValueError('%s: a colormap named %s is already loaded'%(filename, name))
+   points, extra = [], {}
+   with open(filename) as f:
+      for line in f:
+         fields = line.split('#')[0].split()
+         if not fields:
+            continue
+         if fields[0] in ('under', 'over', 'nan'):
+            extra[fields[0]] = tuple(float(v) for v in fields[1:4])
+         else:
+            points.append([float(v) for v in fields])
+   if len(points) < 2 or len(set(len(p) for p in points)) != 1 or len(points[0]) not in (3,4):
+      raise ValueError('%s: expected at least two lines of "r g b" or "x r g b"'%filename)
+   scale = 255.0 if max(max(p[-3:]) for p in points) > 1 else 1.0
+   for k in extra:
+      extra[k] = tuple(v/scale for v in extra[k])
+   if len(points[0]) == 3:
+      points = [[i/(len(points)-1.0)] + p for i,p in enumerate(points)]
+   points = sorted((p[0], tuple(v/scale for v in p[1:])) for p in points)
+   COLORMAPS[name] = colormap_from_points(points, **extra)
+   PALETTES[1].append((name, 0))
+   return name
+
+
+LUT_TEXTURE_ID = 6   # the reduction uses 7-10, the HUD font 11 and 12, the image tiles from 13
+current_lut = None
+
+def use_colormap(P, name):
+   ''' binds the lut of the colormap to the texture unit 1 and sets the uniforms of P,
+       the lut is uploaded again only when the colormap changes '''
+   global current_lut
+   import ctypes
+   cmap = COLORMAPS[name]
+   glActiveTexture(GL_TEXTURE1)
+   glBindTexture(GL_TEXTURE_1D, LUT_TEXTURE_ID)
+   if current_lut != name:
+      texels = []
+      for c in [cmap.under] + cmap.colors + [cmap.over]:
+         texels += [c[0], c[1], c[2], 1.0]
+      glTexParameteri(GL_TEXTURE_1D, GL_TEXTURE_MAG_FILTER, GL_LINEAR)
+      glTexParameteri(GL_TEXTURE_1D, GL_TEXTURE_MIN_FILTER, GL_LINEAR)
+      glTexParameteri(GL_TEXTURE_1D, GL_TEXTURE_WRAP_S, GL_CLAMP_TO_EDGE)
+      glTexImage1D(GL_TEXTURE_1D, 0, GL_RGBA32F, len(texels)//4, 0, GL_RGBA, GL_FLOAT,
+                   (ctypes.c_float*len(texels))(*texels))
+      current_lut = name
+   glActiveTexture(GL_TEXTURE0)
+   P.uniform1i(b"lut", 1)
+   P.uniform1f(b"_lutsz", len(cmap.colors)+2)
+   P.uniform1i(b"_lutraw", cmap.raw)
+   P.uniform4f(b"_lutnan", cmap.nan[0], cmap.nan[1], cmap.nan[2], 1.0)
+
+
+class FragmentProgram:
+   ''' a compiled shader program with its uniform locations and the last
+       values sent to each uniform, so that only the changed values are sent '''
+   def __init__(self, source):
+      # reuse the binary of a previous run if possible
+      cachefile = program_binary_cache_filename(source)
+      self.program = load_program_binary(cachefile) if cachefile else None
+      if cachefile:
+         S.count('shader_binary_cache_hits' if self.program else 'shader_binary_cache_misses')
+      if not self.program:
+         # linked here instead of compileProgram, whose validation fails while the
+         # samplers of the lut shaders still point to the same texture unit
+         from OpenGL.GL.shaders import compileShader
+         shader = compileShader(source, GL_FRAGMENT_SHADER)
+         self.program = glCreateProgram()
+         glAttachShader(self.program, shader)
+         if cachefile:
+            glProgramParameteri(self.program, GL_PROGRAM_BINARY_RETRIEVABLE_HINT, GL_TRUE)
+         glLinkProgram( self.program )
+         if glGetProgramiv(self.program, GL_LINK_STATUS) != GL_TRUE:
+            raise RuntimeError(glGetProgramInfoLog(self.program))
+         glDeleteShader(shader)
+         if cachefile:
+            save_program_binary(self.program, cachefile)
+      self.locations = {}
+      self.values = {}
+
+   def location(self, name):
+      if name not in self.locations:
+         self.locations[name] = glGetUniformLocation(self.program, name)
+      return self.locations[name]
+
+   def changed(self, name, value):
+      ''' returns the location of the uniform if value differs from the last one sent '''
+      if self.values.get(name) == value:
+         return -1
+      self.values[name] = value
+      return self.location(name)
+
+   def uniform1f(self, name, a):
+      loc = self.changed(name, a)
+      if loc >= 0: glUniform1f(loc, a)
+
+   def uniform1i(self, name, a):
+      loc = self.changed(name, a)
+      if loc >= 0: glUniform1i(loc, a)
+
+   def uniform2f(self, name, a, b):
+      loc = self.changed(name, (a,b))
+      if loc >= 0: glUniform2f(loc, a, b)
+
+   def uniform4f(self, name, a, b, c, d):
+      loc = self.changed(name, (a,b,c,d))
+      if loc >= 0: glUniform4f(loc, a, b, c, d)
+
+
+##### SHADER PROGRAM BINARY CACHE
+# with GL_ARB_get_program_binary the linked programs are stored in 
+# ~/.cache/pvflip/shaders so the next runs don't compile the GLSL again
+def program_binary_cache_filename(source):
+   ''' returns the name of the file caching the binary of the program 
+       compiled from source, or None if program binaries are not supported '''
+   import os, hashlib
+   if not glGetProgramBinary or not glProgramBinary:
+      return None
+   if glGetIntegerv(GL_NUM_PROGRAM_BINARY_FORMATS) < 1:
+      return None
+   cachedir = os.environ.get('XDG_CACHE_HOME', os.path.join(os.path.expanduser('~'), '.cache'))
+   # the binaries are only valid for the same driver 
+   key = hashlib.sha1()
+   for k in (glGetString(GL_VENDOR), glGetString(GL_RENDERER), glGetString(GL_VERSION)):
+      key.update(k or b'')
+   key.update(source.encode('utf-8'))
+   return os.path.join(cachedir, 'pvflip', 'shaders', key.hexdigest() + '.bin')
+
+
+def load_program_binary(filename):
+   ''' returns a program created from the cached binary, or None '''
+   import struct
+   from OpenGL.error import GLError
+   try:
+      with open(filename, 'rb') as f:
+         data = f.read()
+   except (IOError, OSError):
+      return None
+   if len(data) <= 4:
+      return None
+   binary_format = struct.unpack('<I', data[:4])[0]
+   program = glCreateProgram()
+   try:
+      glProgramBinary(program, binary_format, data[4:], len(data)-4)
+   except GLError:
+      pass
+   # the binary is rejected if the driver has changed
+   if glGetProgramiv(program, GL_LINK_STATUS) != GL_TRUE:
+      glDeleteProgram(program)
+      return None
+   return program
+
+
+def save_program_binary(program, filename):
+   import os, struct, ctypes
+   n = glGetProgramiv(program, GL_PROGRAM_BINARY_LENGTH)
+   if n <= 0:
+      return
+   binary = ctypes.create_string_buffer(n)
+   length, binary_format = GLsizei(0), GLenum(0)
+   glGetProgramBinary(program, n, ctypes.byref(length), ctypes.byref(binary_format), binary)
+   try:
+      if not os.path.isdir(os.path.dirname(filename)):
+         os.makedirs(os.path.dirname(filename))
+      # write and rename, so that concurrent instances never read half a file
+      tmpname = '%s.%d'%(filename, os.getpid())
+      with open(tmpname, 'wb') as f:
+         f.write(struct.pack('<I', binary_format.value))
+         f.write(binary.raw[:length.value])
+      os.rename(tmpname, filename)
+   except (IOError, OSError) as e:
+      print('cannot cache the shader binary: %s'%e)
+
+
+def precompile_next_shader():
+   ''' compiles one of the SHADERS that has not been used yet,
+       returns True if there are more left to compile '''
+   for name in SHADERS:
+      if name not in SHADER_PROGRAMS:
+         SHADER_PROGRAMS[name] = FragmentProgram(SHADERS[name])
+         break
+   return len(SHADER_PROGRAMS) < len(SHADERS)
+
+
+current_program = 0
+
+def use_program(program):
+   ''' calls glUseProgram only if program is not already in use '''
+   global current_program
+   if program != current_program:
+      glUseProgram(program)
+      current_program = program
+
+
 def use_shader_program(name):
    ##########
    ######## SETUP FRAGMENT SHADER FOR CONTRAST CHANGE
@@ -544,23 +784,42 @@ def use_shader_program(name):
    # programs, shaders, and the current program are global variables
    global program, SHADERS, SHADER_PROGRAMS
    if name not in SHADER_PROGRAMS:
-      SHADER_PROGRAMS[name] = compileProgram(
-            compileShader(SHADERS[name], GL_FRAGMENT_SHADER),
-            );
-      glLinkProgram( SHADER_PROGRAMS[name] )
+      SHADER_PROGRAMS[name] = FragmentProgram(SHADERS[name])
    program = SHADER_PROGRAMS[name]
    # try to activate/enable shader program
    # handle errors wisely
    try:
-      glUseProgram(program)   
+      use_program(program.program)
    except OpenGL.error.GLError:
-      print(glGetProgramInfoLog(program))
+      print(glGetProgramInfoLog(program.program))
       raise
+   return program
+
+
+#### COMMAND LINE OPTIONS
+class ProgramOptions:
+   # --half : store the textures as 16 bit floats (halves the GPU memory)
+   half_float = 0
+   # --stats-file FILE : where the timers are written as JSON (at exit and with shift-T)
+   stats_file = None
+   # --record FILE : write the input events to FILE (see EventTrace)
+   record_file = None
+   # --replay FILE : replay the events of FILE at full speed, then exit
+   replay_file = None
+   # --reuse : send the images to the running viewer, or become it
+   reuse = 0
+   # --startup-profile : print the time spent in each step until the first frame
+   startup_profile = 0
+   # --stream SOURCE : show the images read from SOURCE as they arrive (see FrameStream)
+   stream = None
+   # --shm NAME : the same for the frames of the shared memory feed NAME (see shmfeed.py)
+   shared_stream = 0
 
 
 #### INTERFACE STATE
 class ViewportState:
    winx,winy=0,0
+   window = None          # set once the first frame is drawn
    zoom_param  = 1
    scale_param = 1.0      ## TODO internal variables should not be here
    bias_param  = 0
@@ -594,24 +853,32 @@ class ViewportState:
    #if the window has been resized by the used then automatic resize will be disabled
    window_has_been_resized_by_the_user = 0  
 
-   # mute and buffer fast events  
-   mute_keyboard=0
-   mute_sweep=0
-   mute_wheel=0
-   mute_wheel_buffer=[0,0] 
+   # window title, updated at most every title_interval seconds
+   title=''
+   title_shown=''
+   title_time=0
+   title_interval=0.1
 
    # HUD info
    display_hud = 1
+   display_stats = 0
    txt_val='0'
    txt_pos='0,0'
 
+   # statistics of the region selected with the right button
+   selection = None              # x0,y0,x1,y1 in image coordinates
+   selection_image = None        # the image used for txt_selection
+   selection_histogram = None
+   txt_selection = ''
+
    # not clear yet
    data_min = 0
    data_max = 255
 
    # VISUALIZE FLOW
    TOGGLE_FLOW_COLORS = 0
-   TOGGLE_AUTOMATIC_RANGE = 0
+   TOGGLE_AUTOMATIC_RANGE = 0   # 1: range of the image, 2: range of the visible pixels
+   viewport_histogram = None
    TOGGLE_FIT_TO_WINDOW_SIZE = 0
 
 
@@ -650,8 +917,11 @@ class ViewportState:
       V.update_scale_and_bias()
    
    def reset_scale_bias(V):
-      V.v_radius=(V.data_max-V.data_min)/2.0
-      V.v_center=(V.data_max+V.data_min)/2.0
+      V.set_range(V.data_min, V.data_max)
+
+   def set_range(V, vmin, vmax):
+      V.v_radius=(vmax-vmin)/2.0
+      V.v_center=(vmax+vmin)/2.0
       V.v_center_vector[0] = V.v_center
       V.v_center_vector[1] = V.v_center
       V.v_center_vector[2] = V.v_center
@@ -746,20 +1016,147 @@ class ImageState:
    v_max = 0
    v_min = 0
    mtime = 0
+   # block summaries of the tiles used by region_stats, built on demand
+   stats_summaries = None
+   # low resolution tile shown stretched where the tiles are not uploaded yet
+   preview = None
+   # for the large JPEG images: the preview is the image decoded at 1/reduced 
+   # of its size (0: not reduced), the tiles are decoded (loading) once the
+   # zoom needs them or full_needed is set. For the RAW files the preview is
+   # their RGB thumbnail
+   reduced = 0
+   loading = None
+   full_needed = 0
+   thumbnail = 0
+   # the preview as an image of its own, read by the probes meanwhile
+   reduced_probes = None
+
+   def tile_index(self,x,y):
+      ''' index of the tile containing the pixel x,y: the tiles are stored
+          by rows and all of them have the size of the first one (except the last ones) '''
+      tw,th = self.imageBitmapTiles[0][3], self.imageBitmapTiles[0][4]
+      return (y//th)*((self.w + tw - 1)//tw) + x//tw
+
+   def approximate(self):
+      ''' only the reduced image is loaded: the probes read its preview '''
+      return bool(self.reduced and self.preview and not self.imageBitmapTiles)
+
+   def reduced_image(self):
+      ''' the preview of a reduced image as an ImageState of the preview size '''
+      P = self.reduced_probes
+      if P is None or P.imageBitmapTiles[0] is not self.preview:
+         P = self.reduced_probes = ImageState()
+         P.imageBitmapTiles = [self.preview]
+         P.w, P.h, P.nch = self.preview[3], self.preview[4], self.preview[5]
+      return P
+
+   def reduced_region(self,x0,y0,x1,y1):
+      ''' the reduced image and the region of its pixels covering [x0,x1)x[y0,y1) '''
+      P = self.reduced_image()
+      return P, x0*P.w//self.w, y0*P.h//self.h, -(-x1*P.w//self.w), -(-y1*P.h//self.h)
 
    def get_image_point(self,x,y):
-      if x>=0 and y>=0 and x<self.w and y<self.h:
+      if self.approximate():
+         P = self.reduced_image()
+         return P.get_image_point(x*P.w//self.w, y*P.h//self.h)
+      if x>=0 and y>=0 and x<self.w and y<self.h and self.imageBitmapTiles:
          #### ACCESS THE RIGHT TILE
-         for tile in self.imageBitmapTiles:
-            if tile[1] <= x and tile[2] <= y and tile[1]+tile[3] > x and tile[2]+tile[4] > y:
-               idx = (x-tile[1]+(y-tile[2])*tile[3])*tile[5]
-               return tile[0][idx:idx+tile[5]]
-         # this should never happen
-         print("this should never happen")
-         return None
+         tile = self.imageBitmapTiles[self.tile_index(x,y)]
+         idx = (x-tile[1]+(y-tile[2])*tile[3])*tile[5]
+         return tile[0][idx:idx+tile[5]]
       else:
          return None
 
+   def get_image_region(self,x0,y0,w,h):
+      ''' returns the pixels of the region [x0,x0+w)x[y0,y0+h) clipped to the image
+          as a flat list (rows, then interleaved channels), and its clipped size.
+          The data is copied with one slice per row and tile, not per pixel. 
+          For a reduced image these are the pixels of its preview covering 
+          the region, and their size. '''
+      if self.approximate():
+         P, px0, py0, px1, py1 = self.reduced_region(x0, y0, x0+w, y0+h)
+         return P.get_image_region(px0, py0, px1-px0, py1-py0)
+      x1,y1 = min(x0+w, self.w), min(y0+h, self.h)
+      x0,y0 = max(x0, 0), max(y0, 0)
+      if x1 <= x0 or y1 <= y0 or not self.imageBitmapTiles:   # or only the preview is loaded
+         return [], 0, 0
+      out = []
+      for y in range(y0, y1):
+         first, last = self.tile_index(x0,y), self.tile_index(x1-1,y)
+         for tile in self.imageBitmapTiles[first:last+1]:
+            a = max(x0, tile[1]) - tile[1]
+            b = min(x1, tile[1]+tile[3]) - tile[1]
+            base = (y-tile[2])*tile[3]
+            out.extend(tile[0][(base+a)*tile[5]:(base+b)*tile[5]])
+      return out, x1-x0, y1-y0
+
+   def get_image_window_mean(self,x,y,radius=2):
+      ''' mean of the finite values of each channel in the (2*radius+1)^2 
+          window centered at x,y (NaN for a channel without finite values),
+          computed in C by region_stats '''
+      stats = self.region_stats(x-radius, y-radius, x+radius+1, y+radius+1)
+      return stats[1] if stats else None
+
+   def tiles_in_region(self,x0,y0,x1,y1):
+      ''' the (index, tile) pairs intersecting the region [x0,x1)x[y0,y1) inside the image '''
+      stride = self.tile_index(self.w-1,0) + 1     # tiles per row
+      first, last = self.tile_index(x0,y0), self.tile_index(x1-1,y1-1)
+      cols = range(first % stride, last % stride + 1)
+      rows = range(first // stride, last // stride + 1)
+      return [(r*stride+c, self.imageBitmapTiles[r*stride+c]) for r in rows for c in cols]
+
+   def region_stats(self,x0,y0,x1,y1):
+      ''' statistics of each channel in the region [x0,x1)x[y0,y1): returns the number
+          of pixels and the lists of mean, std, min, max and count of non finite values.
+          The block summaries of a tile are computed the first time it is used,
+          after that a region costs O(perimeter) instead of O(area). For a 
+          reduced image they are those of its preview '''
+      import piio, math
+      if self.approximate():
+         P, x0, y0, x1, y1 = self.reduced_region(x0, y0, x1, y1)
+         return P.region_stats(x0, y0, x1, y1)
+      x0,y0 = max(x0,0), max(y0,0)
+      x1,y1 = min(x1,self.w), min(y1,self.h)
+      if x1 <= x0 or y1 <= y0 or not self.imageBitmapTiles:
+         return None
+      if self.stats_summaries is None:
+         self.stats_summaries = {}
+      acc = piio.new_region_stats(self.nch)
+      for idx, tile in self.tiles_in_region(x0,y0,x1,y1):
+         if idx not in self.stats_summaries:
+            self.stats_summaries[idx] = piio.tile_stats_summary(tile)
+         piio.tile_region_stats(tile, self.stats_summaries[idx],
+               max(x0,tile[1])-tile[1], max(y0,tile[2])-tile[2],
+               min(x1,tile[1]+tile[3])-tile[1], min(y1,tile[2]+tile[4])-tile[2], acc)
+      n = (x1-x0)*(y1-y0)
+      ssum, ssum2, count, vmin, vmax = acc
+      mean, std = [], []
+      for c in range(self.nch):
+         if count[c]:
+            mean.append(ssum[c]/count[c])
+            std.append(math.sqrt(max(ssum2[c]/count[c] - mean[c]**2, 0)))
+         else:
+            mean.append(float('nan')); std.append(float('nan'))
+      nonfinite = [n - int(count[c]) for c in range(self.nch)]
+      return n, mean, std, list(vmin), list(vmax), nonfinite
+
+   def region_histogram(self,x0,y0,x1,y1,lo,hi,nbins=128):
+      ''' histogram of each channel in the region [x0,x1)x[y0,y1), nbins bins in [lo,hi] '''
+      import piio, ctypes
+      if self.approximate():
+         P, x0, y0, x1, y1 = self.reduced_region(x0, y0, x1, y1)
+         return P.region_histogram(x0, y0, x1, y1, lo, hi, nbins)
+      x0,y0 = max(x0,0), max(y0,0)
+      x1,y1 = min(x1,self.w), min(y1,self.h)
+      hist = (ctypes.c_double*(nbins*self.nch))()
+      if x1 > x0 and y1 > y0 and self.imageBitmapTiles:
+         for idx, tile in self.tiles_in_region(x0,y0,x1,y1):
+            piio.tile_region_histogram(tile,
+                  max(x0,tile[1])-tile[1], max(y0,tile[2])-tile[2],
+                  min(x1,tile[1]+tile[3])-tile[1], min(y1,tile[2]+tile[4])-tile[2],
+                  lo, hi, hist)
+      return [list(hist[c*nbins:(c+1)*nbins]) for c in range(self.nch)]
+
 
 
 ## TODO MERGE D AND DD
@@ -769,6 +1166,7 @@ class DataBackend:
    pass
    
 
+O = ProgramOptions()
 V = ViewportState()
 D = ImageState()
 DD = {}
@@ -776,11 +1174,39 @@ current_image_idx=0
 
 
 
-def load_image(imagename):
+def load_image(imagename, timings=None, preview=None):
+   ''' if preview is a function, the image is decoded in a thread and 
+       preview(tile, w, h) is called with a low resolution copy of the 
+       image as soon as it is available '''
+   # the frames of --stream are read by F
+   if imagename == F.source:
+      return F.latest()
+   # already decoded (or being decoded) by start_loading
+   job = LOADING.pop(imagename, None)
+   if preview and not job:
+      job = start_loading(imagename)
+      del LOADING[imagename]
+   if job:
+      shown = False
+      while job['thread'].is_alive():
+         job['thread'].join(0.005)
+         if preview and job['preview'] and not shown and job['thread'].is_alive():
+            preview(*job['preview'])
+            shown = True
+         # keep the window responsive, the input events wait in I
+         if V.window:
+            glfw.poll_events()
+      if timings is not None:
+         timings.update(job['timings'])
+      if 'error' in job:
+         print('error reading the image: %s'%job['error'])
+         raise IOError
+      return job['result']
+
    import piio
    try:
 #      im,w,h,nch = piio.read_buffer(imagename)
-      tiles,w,h,nch,vmin,vmax = piio.read_tiled_buffers(imagename)
+      tiles,w,h,nch,vmin,vmax = piio.read_tiled_buffers(imagename, timings)
 #      (im,x0,y0,w,h,nch) = tiles[0]
 #      v_min,v_max=0.0,255.0
 #      v_min,v_max = piio.minmax(im)
@@ -791,6 +1217,74 @@ def load_image(imagename):
       raise IOError
 
 
+# camera RAW files, read by LibRaw
+RAW_EXTENSIONS = ('.3fr', '.arw', '.cr2', '.cr3', '.crw', '.dcr', '.dng', '.erf',
+      '.iiq', '.k25', '.kdc', '.mef', '.mos', '.mrw', '.nef', '.nrw', '.orf',
+      '.pef', '.raf', '.raw', '.rw2', '.rwl', '.sr2', '.srf', '.srw', '.x3f')
+
+def read_reduced_image(filename):
+   ''' a reduced image shown instead of the decoded tiles, if that is enough 
+       for the current zoom: large JPEG images are decoded at 1/2, 1/4 or 1/8 
+       of their size (libjpeg reduces them in the DCT), large camera RAW files
+       are replaced by their embedded thumbnail. Returns (tile, w, h, 
+       reduction, thumbnail) or None '''
+   import piio, os
+   # the zoom in pixels of the framebuffer (retina displays)
+   scale = get_framebuffer_size(V.window)[0]*1.0/max(V.winx, 1)
+   if os.path.splitext(filename)[1].lower() in RAW_EXTENSIONS:
+      thumb = piio.read_raw_thumbnail(filename, int(max(V.winx, V.winy)*scale))
+      if not thumb or thumb[1]*thumb[2] < PREVIEW_MIN_PIXELS:
+         return None
+      return thumb + (thumb[1]*1.0/thumb[0][3], 1)
+   size = piio.jpeg_size(filename)
+   if not size:
+      return None
+   if size[0]*size[1] < PREVIEW_MIN_PIXELS:
+      return None
+   w, h = size
+   zoom = V.zoom_param
+   if V.TOGGLE_FIT_TO_WINDOW_SIZE:
+      zoom = min(V.winx*1.0/w, V.winy*1.0/h)
+   reduction = 8
+   while reduction > 1 and reduction*zoom*scale > 1:
+      reduction //= 2
+   if reduction == 1:
+      return None
+   reduced = piio.read_jpeg_scaled(filename, reduction)
+   return reduced + (reduction, 0) if reduced else None
+
+
+def update_reduced_image():
+   ''' starts decoding the full resolution of D when the zoom magnifies the
+       pixels of its reduced image (or the palettes of a RAW are needed), 
+       and uses it once it's ready '''
+   if not D.reduced:
+      return
+   if not D.loading:
+      zoom = V.zoom_param*get_framebuffer_size(V.window)[0]*1.0/max(V.winx, 1)
+      if D.reduced*zoom > 1 or D.full_needed:
+         D.loading = start_loading(D.filename, preview=False)
+         del LOADING[D.filename]
+      return
+   if D.loading['thread'].is_alive():
+      return
+   job, D.loading = D.loading, None
+   if 'error' in job:
+      print('error reading the image: %s'%job['error'])
+      D.reduced = 0    # don't retry, only the reduced image is shown
+      return
+   for name in job['timings']:
+      S.add(name, job['timings'][name])
+   D.imageBitmapTiles,D.w,D.h,D.nch,D.v_min,D.v_max = job['result']
+   D.reduced = 0
+   V.selection_image = None   # its stats were those of the reduced image
+   setupImageTextures(D)
+   V.data_min, V.data_max = D.v_min, D.v_max
+   # the values of the RAW mosaic are unrelated to those of its thumbnail
+   if V.TOGGLE_AUTOMATIC_RANGE or D.thumbnail: V.reset_scale_bias()
+   V.redisp = 1
+
+
 def insert_images(filenames):
    global current_image_idx
    import sys
@@ -841,27 +1335,62 @@ def change_image(new_idx):
          print(new_filename + ' has changed. Reloading...')
          DD.pop(new_idx)
 
+   S.start_switch()
+
    # the image seems to be there
    if new_idx not in DD:
+      S.count('image_cache_misses')
+      previous = D
       # load_image may trow an exception if the file is not readable or it doesn't exist
       try:
          T = DD[new_idx] = ImageState()
 
+         def show_preview(tile, w, h):
+            ''' shows the preview of a large image while the rest is decoded '''
+            global D
+            if w*h < PREVIEW_MIN_PIXELS:
+               return
+            T.preview, T.w, T.h, T.nch = tile, w, h, tile[5]
+            T.imageBitmapTiles, T.filename = [], new_filename
+            T.v_min, T.v_max = piio.minmax(tile[0])
+            D = T
+            setupImageTextures(T)
+            V.data_min, V.data_max = T.v_min, T.v_max
+            if V.TOGGLE_AUTOMATIC_RANGE: V.reset_scale_bias()
+            V.redisp = 1
+            draw_frame(V.window)
+
          tic()
          # read the image
-         T.imageBitmapTiles,T.w,T.h,T.nch,T.v_min,T.v_max = load_image(new_filename)
+         timings = {}
+         import piio
+         with S.timer('load'):
+            reduced = read_reduced_image(new_filename) if V.window and new_filename != F.source else None
+            if reduced:
+               T.preview, T.w, T.h, T.reduced, T.thumbnail = reduced
+               T.imageBitmapTiles, T.nch = [], T.preview[5]
+               T.v_min, T.v_max = piio.minmax(T.preview[0])
+            else:
+               T.imageBitmapTiles,T.w,T.h,T.nch,T.v_min,T.v_max = load_image(new_filename, timings,
+                     show_preview if V.window else None)
+         for name in timings:
+            S.add(name, timings[name])
          T.filename = new_filename
          try:   # if mtime cannot be read, then set it to -1
-            T.mtime = (stat(new_filename).st_mtime)
+            T.mtime = (stat(new_filename).st_mtime) if new_filename != F.source else -1
          except OSError:
             T.mtime = -1
-         setupTexturesFromImageTiles(T.imageBitmapTiles,T.w,T.h,T.nch)
+         setupImageTextures(T)
          V.data_min, V.data_max =  T.v_min,T.v_max
          toc('loadImage+data->RGBbitmap+texture setup')
 
          D = T     # everything is ok, update the corrent image data
       except IOError:
          DD.pop(new_idx)
+         if D is T:   # only its preview was shown
+            D = previous
+            setupImageTextures(D)
+            V.data_min, V.data_max = D.v_min, D.v_max
          print(new_filename + '. Skipping...')
          sys.argv.pop(new_idx+1)
          if len(sys.argv) == 1: 
@@ -879,11 +1408,12 @@ def change_image(new_idx):
            DD.pop((new_idx+BUFF) % NUM_FILES)
 
    else:
+      S.count('image_cache_hits')
       D = DD[new_idx]
 
       # setup texture 
       #tic()
-      setupTexturesFromImageTiles(D.imageBitmapTiles,D.w,D.h,D.nch)
+      setupImageTextures(D)
       V.data_min, V.data_max=  D.v_min,D.v_max 
       #toc('texture setup')
 
@@ -900,7 +1430,7 @@ x0=0; y0=0; w0=0; h0=0; b0state=''; b1state=''
 
 
 
-def mouseMotion_callback(window, x,y):
+def mouseMotion_event(window, x,y):
     import math 
     global V,D
     global x0,y0,w0,h0,b0state,b1state
@@ -911,18 +1441,19 @@ def mouseMotion_callback(window, x,y):
     ### region selection
     if b1state=='pressed' :
        w0,h0 = tx-x0,ty-y0
+       V.selection = (int(x0),int(y0),int(x0+w0),int(y0+h0))
+       update_selection_stats()
        V.redisp=1
     if b0state=='pressed' :
        V.dragdx,V.dragdy = tx-V.dragx0,ty-V.dragy0
        V.redisp=1
     # adjust bias usign concrete pixel
-    if V.shift_is_pressed and not V.mute_sweep:
+    if V.shift_is_pressed:
        centerval = D.get_image_point(int(tx),int(ty))
        if not (centerval==None or math.isnan(sum(centerval)) or math.isinf(sum(centerval))):
           V.center_update_value(sum(centerval)/len(centerval))
           if len(centerval)==3:
               V.center_update_vector(centerval)
-          V.mute_sweep=1
 
 
     centerval = D.get_image_point(int(tx),int(ty))
@@ -934,7 +1465,9 @@ def mouseMotion_callback(window, x,y):
           V.txt_val = '%s %s'%(centerval[0], centerval[1])
        else:
           V.txt_val = '%s %s %s'%(centerval[0], centerval[1], centerval[2])
-       glfw.set_window_title(window, '%s:[%s]'%(V.txt_pos,V.txt_val))
+       # read from the reduced image
+       if D.approximate(): V.txt_val = '~' + V.txt_val
+       V.title = '%s:[%s]'%(V.txt_pos,V.txt_val)
 
     # Update viewport mouse position
     V.mx, V.my = x, y
@@ -948,19 +1481,51 @@ def mouseMotion_callback(window, x,y):
 
 
 
+def update_selection_stats(histogram=False):
+    ''' statistics of the selected region for the HUD, the histogram is only 
+        computed when requested (at the end of the drag) '''
+    xx0,yy0,xx1,yy1 = V.selection
+    xx0,xx1 = min(xx0,xx1), max(xx0,xx1)
+    yy0,yy1 = min(yy0,yy1), max(yy0,yy1)
+    V.txt_selection = 'Selection%s:\n(%d,%d) %dx%d'%(' ~' if D.approximate() else '',
+          xx0, yy0, xx1-xx0, yy1-yy0)
+    V.selection_image = D
+    V.selection_histogram = None
+    stats = D.region_stats(xx0,yy0,xx1,yy1)
+    if stats is None:
+       return
+    n, mean, std, vmin, vmax, nonfinite = stats
+    for c in range(len(mean)):
+       V.txt_selection += '\n%s%g +-%g [%g, %g]%s'%('%d: '%c if len(mean)>1 else '',
+             mean[c], std[c], vmin[c], vmax[c], 
+             ' nan:%d'%nonfinite[c] if nonfinite[c] else '')
+    if histogram:
+       lo, hi = min(vmin), max(vmax)
+       if lo <= hi:
+          V.selection_histogram = D.region_histogram(xx0,yy0,xx1,yy1,lo,hi)
+
+
+
 def mouseButtons_callback(window, button, action, mods):
+    x, y = get_cursor_pos(window)
+    I.events.append(('button', button, action, mods, x, y))
+    I.arrived('click')
+    E.log('button', button, action, mods, x, y)
+
+def mouseButtons_event(window, button, action, mods):
     global V
     global x0,y0,w0,h0,b0state,b1state
 
     # select region
     if button==glfw.MOUSE_BUTTON_RIGHT and action==glfw.PRESS:
-       x,y = glfw.get_cursor_pos (window)
+       x,y = get_cursor_pos(window)
        x0,y0 = V.compute_image_coordinates(x,y)
        w0,h0=0,0
        b1state='pressed'
+       V.selection, V.selection_histogram = None, None
        V.redisp=1
     elif button==glfw.MOUSE_BUTTON_RIGHT and action==glfw.RELEASE:
-       x,y = glfw.get_cursor_pos (window)
+       x,y = get_cursor_pos(window)
        curr_x,curr_y = V.compute_image_coordinates(x,y)
 #       print(curr_x, curr_y)
        w0,h0 = int(curr_x)-int(x0),int(curr_y)-int(y0)
@@ -970,19 +1535,24 @@ def mouseButtons_callback(window, button, action, mods):
        xx0,yy0,xx1,yy1 = int(xx0),int(yy0),int(xx1),int(yy1)
        print(xx0, yy0, abs(xx1-xx0), abs(yy1-yy0))
 
-       global HELPstr
-       HELPstr="\nSelection:\n(%d,%d) %dx%d"%(xx0, yy0, abs(xx1-xx0), abs(yy1-yy0))
+       # a click without dragging dismisses the selection
+       if xx0==xx1 or yy0==yy1:
+          V.selection, V.selection_histogram, V.txt_selection = None, None, ''
+       else:
+          V.selection = (xx0,yy0,xx1,yy1)
+          update_selection_stats(histogram=True)
+          print(V.txt_selection)
        V.redisp=1
 
     # drag
     if button==glfw.MOUSE_BUTTON_LEFT and action==glfw.PRESS:
-       x,y = glfw.get_cursor_pos (window)
+       x,y = get_cursor_pos(window)
        V.dragx0,V.dragy0 = V.compute_image_coordinates(x,y)
        V.dragdx,V.dragdy=0,0
        b0state='pressed'
        V.redisp=1
     elif button==glfw.MOUSE_BUTTON_LEFT and action==glfw.RELEASE:
-       x,y = glfw.get_cursor_pos (window)
+       x,y = get_cursor_pos(window)
        curr_x,curr_y = V.compute_image_coordinates(x,y)
        V.dragdx,V.dragdy = curr_x-V.dragx0,curr_y-V.dragy0
        b0state='released'
@@ -995,19 +1565,10 @@ def mouseButtons_callback(window, button, action, mods):
 
 
 
-def mouseWheel_callback(window, xoffset, yoffset):
+def mouseWheel_event(window, xoffset, yoffset):
       global V,D
-      if V.mute_wheel:
-         V.mute_wheel_buffer[0]=V.mute_wheel_buffer[0]+xoffset
-         V.mute_wheel_buffer[1]=V.mute_wheel_buffer[1]+yoffset
-         return
-      else:
-         xoffset=xoffset+V.mute_wheel_buffer[0]
-         yoffset=yoffset+V.mute_wheel_buffer[1]
-         V.mute_wheel_buffer = [0,0]
-         V.mute_wheel=1
 
-      curr_x,curr_y = glfw.get_cursor_pos (window)
+      curr_x,curr_y = get_cursor_pos(window)
 
       # zoom
       if V.alt_is_pressed:
@@ -1024,12 +1585,9 @@ def mouseWheel_callback(window, xoffset, yoffset):
 
 
 # letters and numbers
-def keyboard_callback(window, key, scancode, action, mods):
+def keyboard_event(window, key, scancode, action, mods):
     global V,D
 
-    if V.mute_keyboard: # only mute the spacebar event
-       return
-
     key_name = glfw.get_key_name(key, 0);
     # this the actual letter independently of the keyboard
     if type(key_name)!=type(None) and 'A' <= key_name and key_name <= 'z':
@@ -1038,7 +1596,7 @@ def keyboard_callback(window, key, scancode, action, mods):
        key = glfw.__dict__['KEY_%s'%key_name]
 
     # navigate
-    winx, winy= glfw.get_framebuffer_size(window)
+    winx, winy= get_framebuffer_size(window)
     if key==glfw.KEY_RIGHT and (action==glfw.PRESS or action==glfw.REPEAT):
        V.translation_update(winx/4/V.zoom_param,0)
     elif key==glfw.KEY_UP and (action==glfw.PRESS or action==glfw.REPEAT):
@@ -1056,9 +1614,13 @@ def keyboard_callback(window, key, scancode, action, mods):
     if key==glfw.KEY_C and action==glfw.PRESS:
        V.reset_scale_bias()
        if V.shift_is_pressed:
-         V.TOGGLE_AUTOMATIC_RANGE = (V.TOGGLE_AUTOMATIC_RANGE + 1) % 2
-         if V.TOGGLE_AUTOMATIC_RANGE: 
+         V.TOGGLE_AUTOMATIC_RANGE = (V.TOGGLE_AUTOMATIC_RANGE + 1) % 3
+         V.viewport_histogram = None
+         R.view_key = None
+         if V.TOGGLE_AUTOMATIC_RANGE == 1: 
             print("automatic range enabled")
+         elif V.TOGGLE_AUTOMATIC_RANGE == 2: 
+            print("automatic range follows the viewport")
          else: 
             print("automatic range disabled")
          
@@ -1066,6 +1628,7 @@ def keyboard_callback(window, key, scancode, action, mods):
     if key==glfw.KEY_B and (action==glfw.PRESS or action==glfw.REPEAT): 
        V.reset_range_to_8bits()
        V.TOGGLE_AUTOMATIC_RANGE = 0
+       V.viewport_histogram = None
        print("range set to [0,255]")
 
 
@@ -1075,7 +1638,7 @@ def keyboard_callback(window, key, scancode, action, mods):
        from os import path
 
        # determine display scale
-       fb_width,fb_height = glfw.get_framebuffer_size(window)
+       fb_width,fb_height = get_framebuffer_size(window)
        display_scale = int(fb_width / V.winx)
 
        w,h=V.winx*display_scale,V.winy*display_scale
@@ -1126,8 +1689,10 @@ def keyboard_callback(window, key, scancode, action, mods):
        V.reset_scale_bias()
 
     # reset visualization
-    if key==glfw.KEY_1 and action==glfw.PRESS:
-       V.TOGGLE_FLOW_COLORS = (V.TOGGLE_FLOW_COLORS + 1) % 8
+    if key==glfw.KEY_1 and action==glfw.PRESS and D.thumbnail and D.reduced:
+       D.full_needed = 1   # the palettes of the RAW mosaic (bayer)
+    elif key==glfw.KEY_1 and action==glfw.PRESS:
+       V.TOGGLE_FLOW_COLORS = V.TOGGLE_FLOW_COLORS + 1   # wrapped by display
        V.redisp = 1
 
 
@@ -1149,19 +1714,16 @@ def keyboard_callback(window, key, scancode, action, mods):
     if key==glfw.KEY_SPACE and (action==glfw.PRESS or action==glfw.REPEAT):
        new_current_image_idx = change_image(current_image_idx+1)
        if V.TOGGLE_AUTOMATIC_RANGE: V.reset_scale_bias()
-       V.mute_keyboard=1
 
     if key==glfw.KEY_BACKSPACE and (action==glfw.PRESS or action==glfw.REPEAT):
        new_current_image_idx = change_image(current_image_idx-1)
        if V.TOGGLE_AUTOMATIC_RANGE: V.reset_scale_bias()
-       V.mute_keyboard=1
 
     if key==glfw.KEY_MINUS and (action==glfw.PRESS or action==glfw.REPEAT):
        if remove_current_image():
           new_current_image_idx = change_image(current_image_idx)
           current_image_idx = -1  #FIXME forced refresh: image index hasn't changed by the image has
           if V.TOGGLE_AUTOMATIC_RANGE: V.reset_scale_bias()
-          V.mute_keyboard=1
 
     if not new_current_image_idx == current_image_idx:
        current_image_idx = new_current_image_idx
@@ -1173,17 +1735,26 @@ def keyboard_callback(window, key, scancode, action, mods):
        V.display_hud=(V.display_hud+1)%2
        V.redisp=1
 
+    # timers and counters: show, or write them with shift
+    if key==glfw.KEY_T   and action==glfw.PRESS:
+       if V.shift_is_pressed:
+          S.dump(O.stats_file)
+       else:
+          V.display_stats=(V.display_stats+1)%2
+          V.redisp=1
+
     # help
     if key==glfw.KEY_H   and action==glfw.PRESS:
        global HELPstr
        HELPstr="==============HELP==============\n" + \
                "Q     : quit\n" + \
                "U     : show/hide HUD\n" + \
+               "T     : show/hide timers, shiftT: write them\n" + \
                "arrows: pan image\n" + \
                "P,M   : zoom image in/out\n" + \
                "F     : fit image to window size\n" + \
                "C     : reset intensity range\n" + \
-               "shiftC: automatically reset range\n" + \
+               "shiftC: automatically reset range (image/viewport)\n" + \
                "B     : set range to [0:255]\n" + \
                "D,E   : range scale up/down\n" + \
                "R     : reset visualization: zoom,pan,range\n" + \
@@ -1219,14 +1790,526 @@ def keyboard_callback(window, key, scancode, action, mods):
        print(x0,y0,w0,h0)
 
     if V.redisp == 1:
-       # Call the mouseMotion callback in order to update the display info
-       mouseMotion_callback(window, V.mx, V.my)
+       # Call the mouseMotion event in order to update the display info
+       mouseMotion_event(window, V.mx, V.my)
+
+
+
+
+#### INPUT BATCHING
+class InputBatch:
+   ''' The GLFW input callbacks only record the events here, and 
+       process_input_batch applies them once per frame: the key, button 
+       and motion events in order (the consecutive motions are reduced to
+       the last position), then the accumulated scroll offsets and the 
+       dropped files. At most one image is changed per frame, the events
+       after a second image change wait for the next frame. '''
+   # ('key', key, scancode, action, mods), ('button', button, action, mods, x, y)
+   # or ('motion', x, y)
+   events = []
+   scroll = [0,0]
+   drops = []
+   since = {}       # kind of event : arrival time of the oldest one not yet drawn
+   cursor = None    # during a replay: the recorded cursor position
+
+   def clear(I):
+      I.events = []
+      I.scroll = [0,0]
+      I.drops = []
+
+   def moved(I, x, y):
+      if I.events and I.events[-1][0] == 'motion':
+         I.events[-1] = ('motion', x, y)
+      else:
+         I.events.append(('motion', x, y))
+
+   def pending(I):
+      ''' events wait for the next frame '''
+      return bool(I.events or I.scroll != [0,0] or I.drops)
+
+   def arrived(I, kind):
+      import time
+      if kind not in I.since:
+         I.since[kind] = time.time()
+
+   def frame_drawn(I):
+      ''' the latency of the events is the time until the end of their frame '''
+      import time
+      now = time.time()
+      for kind in I.since:
+         S.add('lat.'+kind, now - I.since[kind])
+      I.since = {}
 
+I = InputBatch()
+
+
+def get_cursor_pos(window):
+    if I.cursor is not None:
+       return I.cursor
+    return glfw.get_cursor_pos(window)
+
+def get_framebuffer_size(window):
+    if window:
+       return glfw.get_framebuffer_size(window)
+    return V.winx, V.winy   # offscreen rendering: the size is set in V
+
+# keys that load another image
+IMAGE_CHANGE_KEYS = (glfw.KEY_SPACE, glfw.KEY_BACKSPACE, glfw.KEY_MINUS)
+
+
+def mouseMotion_callback(window, x,y):
+    I.moved(x, y)
+    I.arrived('move')
+    E.log('motion', x, y)
+
+def mouseWheel_callback(window, xoffset, yoffset):
+    I.scroll[0] = I.scroll[0] + xoffset
+    I.scroll[1] = I.scroll[1] + yoffset
+    I.arrived('wheel')
+    if E.file:
+       E.log('scroll', xoffset, yoffset, *get_cursor_pos(window))
+
+def keyboard_callback(window, key, scancode, action, mods):
+    I.events.append(('key', key, scancode, action, mods))
+    I.arrived('key')
+    E.log('key', key, scancode, action, mods)
+
+
+def process_input_batch(window):
+    ''' applies the input events recorded since the last frame '''
+    global current_image_idx
+    events, scroll, drops = I.events, I.scroll, I.drops
+    I.clear()
+
+    image_changed = False
+    for n, event in enumerate(events):
+       if event[0] == 'key':
+          if image_changed and event[1] in IMAGE_CHANGE_KEYS:
+             # the next image change and the events after it wait for the 
+             # next frame, before those that arrived meanwhile
+             I.events[:0] = events[n:]
+             I.scroll = [scroll[0] + I.scroll[0], scroll[1] + I.scroll[1]]
+             I.drops[:0] = drops
+             return
+          idx = current_image_idx
+          keyboard_event(window, *event[1:])
+          image_changed = image_changed or idx != current_image_idx
+       elif event[0] == 'button':
+          # the cursor position of the click
+          cursor, I.cursor = I.cursor, event[4:6]
+          mouseButtons_event(window, *event[1:4])
+          I.cursor = cursor
+       else:
+          mouseMotion_event(window, event[1], event[2])
+
+    if scroll != [0,0]:
+       mouseWheel_event(window, scroll[0], scroll[1])
+
+    for filenames in drops:
+       drop_event(window, filenames)
+
+    # the events that don't change the view have no latency
+    if not V.redisp:
+       I.since = {}
+
+
+#### INPUT RECORDING
+class EventTrace:
+   ''' With --record FILE the input callbacks write their events to FILE,
+       one JSON list [seconds, kind, arguments...] per line, and a 'frame'
+       line after each drawn frame. The first line has the images and the
+       window size. --replay FILE feeds them back (see replay_trace). '''
+   file = None
+   t0 = 0
+
+   def start(E, filename, window_size):
+      import json, time
+      E.file = open(filename, 'w')
+      E.t0 = time.time()
+      E.file.write(json.dumps({'images': sys.argv[1:], 'window': list(window_size)}) + '\n')
+
+   def log(E, kind, *args):
+      import json, time
+      if E.file:
+         E.file.write(json.dumps([round(time.time() - E.t0, 6), kind] + list(args)) + '\n')
+
+   def stop(E):
+      if E.file:
+         E.file.close()
+         E.file = None
+
+E = EventTrace()
+
+
+def read_trace(filename):
+    ''' returns the header and the events of a file written by --record '''
+    import json
+    with open(filename) as f:
+       header = json.loads(f.readline())
+       events = [json.loads(l) for l in f if l.strip()]
+    return header, events
+
+
+def replay_trace(window, filename):
+    ''' feeds the recorded events to the callbacks, and draws the frames
+        where they were drawn, as fast as possible. window can be None
+        for an offscreen context (benchmark.py --replay) '''
+    global current_image_idx
+    header, events = read_trace(filename)
+    sys.argv[1:] = header['images']
+    V.winx, V.winy = header['window']
+    if window:
+       glfw.set_window_size(window, V.winx, V.winy)
+    current_image_idx = change_image(0)
+    V.reset_scale_bias()
+    V.window_has_been_resized_by_the_user = 1   # keep the recorded size
+    V.redisp = 1
+
+    callbacks = {'key': keyboard_callback, 'motion': mouseMotion_callback,
+                 'scroll': mouseWheel_callback, 'button': mouseButtons_callback,
+                 'drop': drop_callback, 'resize': resize_callback}
+    for event in events:
+       kind, args = event[1], event[2:]
+       if kind == 'frame':
+          process_input_batch(window)
+          draw_frame(window)
+       elif kind == 'key' and args[0] in (glfw.KEY_Q, glfw.KEY_ESCAPE):
+          break
+       elif kind in callbacks:
+          if kind == 'motion':
+             I.cursor = tuple(args)
+          elif kind in ('scroll', 'button'):
+             I.cursor, args = tuple(args[-2:]), args[:-2]
+          callbacks[kind](window, *args)
+
+    # the events that wait for the next frame, and the pending uploads
+    process_input_batch(window)
+    while draw_frame(window) or I.pending():
+       process_input_batch(window)
+    I.cursor = None
+
+
+#### SINGLE INSTANCE SERVER
+class ViewerServer:
+   ''' With --reuse the viewer listens on viewer_socket_path(): a thread 
+       receives the image lists of the next invocations, and the main loop
+       adds them as if they were dropped on the window (drop_callback). '''
+   sock = None
+   path = None
+   received = []
+
+   def start(L):
+      import socket, os, threading
+      path = viewer_socket_path()
+      if not hasattr(socket, 'AF_UNIX') or not path:
+         return
+      sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+      try:
+         sock.bind(path)
+      except (socket.error, OSError):
+         # a stale socket of a viewer that didn't exit cleanly
+         if send_to_running_viewer([]):
+            sock.close()   # another viewer has just started
+            return
+         try:
+            os.remove(path)
+            sock.bind(path)
+         except (socket.error, OSError) as e:
+            print('cannot listen on %s: %s'%(path, e))
+            sock.close()
+            return
+      sock.listen(8)
+      L.sock, L.path, L.lock = sock, path, threading.Lock()
+      t = threading.Thread(target=L.serve)
+      t.daemon = True
+      t.start()
+
+   def serve(L):
+      import json
+      while True:
+         try:
+            conn, addr = L.sock.accept()
+         except Exception:
+            return   # the socket was closed by stop
+         try:
+            conn.settimeout(2)
+            data = b''
+            while not data.endswith(b'\n'):
+               chunk = conn.recv(65536)
+               if not chunk:
+                  break
+               data = data + chunk
+            filenames = json.loads(data.decode('utf-8'))
+            if filenames:
+               with L.lock:
+                  L.received.append(filenames)
+               # wake up the main loop
+               if hasattr(glfw, 'post_empty_event'):
+                  glfw.post_empty_event()
+            conn.sendall(b'ok\n')
+         except Exception as e:
+            print('bad request from a client: %s'%e)
+         conn.close()
+
+   def pop(L):
+      ''' the image lists received since the last call '''
+      if not L.received:
+         return []
+      with L.lock:
+         received, L.received = L.received, []
+      return received
+
+   def stop(L):
+      import os
+      if L.sock:
+         L.sock.close()
+         L.sock = None
+         try:
+            os.remove(L.path)
+         except OSError:
+            pass
+
+L = ViewerServer()
+
+
+#### STREAMS
+class FrameStream:
+   ''' With --stream SOURCE the images of a sequence of concatenated binary
+       PGM/PPM, PFM or farbfeld images read from SOURCE (- for stdin, or a
+       named pipe) are shown as they arrive, in the place of SOURCE in the
+       list of images. A thread reads and tiles the frames and keeps only the
+       last one: the frames that arrive faster than they are shown are dropped. 
+       With --shm NAME the frames are polled from the shared memory ring
+       buffer NAME written by an external producer (see shmfeed.py), the
+       float32 frames are shown from the ring buffer itself: the frames
+       shown, pending and being read are held so that the producer doesn't
+       rewrite them. '''
+   source = None
+   shared = 0
+   pending = None      # the last frame read, not shown yet (tiled, timings, held)
+   last = None         # the last frame shown
+   frames = 0
+   dropped = 0
+   dropped_counted = 0   # already added to S
+   ended = 0
+   feed = None         # the shared memory feed being read
+   shown = []          # times at which the last frames were shown
+   poll_interval = 0.001    # seconds between two polls of the shared memory
+   first_wait = 0.5         # seconds the first image waits for the first frame
+   shown_frames = 0
+   band_max_width = 8192    # wider shared frames are tiled in 1024x1024
+
+   def start(F, source, shared=0):
+      import threading
+      F.source, F.shared = source, shared
+      F.lock, F.first = threading.Lock(), threading.Event()
+      t = threading.Thread(target=F.read_shared if shared else F.read)
+      t.daemon = True
+      t.start()
+
+   def push(F, tiled, timings, skipped=0, held=None):
+      ''' the new pending frame, skipped frames were not read. held is the
+          (feed, n, which) of a shared frame '''
+      with F.lock:
+         if F.pending:
+            F.dropped += 1
+         F.dropped += skipped
+         F.pending = (tiled, timings, held)
+         F.frames += 1 + skipped
+      F.first.set()
+      # wake up the main loop
+      if V.window and hasattr(glfw, 'post_empty_event'):
+         glfw.post_empty_event()
+
+   def read(F):
+      import piio
+      try:
+         if F.source == '-':
+            f = getattr(sys.stdin, 'buffer', sys.stdin)
+         else:
+            f = open(F.source, 'rb')   # a named pipe waits for the producer
+         while True:
+            timings = {}
+            frame = piio.read_frame(f)
+            if frame is None:
+               break
+            F.push(piio.tile_buffer(*(frame + (timings,))), timings)
+      except (IOError, OSError) as e:
+         print('error reading the stream %s: %s'%(F.source, e))
+      F.ended = 1
+      F.first.set()
+      print('end of the stream %s: %d frames, %d dropped'%(F.source, F.frames, F.dropped))
+
+   def read_shared(F):
+      ''' polls the shared memory feed F.source, waits for its producer and
+          follows the next ones '''
+      import time, shmfeed
+      feed, last = None, 0
+      while True:
+         if feed is None or feed.replaced():
+            try:
+               feed = shmfeed.Feed(F.source)
+               F.feed = feed
+               # the frames written before attaching are not counted as dropped
+               last = max(feed.sequence() - 1, 0)
+            except (IOError, OSError):
+               time.sleep(0.1)
+               continue
+            except ValueError as e:
+               print('error reading the feed %s: %s'%(F.source, e))
+               break
+         n = feed.sequence()
+         if n == last:
+            time.sleep(0.1 if feed.closed() else F.poll_interval)
+            continue
+         skipped, last = n - last - 1, n
+         timings = {}
+         # held 0 is the frame shown, 1 and 2 the pending one and this one
+         with F.lock:
+            pending = F.pending and F.pending[2]
+            which = 3 - pending[2] if pending and pending[0] is feed else 1
+            held = feed.hold(n, which)
+         tiled = held and F.shared_tiles(feed, n, timings)
+         if tiled:
+            F.push(tiled, timings, skipped, (feed, n, which))
+         else:
+            with F.lock:
+               F.dropped += 1 + skipped
+               F.frames += 1 + skipped
+      F.ended = 1
+      F.first.set()
+
+   def shared_tiles(F, feed, n, timings):
+      ''' the tiles of the held frame n of the feed as piio.tile_buffer, or
+          None if the producer rewrote it before. The float32 frames are tiled
+          in bands of 1024 rows pointing into their slot, the others are
+          converted to float32 (and the wider ones tiled) first '''
+      import ctypes, time, piio, shmfeed
+      frame = feed.frame(n)
+      if not frame:
+         return None
+      offset, w, h, nch, dtype = frame
+      N, size = w*h*nch, shmfeed.DTYPES[dtype][1]
+      if dtype == 'float32':
+         data = feed.mm
+      else:
+         t0 = time.time()
+         src = (ctypes.c_uint8*(N*size)).from_buffer(feed.mm, offset)
+         data, offset = piio.convert_samples(src, N, size), 0
+         timings['convert'] = time.time() - t0
+      if nch > 4 or w > F.band_max_width:
+         if data is feed.mm:
+            data = (ctypes.c_float*N).from_buffer(feed.mm, offset)
+         return piio.tile_buffer(data, w, h, nch, timings)
+
+      t0 = time.time()
+      vmin, vmax = piio.minmax((ctypes.c_float*N).from_buffer(data, offset))
+      timings['minmax'] = time.time() - t0
+      tiles = []
+      for y in range(0, h, 1024):
+         hh = min(h - y, 1024)
+         band = (ctypes.c_float*(w*hh*nch)).from_buffer(data, offset + y*w*nch*4)
+         tiles.append([band, 0, y, w, hh, nch, -1])
+      return (tiles, w, h, nch, vmin, vmax)
+
+   def pop(F):
+      ''' the last frame (tiles, w, h, nch, vmin, vmax) read since the last 
+          call, or None '''
+      if not F.pending:
+         return None
+      with F.lock:
+         (F.last, timings, held), F.pending = F.pending, None
+         if held:
+            held[0].hold(held[1], 0)   # releases the frame shown until now
+         dropped, F.dropped_counted = F.dropped - F.dropped_counted, F.dropped
+      S.count('stream_dropped', dropped)
+      for name in timings:
+         S.add(name, timings[name])
+      S.count('stream_frames')
+      return F.last
+
+   def stop(F):
+      ''' removes the shared memory feed left by its finished producer '''
+      import os
+      feed = F.feed
+      if feed and feed.closed() and not feed.replaced():
+         try:
+            os.remove(feed.path)
+         except OSError:
+            pass
+
+   def mark_shown(F):
+      import time
+      F.shown_frames += 1
+      F.shown.append(time.time())
+      F.fps()   # forgets the older ones
+
+   def fps(F):
+      ''' frames shown during the last second '''
+      import time
+      now = time.time()
+      while F.shown and F.shown[0] < now - 1:
+         F.shown.pop(0)
+      return len(F.shown)
+
+   def latest(F):
+      ''' the last frame. Waits at most first_wait seconds for the first one
+          (a named pipe without writer or a feed without producer would block
+          the window), then returns an empty image that show_stream_frame 
+          replaces when the first frame arrives '''
+      F.first.wait(F.first_wait)
+      if F.pop() or F.last:
+         return F.last
+      if F.ended:
+         raise IOError
+      return F.placeholder()
+
+   def placeholder(F):
+      ''' black 512x512 image '''
+      import ctypes, piio
+      w, h = 512, 512
+      return piio.tile_buffer((ctypes.c_float*(w*h))(), w, h, 1)
+
+F = FrameStream()
+
+
+def show_stream_frame(frame):
+   ''' replaces the image of the stream by its new frame '''
+   global D
+   if F.source not in sys.argv[1:]:
+      return     # removed from the list
+   F.mark_shown()
+   idx = sys.argv.index(F.source, 1) - 1
+   T = DD[idx] = ImageState()
+   T.imageBitmapTiles,T.w,T.h,T.nch,T.v_min,T.v_max = frame
+   T.filename, T.mtime = F.source, -1
+   if current_image_idx % (len(sys.argv) - 1) == idx:
+      D = T
+      setupImageTextures(D)
+      V.data_min, V.data_max = D.v_min, D.v_max
+      if V.TOGGLE_AUTOMATIC_RANGE: V.reset_scale_bias()
+      V.redisp = 1
+      # the window was sized for the placeholder
+      if F.shown_frames == 1: V.resize = 1
+
+
+def update_window_title(window):
+    ''' sets the window title at most every V.title_interval seconds, 
+        returns the time to wait for the pending update, or None '''
+    if V.title == V.title_shown:
+       return None
+    now = glfw.get_time()
+    if now - V.title_time < V.title_interval:
+       return V.title_interval - (now - V.title_time)
+    glfw.set_window_title(window, V.title)
+    V.title_shown, V.title_time = V.title, now
+    return None
 
 
 
 def resize_callback(window, width, height):
    global V
+   E.log('resize', width, height)
    glViewport(0, 0, width, height)
    V.winx,V.winy=width,height
    V.redisp=1
@@ -1243,6 +2326,11 @@ def unicode_char_callback(window, codepoint):
 
 
 def drop_callback(window, filenames):
+    I.drops.append(list(filenames))
+    I.arrived('drop')
+    E.log('drop', list(filenames))
+
+def drop_event(window, filenames):
     global V
     global current_image_idx
 
@@ -1252,7 +2340,6 @@ def drop_callback(window, filenames):
     new_current_image_idx = current_image_idx
     new_current_image_idx = change_image(current_image_idx+1)
     if V.TOGGLE_AUTOMATIC_RANGE: V.reset_scale_bias()
-    V.mute_keyboard=1
 
     if not new_current_image_idx == current_image_idx:
        current_image_idx = new_current_image_idx
@@ -1260,7 +2347,8 @@ def drop_callback(window, filenames):
        V.resize=1
 
     # regain focus after drop
-    glfw.focus_window(window);
+    if window:
+       glfw.focus_window(window);
 
 
 def display_refresh(window):
@@ -1279,13 +2367,16 @@ def display( window ):
     # image is larger than the screen glutReshapeWindow(D.w,D.h) 
     # will fail and winx,winy will be truncated to the size of the screen
 #    winx, winy= glfw.get_framebuffer_size(window)
-    winx, winy= glfw.get_window_size(window)
+    if window:
+       winx, winy= glfw.get_window_size(window)
+    else:   # offscreen rendering (benchmark.py): the size is set in V
+       winx, winy= V.winx, V.winy
     V.winx,V.winy=winx,winy
 
 
     # Query the native frame buffer resolution to honor HDPI monitors
     # https://github.com/adrianbroher/freetype-gl/commit/c8474a9f1723e013219ab871d6f40cf86159fe87
-    fb_width,fb_height = glfw.get_framebuffer_size(window)
+    fb_width,fb_height = get_framebuffer_size(window)
     
     # minimized window in windows 10 has size 0
     if (fb_width,fb_height, winx, winy) == (0,0,0,0):
@@ -1329,128 +2420,121 @@ def display( window ):
        glPopMatrix()
 
 
-    def drawHud(str,color=(0,1,0),pos=(8,13)):
-       #import OpenGL.GLUT as glut
-       #  A pointer to a font style..
-       #  Fonts supported by GLUT are: GLUT_BITMAP_8_BY_13,
-       #  GLUT_BITMAP_9_BY_15, GLUT_BITMAP_TIMES_ROMAN_10,
-       #  GLUT_BITMAP_TIMES_ROMAN_24, GLUT_BITMAP_HELVETICA_10,
-       #  GLUT_BITMAP_HELVETICA_12, and GLUT_BITMAP_HELVETICA_18.
-       font_style = glut.GLUT_BITMAP_8_BY_13
-       if display_scale>1:                  # RETINA
-          font_style = glut.GLUT_BITMAP_HELVETICA_18
-       glColor3f(color[0], color[1], color[2]);
-       line=0;
-       glRasterPos3f (pos[0], pos[1]+13*line,.5)
-       for i in str:
-          if  i=='\n':
-             line=line+1
-             glRasterPos3f (pos[0], pos[1]+13*line,.5)
-          else:
-             glut.glutBitmapCharacter(font_style, ord(i))
+    def drawHud(name,str,color=(0,1,0),pos=(8,13)):
+       # each HUD string has its own vertex buffer, rebuilt only if the text changes
+       if name not in HUD_TEXTS:
+          HUD_TEXTS[name] = HudText()
+       HUD_TEXTS[name].draw(str, 2 if display_scale>1 else 1, color, pos)
     
     
+    def drawTiles(P):
+       glEnable (GL_TEXTURE_2D); #/* enable texture mapping */
+       # the preview, stretched to the size of the image, fills the tiles not uploaded yet
+       if D.preview and (not D.imageBitmapTiles or len(U.ready) < len(D.imageBitmapTiles)):
+          P.uniform2f(b"_tilesz", D.preview[3], D.preview[4])
+          drawImage(PREVIEW_TEXTURE_ID, D.w, D.h)
+       textureID=13
+       for tile in D.imageBitmapTiles:
+          if textureID in U.ready:  # skip the tiles that are still being uploaded
+             P.uniform2f(b"_tilesz", tile[3], tile[4])
+             drawImage(textureID,tile[3],tile[4],tile[1],tile[2])
+          textureID=textureID+1
+       glDisable (GL_TEXTURE_2D); #/* disable texture mapping */
+
+
+    fbw, fbh = int(winx*display_scale), int(winy*display_scale)
+    # what is visible: the image, its uploaded tiles and the view transform
+    view_key = (D, U.generation, len(U.ready), V.zoom_param, V.dx, V.dy, 
+                V.dragdx, V.dragdy, fbw, fbh)
+
+    # the automatic range follows the viewport: the range of the 
+    # visible pixels is computed on the GPU before drawing them
+    if V.TOGGLE_AUTOMATIC_RANGE == 2 and R.view_key != view_key:
+       with S.timer('reduce'):
+          r = R.reduce(fbw, fbh, D.nch, drawTiles)
+       R.view_key = view_key
+       if r:
+          vmin, vmax, V.viewport_histogram = r
+          V.set_range(vmin, vmax)
+
     ## USE THE SHADER FOR RENDERING THE IMAGE
-    if D.nch == 2 :
-#       [('oflow',0), ('rb',0)]
-       V.TOGGLE_FLOW_COLORS = V.TOGGLE_FLOW_COLORS % 2
-       if V.TOGGLE_FLOW_COLORS == 1:
-          use_shader_program('oflow')
-       else:
-          use_shader_program('rb')
-    elif D.nch == 1:
-#       [('rgba',0), ('djet',0), ('dhsv',0), ('dem',0), ('djet',1), ('rgba',1), ('bayer',0), ('s2l2a',0)]
-       if V.TOGGLE_FLOW_COLORS == 1:
-          V.inv_param=0
-          use_shader_program('djet')
-       elif V.TOGGLE_FLOW_COLORS == 2:
-          V.inv_param=0
-          use_shader_program('dhsv')
-       elif V.TOGGLE_FLOW_COLORS == 3:
-          V.inv_param=1
-          use_shader_program('djet')
-       elif V.TOGGLE_FLOW_COLORS == 4:
-          V.inv_param=1
-          use_shader_program('dem')
-       elif V.TOGGLE_FLOW_COLORS == 5:
-          V.inv_param=1
-          use_shader_program('rgba')
-       elif V.TOGGLE_FLOW_COLORS == 6:
-          V.inv_param=0
-          use_shader_program('bayer')
-       elif V.TOGGLE_FLOW_COLORS == 7:
-          V.inv_param=0
-          use_shader_program('s2l2a')
-       else:
-          V.inv_param=0
-          use_shader_program('rgba')
+    palettes = PALETTES[D.nch if D.nch in PALETTES else 3]
+    V.TOGGLE_FLOW_COLORS = V.TOGGLE_FLOW_COLORS % len(palettes)
+    shader_name, V.inv_param = palettes[V.TOGGLE_FLOW_COLORS]
+    if shader_name in COLORMAPS:
+       shader_name, colormap = 'lut', shader_name
     else:
-       V.TOGGLE_FLOW_COLORS = V.TOGGLE_FLOW_COLORS % 4
-#       [('rgba',0), ('hsv',0), ('rgba',1), ('rgb',0)]
-       if V.TOGGLE_FLOW_COLORS == 1:
-          V.inv_param=0
-          use_shader_program('hsv')
-       elif V.TOGGLE_FLOW_COLORS == 2:
-          V.inv_param=1
-          use_shader_program('rgba')
-       elif V.TOGGLE_FLOW_COLORS == 3:
-          V.inv_param=0
-          use_shader_program('rgb')
-       else:
-          V.inv_param=0
-          use_shader_program('rgba')
-
-    global program
-    # set the values of the shader uniform variables (global)
-    shader_a= glGetUniformLocation(program, b"shader_a")
-    glUniform1f(shader_a,V.scale_param)
-    shader_b= glGetUniformLocation(program, b"shader_b")
-    glUniform1f(shader_b,V.bias_param)
-    shader_c= glGetUniformLocation(program, b"shader_c")
-    glUniform1i(shader_c,V.inv_param)
-
-    shader_B0 = glGetUniformLocation(program, b"shader_B0")
-    glUniform1f(shader_B0, V.bias_vector[0])
-    shader_B1 = glGetUniformLocation(program, b"shader_B1")
-    glUniform1f(shader_B1, V.bias_vector[1])
-    shader_B2 = glGetUniformLocation(program, b"shader_B2")
-    glUniform1f(shader_B2, V.bias_vector[2])
-
-    # DRAW THE IMAGE
-    glEnable (GL_TEXTURE_2D); #/* enable texture mapping */
-    textureID=13
-    for tile in D.imageBitmapTiles:
-       _tilesz= glGetUniformLocation(program, b"_tilesz")
-       glUniform2f(_tilesz, tile[3], tile[4]);
-       drawImage(textureID,tile[3],tile[4],tile[1],tile[2])
-       textureID=textureID+1
-    glDisable (GL_TEXTURE_2D); #/* disable texture mapping */
+       colormap = SHADER_COLORMAPS.get(shader_name)
+
+    # the shaded image is reused from the render cache if nothing that affects it
+    # has changed, so the HUD and overlay updates don't run the shaders again
+    image_key = view_key + (shader_name, colormap, V.inv_param, V.scale_param, 
+                            V.bias_param, tuple(V.bias_vector))
+    if C.lookup(image_key, fbw, fbh):
+       S.count('render_cache_hits')
+    else:
+       S.count('render_cache_misses')
+       # the CPU time to submit the commands, the GPU runs them later
+       with S.timer('shader_cpu'):
+          P = use_shader_program(shader_name)
+          if colormap:
+             use_colormap(P, colormap)
+
+          # set the values of the shader uniform variables (only the changed ones are sent)
+          P.uniform1f(b"shader_a", V.scale_param)
+          P.uniform1f(b"shader_b", V.bias_param)
+          P.uniform1i(b"shader_c", V.inv_param)
+          P.uniform1f(b"shader_B0", V.bias_vector[0])
+          P.uniform1f(b"shader_B1", V.bias_vector[1])
+          P.uniform1f(b"shader_B2", V.bias_vector[2])
+
+       # DRAW THE IMAGE
+       with S.timer('draw_cpu'), S.gpu_timer('draw_gpu'):
+          C.begin(image_key, fbw, fbh)
+          drawTiles(P)
+          C.end()
+    C.blit(fbw, fbh)
 
 
     # DONT USE THE SHADER FOR RENDERING THE HUD
-    glUseProgram(0)   
+    use_program(0)
 
     if V.display_hud:
        a=D.v_max-D.v_min
        b=D.v_min
-       drawHud('%s\n%s\n%s\n%.3f %.3f %s\n%.3f %.3f'%(
+       # the live frames (--stream, --shm) show their rate
+       live = '\n%d fps, %d dropped'%(F.fps(), F.dropped) if D.filename == F.source else ''
+       drawHud('info', '%s\n%s\n%s\n%.3f %.3f %s\n%.3f %.3f%s'%(
             D.filename, V.txt_pos,V.txt_val,V.v_center,V.v_radius, 
-            'auto' if V.TOGGLE_AUTOMATIC_RANGE else '',
-            D.v_min,D.v_max)
+            ('', 'auto', 'view')[V.TOGGLE_AUTOMATIC_RANGE],
+            D.v_min,D.v_max, live)
             )
+       if V.TOGGLE_AUTOMATIC_RANGE == 2 and V.viewport_histogram:
+          drawHistogram(V.viewport_histogram, (winx - 266, 10))
+
+    if V.display_stats:
+       drawHud('stats', S.text(), (1,0.6,0), (winx - 300, 100))
 
     global HELPstr
     if HELPstr != "":
-       drawHud(HELPstr, (0,1,0), (10, 80))
+       drawHud('help', HELPstr, (0,1,0), (10, 80))
        HELPstr=""
 
+    # statistics of the selected region, recomputed when the image changes
+    if V.selection:
+       if V.selection_image is not D and (D.imageBitmapTiles or D.approximate()):
+          update_selection_stats(histogram=V.selection_histogram is not None)
+       drawHud('selection', V.txt_selection, (1,1,0), (10, winy - 13*V.txt_selection.count('\n') - 90))
+       if V.selection_histogram:
+          drawHistogram(V.selection_histogram, (10, winy - 74))
+
 
     # show RECTANGULAR region
     global x0,y0,w0,h0,b0state,b1state
-    if(b1state=='pressed'):
+    if V.selection:
 
        # real image coordinates
-       xx0,yy0,xx1,yy1 = int(x0),int(y0),int(x0+w0),int(y0+h0)
+       xx0,yy0,xx1,yy1 = V.selection
 
        # compose transformation
        glPushMatrix()
@@ -1482,6 +2566,139 @@ def display( window ):
 
 
 
+##### HUD TEXT
+HUD_TEXTS = {}
+HUD_FONT_TEXTURE_ID = { 1: 12, 2: 11 }   # the image tiles use the textures from 13
+
+class HudText:
+   ''' A string drawn with the glyphs of the hudfont atlas. The quads of
+       all its characters are stored in a single vertex buffer, which is
+       only rebuilt when the text changes. '''
+   atlas = {}    # scale : (cell_w, cell_h, baseline, atlas_w, atlas_h)
+
+   def __init__(self):
+      self.text  = None
+      self.scale = None
+      self.vbo   = None
+      self.nvertices = 0
+
+   def setup_atlas(self, scale):
+      ''' uploads the glyphs for the display scale (2 for retina) as an alpha mask '''
+      import hudfont
+      pixels, aw, ah, cw, ch, baseline = hudfont.build_atlas(scale)
+      glBindTexture(GL_TEXTURE_2D, HUD_FONT_TEXTURE_ID[scale])
+      glPixelStorei(GL_UNPACK_ALIGNMENT,1)
+      glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_NEAREST)
+      glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_NEAREST)
+      # the fixed pipeline modulates the alpha of GL_ALPHA textures with the current color
+      glTexImage2D(GL_TEXTURE_2D, 0, GL_ALPHA8, aw, ah, 0, GL_ALPHA, GL_UNSIGNED_BYTE, bytes(pixels))
+      HudText.atlas[scale] = (cw, ch, baseline, aw, ah)
+
+   def set_text(self, text, scale):
+      ''' one quad per character, in window coordinates: 8x13 cells with 
+          the origin at the baseline of the first line (like glRasterPos) '''
+      import ctypes, hudfont
+      if scale not in HudText.atlas:
+         self.setup_atlas(scale)
+      cw, ch, baseline, aw, ah = HudText.atlas[scale]
+      columns = aw // cw
+      step_x, step_y, top = cw/scale, ch/scale, baseline/scale
+
+      vertices = []
+      line, col = 0, 0
+      for c in text:
+         if c == '\n':
+            line, col = line+1, 0
+            continue
+         n = ord(c) - hudfont.FIRST_CHAR
+         if n < 0 or n >= hudfont.NUM_CHARS:
+            n = ord('?') - hudfont.FIRST_CHAR
+         u0, v0 = (n % columns)*cw/aw, (n // columns)*ch/ah
+         u1, v1 = u0 + cw/aw, v0 + ch/ah
+         x0, y0 = col*step_x, line*step_y - top
+         x1, y1 = x0 + step_x, y0 + step_y
+         vertices += [x0,y0,u0,v0, x1,y0,u1,v0, x1,y1,u1,v1, x0,y1,u0,v1]
+         col = col+1
+
+      if self.vbo is None:
+         self.vbo = glGenBuffers(1)
+      data = (ctypes.c_float*len(vertices))(*vertices)
+      glBindBuffer(GL_ARRAY_BUFFER, self.vbo)
+      glBufferData(GL_ARRAY_BUFFER, ctypes.sizeof(data), data, GL_DYNAMIC_DRAW)
+      glBindBuffer(GL_ARRAY_BUFFER, 0)
+      self.nvertices = len(vertices)//4
+      self.text, self.scale = text, scale
+
+   def draw(self, text, scale, color, pos):
+      import ctypes
+      if text != self.text or scale != self.scale:
+         self.set_text(text, scale)
+      if self.nvertices == 0:
+         return
+
+      glEnable(GL_TEXTURE_2D)
+      glBindTexture(GL_TEXTURE_2D, HUD_FONT_TEXTURE_ID[scale])
+      glTexEnvi(GL_TEXTURE_ENV, GL_TEXTURE_ENV_MODE, GL_MODULATE)
+      glEnable(GL_BLEND)
+      glBlendFunc(GL_SRC_ALPHA, GL_ONE_MINUS_SRC_ALPHA)
+      glColor3f(color[0], color[1], color[2])
+
+      glPushMatrix()
+      glTranslatef(pos[0], pos[1], 0)
+      glBindBuffer(GL_ARRAY_BUFFER, self.vbo)
+      glEnableClientState(GL_VERTEX_ARRAY)
+      glEnableClientState(GL_TEXTURE_COORD_ARRAY)
+      glVertexPointer(2, GL_FLOAT, 16, ctypes.c_void_p(0))
+      glTexCoordPointer(2, GL_FLOAT, 16, ctypes.c_void_p(8))
+      glDrawArrays(GL_QUADS, 0, self.nvertices)
+      glDisableClientState(GL_TEXTURE_COORD_ARRAY)
+      glDisableClientState(GL_VERTEX_ARRAY)
+      glBindBuffer(GL_ARRAY_BUFFER, 0)
+      glPopMatrix()
+
+      glDisable(GL_BLEND)
+      glDisable(GL_TEXTURE_2D)
+
+
+
+HISTOGRAM_COLORS = { 1: [(1,1,0)], 2: [(1,0,0),(0,1,0)], 
+                     3: [(1,0,0),(0,1,0),(0,0.5,1)], 4: [(1,0,0),(0,1,0),(0,0.5,1),(1,1,1)] }
+
+def drawHistogram(hist, pos, size=(256,64)):
+   ''' draws the histograms of the channels as line strips over a translucent box,
+       pos is the top left corner in window coordinates '''
+   nbins = len(hist[0])
+   top = max(max(h) for h in hist)
+   if top == 0:
+      return
+   glEnable(GL_BLEND)
+   glBlendFunc(GL_SRC_ALPHA, GL_ONE_MINUS_SRC_ALPHA)
+   glPushMatrix()
+   glTranslatef(pos[0], pos[1]+size[1], 0)
+   glScalef(float(size[0])/nbins, -float(size[1]), 1)
+   glColor4f(0, 0, 0, 0.5)
+   glBegin(GL_QUADS)
+   glVertex2f(0,0); glVertex2f(nbins,0); glVertex2f(nbins,1); glVertex2f(0,1)
+   glEnd()
+   for h, color in zip(hist, HISTOGRAM_COLORS[len(hist) if len(hist) in HISTOGRAM_COLORS else 4]):
+      glColor4f(color[0], color[1], color[2], 0.9)
+      glBegin(GL_LINE_STRIP)
+      for i in range(nbins):
+         glVertex2f(i, h[i]/top); glVertex2f(i+1, h[i]/top)
+      glEnd()
+   glPopMatrix()
+   glDisable(GL_BLEND)
+
+
+
+# nch : ((internal format, --half internal format), data format, swizzle)
+TEXTURE_FORMATS = {
+      1 : ((GL_R32F,    GL_R16F),    GL_RED,  (GL_RED, GL_RED,   GL_RED,  GL_ONE)),
+      2 : ((GL_RG32F,   GL_RG16F),   GL_RG,   (GL_RED, GL_RED,   GL_RED,  GL_GREEN)),
+      3 : ((GL_RGB32F,  GL_RGB16F),  GL_RGB,  (GL_RED, GL_GREEN, GL_BLUE, GL_ONE)),
+      4 : ((GL_RGBA32F, GL_RGBA16F), GL_RGBA, (GL_RED, GL_GREEN, GL_BLUE, GL_ALPHA)),
+      }
+
 def setupTexture(imageBitmap, ix,iy,nch, textureID=13):
     """texture environment setup"""
     glBindTexture(GL_TEXTURE_2D, textureID)
@@ -1494,29 +2711,278 @@ def setupTexture(imageBitmap, ix,iy,nch, textureID=13):
     glTexParameterf(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_NEAREST)
     glTexEnvf(GL_TEXTURE_ENV, GL_TEXTURE_ENV_MODE, GL_DECAL)
 
-    # THE INTERNAL FORMAT GL_RGB32F ALLOWS TO PERFORM THE CONTRAST CHANGE ON THE FRAGMENT SHADER WITHOUT PRECISION LOSS
+    # THE INTERNAL FORMAT GL_*32F ALLOWS TO PERFORM THE CONTRAST CHANGE ON THE FRAGMENT SHADER WITHOUT PRECISION LOSS
     # https://www.opengl.org/discussion_boards/showthread.php/170053-Shader-floating-point-precision
     # https://www.opengl.org/sdk/docs/man/xhtml/glTexImage2D.xml
-    if nch==1:
-       glTexImage2D( GL_TEXTURE_2D, 0, GL_RGB32F, ix, iy, 0,
-         GL_LUMINANCE, GL_FLOAT, imageBitmap)
-    elif nch==2:
-       glTexImage2D( GL_TEXTURE_2D, 0, GL_RGBA32F, ix, iy, 0,
-         GL_LUMINANCE_ALPHA, GL_FLOAT, imageBitmap)
-    elif nch==4:
-       glTexImage2D( GL_TEXTURE_2D, 0, GL_RGBA32F, ix, iy, 0,
-         GL_RGBA, GL_FLOAT, imageBitmap)
-    else:
-       glTexImage2D( GL_TEXTURE_2D, 0, GL_RGB32F, ix, iy, 0,
-         GL_RGB, GL_FLOAT, imageBitmap)
+    # 1 and 2 channel images are stored as GL_R32F/GL_RG32F and swizzled so 
+    # that the shaders see the same (L,L,L,1) and (L,L,L,A) as with GL_LUMINANCE(_ALPHA)
+    # with --half the textures are stored as GL_*16F (half the memory, ~3 significant digits)
+    internal_format, data_format, swizzle = TEXTURE_FORMATS[nch if nch in TEXTURE_FORMATS else 3]
+    internal_format = internal_format[1 if O.half_float else 0]
+    glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_SWIZZLE_R, swizzle[0])
+    glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_SWIZZLE_G, swizzle[1])
+    glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_SWIZZLE_B, swizzle[2])
+    glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_SWIZZLE_A, swizzle[3])
+    glTexImage2D( GL_TEXTURE_2D, 0, internal_format, ix, iy, 0,
+      data_format, GL_FLOAT, imageBitmap)
 
 
 
 def setupTexturesFromImageTiles(imageBitmapTiles, ix,iy,nch, textureID=13):
-    """texture environment setup"""
+    """texture environment setup: only the texture storage is allocated here,
+       the pixels are streamed to the GPU by U.upload_step in the next frames"""
+    U.reset()
     for tile in imageBitmapTiles:
-       setupTexture(tile[0], tile[3],tile[4],tile[5], textureID)
+       setupTexture(None, tile[3],tile[4],tile[5], textureID)
+       U.pending.append([tile, textureID, 0])
        textureID=textureID+1
+    U.sort_pending_by_distance_to_view()
+
+
+PREVIEW_TEXTURE_ID = 4   # the render cache uses 5
+
+def setupImageTextures(T):
+    ''' textures of the image T: its tiles are streamed by U, its preview
+        (if any) is uploaded at once '''
+    setupTexturesFromImageTiles(T.imageBitmapTiles, T.w, T.h, T.nch)
+    if T.preview:
+       tile = T.preview
+       setupTexture(tile[0], tile[3], tile[4], tile[5], PREVIEW_TEXTURE_ID)
+
+
+
+#### ASYNCHRONOUS TEXTURE UPLOAD
+class TextureUploader:
+   ''' Streams the tiles of the current image to the GPU through an orphaned
+       pixel buffer object. At most upload_budget bytes are transferred
+       per frame (in slices of rows) so the window keeps responding while a
+       large image is uploaded. Only the completely uploaded tiles are drawn. '''
+   upload_budget = 64*1024*1024  # bytes per frame
+
+   pbo = None
+   pending = []         # [tile, textureID, next row to upload]
+   ready = set()        # textureIDs of the completely uploaded tiles
+   generation = 0       # incremented when the textures are reused for another image
+
+   def reset(U):
+      U.pending = []
+      U.ready = set()
+      U.generation += 1
+
+   def sort_pending_by_distance_to_view(U):
+      ''' upload first the tiles closest to the center of the window '''
+      cx,cy = V.compute_image_coordinates(V.winx/2.0, V.winy/2.0)
+      def dist(p):
+         tile = p[0]
+         return (tile[1]+tile[3]/2.0-cx)**2 + (tile[2]+tile[4]/2.0-cy)**2
+      U.pending.sort(key=dist)
+
+   def upload_step(U):
+      ''' uploads the next slice of pending rows, returns True if there is more to upload '''
+      import ctypes
+      if U.pbo is None and glMapBuffer:
+         U.pbo = glGenBuffers(1)
+
+      budget = U.upload_budget
+      glPixelStorei(GL_UNPACK_ALIGNMENT,1)
+      while U.pending and budget > 0:
+         tile, textureID, row = U.pending[0]
+         data, w, h, nch = tile[0], tile[3], tile[4], tile[5]
+         row_bytes = w*nch*ctypes.sizeof(ctypes.c_float)
+         nrows = min(h - row, max(1, budget // row_bytes))
+         nbytes = nrows*row_bytes
+         src = ctypes.addressof(data) + row*row_bytes
+         data_format = TEXTURE_FORMATS[nch if nch in TEXTURE_FORMATS else 3][1]
+
+         glBindTexture(GL_TEXTURE_2D, textureID)
+         if U.pbo:
+            # orphan the previous storage so the driver doesn't wait for the GPU
+            glBindBuffer(GL_PIXEL_UNPACK_BUFFER, U.pbo)
+            glBufferData(GL_PIXEL_UNPACK_BUFFER, nbytes, None, GL_STREAM_DRAW)
+            dst = glMapBuffer(GL_PIXEL_UNPACK_BUFFER, GL_WRITE_ONLY)
+            ctypes.memmove(dst, src, nbytes)
+            glUnmapBuffer(GL_PIXEL_UNPACK_BUFFER)
+            glTexSubImage2D(GL_TEXTURE_2D, 0, 0, row, w, nrows, data_format, GL_FLOAT, ctypes.c_void_p(0))
+            glBindBuffer(GL_PIXEL_UNPACK_BUFFER, 0)
+         else:
+            glTexSubImage2D(GL_TEXTURE_2D, 0, 0, row, w, nrows, data_format, GL_FLOAT, ctypes.c_void_p(src))
+
+         budget -= nbytes
+         S.count('upload_bytes', nbytes)
+         if row + nrows < h:
+            U.pending[0][2] = row + nrows
+         else:
+            U.ready.add(textureID)
+            U.pending.pop(0)
+
+      return len(U.pending) > 0
+
+U = TextureUploader()
+
+
+
+#### VIEWPORT REDUCTION
+class ViewportReduction:
+   ''' Range and coarse histogram of the pixels visible in the window, computed
+       on the GPU. The tiles are drawn with the vrange shader into a float
+       framebuffer, which is then reduced by blocks of 4x4 ping-ponging
+       between two smaller textures until one pixel is left. Only that pixel
+       and the histogram bins are read back. '''
+   nbins = 64
+   level0_texture_id = 10   # the HUD font uses 11 and 12, the image tiles from 13
+   pingpong_texture_ids = (8, 9)
+   histogram_texture_id = 7
+
+   fbo = None
+   size = (0,0)
+   view_key = None   # the view of the last reduction
+
+   def setup(R, w, h):
+      ''' (re)allocates the textures for a w x h framebuffer '''
+      if R.fbo is None:
+         R.fbo = glGenFramebuffers(1)
+         R.allocate(R.histogram_texture_id, R.nbins, 1, GL_R32F, GL_RED)
+      if R.size != (w,h):
+         R.allocate(R.level0_texture_id, w, h, GL_RGBA32F, GL_RGBA)
+         for textureID in R.pingpong_texture_ids:
+            R.allocate(textureID, (w+3)//4, (h+3)//4, GL_RG32F, GL_RG)
+         R.size = (w,h)
+
+   def allocate(R, textureID, w, h, internal_format, data_format):
+      glBindTexture(GL_TEXTURE_2D, textureID)
+      glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_NEAREST)
+      glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_NEAREST)
+      glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_S, GL_CLAMP_TO_EDGE)
+      glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_T, GL_CLAMP_TO_EDGE)
+      glTexImage2D(GL_TEXTURE_2D, 0, internal_format, w, h, 0, data_format, GL_FLOAT, None)
+
+   def render_to(R, textureID, w, h):
+      glFramebufferTexture2D(GL_FRAMEBUFFER, GL_COLOR_ATTACHMENT0, GL_TEXTURE_2D, textureID, 0)
+      glViewport(0, 0, w, h)
+
+   def draw_quad(R):
+      ''' covers the whole viewport '''
+      glMatrixMode(GL_MODELVIEW)
+      glPushMatrix()
+      glLoadIdentity()
+      glMatrixMode(GL_PROJECTION)
+      glPushMatrix()
+      glLoadIdentity()
+      glBegin(GL_QUADS)
+      glVertex2f(-1,-1); glVertex2f(1,-1); glVertex2f(1,1); glVertex2f(-1,1)
+      glEnd()
+      glPopMatrix()
+      glMatrixMode(GL_MODELVIEW)
+      glPopMatrix()
+      glMatrixMode(GL_PROJECTION)
+
+   def reduce(R, w, h, nch, draw_tiles):
+      ''' draws the tiles with draw_tiles(program) in a w x h framebuffer and returns
+          the min, max and histogram (in [min,max]) of the visible pixels, or None '''
+      import ctypes
+      R.setup(w, h)
+      glBindFramebuffer(GL_FRAMEBUFFER, R.fbo)
+
+      # first pass: the range of the channels of each visible pixel
+      R.render_to(R.level0_texture_id, w, h)
+      glClearBufferfv(GL_COLOR, 0, (ctypes.c_float*4)(3.4e38, -3.4e38, 0, 0))
+      P = use_shader_program('vrange')
+      P.uniform1i(b"shader_c", nch)
+      draw_tiles(P)
+
+      # reduce by 4x4 blocks until only one pixel is left
+      P = use_shader_program('vreduce')
+      src, srcsz, texsz = R.level0_texture_id, (w,h), (w,h)
+      dst, other = R.pingpong_texture_ids
+      while srcsz != (1,1):
+         dstsz = ((srcsz[0]+3)//4, (srcsz[1]+3)//4)
+         R.render_to(dst, dstsz[0], dstsz[1])
+         glBindTexture(GL_TEXTURE_2D, src)
+         P.uniform2f(b"_srcsz", srcsz[0], srcsz[1])
+         P.uniform2f(b"_texsz", texsz[0], texsz[1])
+         R.draw_quad()
+         src, srcsz, texsz = dst, dstsz, ((w+3)//4, (h+3)//4)
+         dst, other = other, dst
+      result = (ctypes.c_float*2)()
+      glReadPixels(0, 0, 1, 1, GL_RG, GL_FLOAT, result)
+      vmin, vmax = result
+
+      hist = None
+      if vmin <= vmax:
+         P = use_shader_program('vhist')
+         R.render_to(R.histogram_texture_id, R.nbins, 1)
+         glBindTexture(GL_TEXTURE_2D, R.level0_texture_id)
+         P.uniform2f(b"_srcsz", w, h)
+         P.uniform2f(b"_texsz", w, h)
+         P.uniform1f(b"shader_a", R.nbins/(vmax-vmin) if vmax > vmin else 0)
+         P.uniform1f(b"shader_b", vmin)
+         P.uniform1f(b"_nbins", R.nbins)
+         R.draw_quad()
+         counts = (ctypes.c_float*R.nbins)()
+         glReadPixels(0, 0, R.nbins, 1, GL_RED, GL_FLOAT, counts)
+         hist = [list(counts)]
+
+      glBindFramebuffer(GL_FRAMEBUFFER, 0)
+      glViewport(0, 0, w, h)
+      if hist is None:
+         return None
+      return vmin, vmax, hist
+
+R = ViewportReduction()
+
+
+
+#### RENDER CACHE
+class RenderCache:
+   ''' The shaded image is drawn into an offscreen framebuffer and copied to
+       the window. While its key (view, palette, contrast) doesn't change the
+       copy is reused, and only the HUD and the overlays are drawn again.
+       Disabled if glBlitFramebuffer is not available. '''
+   texture_id = 5
+   fbo = None
+   size = (0,0)
+   key = None
+
+   def supported(C):
+      return bool(glBlitFramebuffer) and bool(glGenFramebuffers)
+
+   def lookup(C, key, w, h):
+      ''' True if the cached image can be used for key '''
+      return C.key == key and C.size == (w,h)
+
+   def begin(C, key, w, h):
+      ''' the next drawing goes to the cache '''
+      if not C.supported():
+         return
+      if C.fbo is None:
+         C.fbo = glGenFramebuffers(1)
+      if C.size != (w,h):
+         # keep the precision of deep color windows
+         internal_format = GL_RGB10_A2 if glGetIntegerv(GL_RED_BITS) > 8 else GL_RGBA8
+         glBindFramebuffer(GL_FRAMEBUFFER, C.fbo)
+         glBindTexture(GL_TEXTURE_2D, C.texture_id)
+         glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_NEAREST)
+         glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_NEAREST)
+         glTexImage2D(GL_TEXTURE_2D, 0, internal_format, w, h, 0, GL_RGBA, GL_UNSIGNED_BYTE, None)
+         glFramebufferTexture2D(GL_FRAMEBUFFER, GL_COLOR_ATTACHMENT0, GL_TEXTURE_2D, C.texture_id, 0)
+         C.size = (w,h)
+      glBindFramebuffer(GL_FRAMEBUFFER, C.fbo)
+      glClear(GL_COLOR_BUFFER_BIT)
+      C.key = key
+
+   def end(C):
+      if C.supported():
+         glBindFramebuffer(GL_FRAMEBUFFER, 0)
+
+   def blit(C, w, h):
+      ''' copies the cached image to the window '''
+      if not C.supported():
+         return
+      glBindFramebuffer(GL_READ_FRAMEBUFFER, C.fbo)
+      glBlitFramebuffer(0, 0, w, h, 0, 0, w, h, GL_COLOR_BUFFER_BIT, GL_NEAREST)
+      glBindFramebuffer(GL_READ_FRAMEBUFFER, 0)
+
+C = RenderCache()
 
 
 
@@ -1538,19 +3004,288 @@ def toc(name=''):
        print('%f s'%(elapsed))
     else:
        print('%s: %f s'%(name, elapsed))
-##### TIC TOC 
-
+##### TIC TOC
+
+
+
+#### INSTRUMENTATION
+class Stats:
+   ''' Timers and counters of the image loads and of the frames. The key T
+       shows them on the HUD, shift-T writes them as JSON to the --stats-file
+       (or prints them), which is also written at exit. '''
+   max_samples = 4096   # samples kept per timer for the percentiles
+
+   def __init__(S):
+      S.timers = {}     # name : [count, total, max, recent samples]
+      S.counters = {}
+      S.switch_start = None
+      S.gpu_queries = []    # (name, query, start time) waiting for their result
+      S.free_queries = []
+      S.gpu_supported = None
+
+   def add(S, name, seconds):
+      if name not in S.timers:
+         S.timers[name] = [0, 0.0, 0.0, []]
+      t = S.timers[name]
+      t[0] += 1
+      t[1] += seconds
+      t[2] = max(t[2], seconds)
+      t[3].append(seconds)
+      if len(t[3]) > 2*S.max_samples:
+         del t[3][:-S.max_samples]
+
+   def count(S, name, n=1):
+      S.counters[name] = S.counters.get(name, 0) + n
+
+   def timer(S, name):
+      ''' with S.timer(name): adds the duration of the block to the timer '''
+      import contextlib, time
+      @contextlib.contextmanager
+      def measure():
+         t0 = time.time()
+         try:
+            yield
+         finally:
+            S.add(name, time.time() - t0)
+      return measure()
+
+   def gpu_timers_supported(S):
+      ''' GL_TIME_ELAPSED queries: OpenGL 3.3 or ARB_timer_query '''
+      import re
+      if S.gpu_supported is None:
+         version = re.match(br'(\d+)\.(\d+)', glGetString(GL_VERSION) or b'')
+         extensions = glGetString(GL_EXTENSIONS) or b''
+         S.gpu_supported = bool(glGenQueries) and bool(glGetQueryObjectui64v) and \
+               (bool(version) and (int(version.group(1)), int(version.group(2))) >= (3, 3)
+                or b'_timer_query' in extensions)
+      return S.gpu_supported
+
+   def gpu_timer(S, name):
+      ''' with S.gpu_timer(name): adds the time the GPU spends on the commands
+          of the block to the timer, measured by a GL_TIME_ELAPSED query that 
+          read_gpu_timers reads without waiting in the next frames. Does
+          nothing without timer queries '''
+      import contextlib, ctypes, time
+      @contextlib.contextmanager
+      def measure():
+         if not S.gpu_timers_supported():
+            yield
+            return
+         if S.free_queries:
+            query = S.free_queries.pop()
+         else:
+            q = GLuint(0)
+            glGenQueries(1, ctypes.byref(q))
+            query = q.value
+         t0 = time.time()
+         glBeginQuery(GL_TIME_ELAPSED, query)
+         try:
+            yield
+         finally:
+            glEndQuery(GL_TIME_ELAPSED)
+            S.gpu_queries.append((name, query, t0))
+      return measure()
+
+   def read_gpu_timers(S):
+      ''' adds the results of the finished queries, in order '''
+      import ctypes, time
+      while S.gpu_queries:
+         name, query, t0 = S.gpu_queries[0]
+         available = GLint(0)
+         glGetQueryObjectiv(query, GL_QUERY_RESULT_AVAILABLE, ctypes.byref(available))
+         if not available.value:
+            break
+         ns = GLuint64(0)
+         glGetQueryObjectui64v(query, GL_QUERY_RESULT, ctypes.byref(ns))
+         # longer than the time since the query began: a driver error 
+         # (llvmpipe returns a timestamp for the first query)
+         if ns.value*1e-9 <= time.time() - t0:
+            S.add(name, ns.value*1e-9)
+         S.gpu_queries.pop(0)
+         S.free_queries.append(query)
+
+   def start_switch(S):
+      ''' the image changes: the switch ends when all its tiles are uploaded '''
+      import time
+      S.switch_start = time.time()
+
+   def end_switch(S):
+      import time
+      if S.switch_start is not None:
+         S.add('switch', time.time() - S.switch_start)
+         S.switch_start = None
+
+   def percentile(S, name, p):
+      samples = sorted(S.timers[name][3][-S.max_samples:])
+      return samples[min(int(p/100.0*len(samples)), len(samples)-1)]
+
+   def hit_rate(S, name):
+      hits, misses = S.counters.get(name+'_hits', 0), S.counters.get(name+'_misses', 0)
+      return hits/float(hits+misses) if hits+misses else None
+
+   def summary(S):
+      timers = {}
+      for name, (n, total, tmax, samples) in S.timers.items():
+         timers[name] = { 'count': n, 'total_s': total, 'mean_ms': 1000*total/n,
+               'p50_ms': 1000*S.percentile(name, 50), 'p90_ms': 1000*S.percentile(name, 90),
+               'p99_ms': 1000*S.percentile(name, 99), 'max_ms': 1000*tmax }
+      rates = dict((name+'_hit_rate', S.hit_rate(name)) for name in ('image_cache', 'render_cache', 'shader_binary_cache'))
+      return { 'timers': timers, 'counters': dict(S.counters), 'hit_rates': rates }
+
+   def text(S):
+      ''' for the HUD '''
+      lines = ['%-10s %8s %8s %8s'%('ms', 'mean', 'p90', 'max')]
+      for name in sorted(S.timers):
+         n, total, tmax, samples = S.timers[name]
+         lines.append('%-10s %8.2f %8.2f %8.2f'%(name[:10], 1000*total/n, 1000*S.percentile(name, 90), 1000*tmax))
+      for name in ('image_cache', 'render_cache'):
+         rate = S.hit_rate(name)
+         if rate is not None:
+            lines.append('%s hits %.0f%%'%(name, 100*rate))
+      lines.append('uploaded %.1f MB'%(S.counters.get('upload_bytes', 0)/1e6))
+      if 'stream_frames' in S.counters:
+         lines.append('stream %d frames, %d dropped'%(S.counters['stream_frames'], S.counters['stream_dropped']))
+      return '\n'.join(lines)
+
+   def dump(S, filename=None):
+      import json
+      data = json.dumps(S.summary(), indent=1, sort_keys=True)
+      if filename is None:
+         print(data)
+         return
+      try:
+         with open(filename, 'w') as f:
+            f.write(data + '\n')
+         print('stats written to %s'%filename)
+      except (IOError, OSError) as e:
+         print('cannot write the stats: %s'%e)
+
+S = Stats()
+
+
+
+
+
+
+
+
+##### COMMAND LINE OPTIONS
+def parse_options():
+   ''' removes the --options from sys.argv and stores them in O,
+       the remaining arguments are the images to show '''
+   global O
+   args = [sys.argv[0]]
+   rest = sys.argv[1:]
+   while rest:
+      a = rest.pop(0)
+      # options with a value: --name value or --name=value
+      value = None
+      if a.startswith('--') and '=' in a:
+         a, value = a.split('=', 1)
+      if a in OPTIONS_WITH_VALUE and value is None:
+         if not rest:
+            print('missing file for %s'%a)
+            sys.exit(1)
+         value = rest.pop(0)
+      if a == '--half':
+         O.half_float = 1
+      elif a == '--reuse':
+         O.reuse = 1
+      elif a == '--startup-profile':
+         O.startup_profile = 1
+      elif a == '--stats-file':
+         O.stats_file = value
+      elif a == '--record':
+         O.record_file = value
+      elif a == '--replay':
+         O.replay_file = value
+      elif a in ('--stream', '--shm'):
+         if O.stream:
+            print('only one --stream or --shm is allowed')
+            sys.exit(1)
+         O.stream, O.shared_stream = value, a == '--shm'
+         args.append(value)
+      elif a == '--colormap':
+         try:
+            load_colormap(value)
+         except (IOError, OSError, ValueError) as e:
+            print('cannot load the colormap: %s'%e)
+            sys.exit(1)
+      elif a.startswith('--'):
+         print('unknown option: %s'%a)
+         sys.exit(1)
+      else:
+         args.append(a)
+   sys.argv[:] = args
 
 
+##### MAIN PROGRAM AND LOOP
 
+def draw_frame(window):
+    ''' draws the frame if needed, returns True if it was drawn '''
+    if not V.redisp:
+       return False
 
+    # Try to resize the window if needed
+    # this process the window resize requests generated by the application
+    # the user window resize requests requests go directly to resize_callback
+    if window and V.resize and not (D.w,D.h) == glfw.get_framebuffer_size(window) and not V.window_has_been_resized_by_the_user:
+       # maximum window size is given by the primary monitor 
+       monsz = glfw.get_video_mode(glfw.get_primary_monitor())[0];
+       V.winx, V.winy = min(D.w, monsz[0]), min(D.h, monsz[1])
+       #if((V.winx,V.winy) == monsz):     # may leave window decoration outside screen
+       #   glfw.set_window_pos(window,0,0)
+
+       # resize the window and check the resulting size (may be smaller)
+       glfw.set_window_size(window,V.winx,V.winy)
+       V.winx, V.winy= glfw.get_window_size(window)
+
+       # I know it's not been the user so I reset the variable to 0
+       V.window_has_been_resized_by_the_user=0
+       V.resize = 0
+
+    if V.TOGGLE_FIT_TO_WINDOW_SIZE: V.update_zoom_position_to_fit_window()
+
+    with S.timer('frame'):
+       # stream the next slice of the pending tiles 
+       uploading = False
+       if U.pending:
+          with S.timer('upload'):
+             uploading = U.upload_step()
+          if not uploading:
+             S.end_switch()
+
+       V.redisp = display(window) or uploading
+
+       # Swap front and back buffers
+       if window:
+          glfw.swap_buffers(window)
+       else:
+          glFinish()
 
+    # the GPU times of the previous frames
+    S.read_gpu_timers()
 
+    I.frame_drawn()
+    E.log('frame')
+    return True
 
-##### MAIN PROGRAM AND LOOP
 
 def main():
 
+    startup_mark('imports')
+    parse_options()
+
+    # the images of the recorded session
+    if O.replay_file:
+       try:
+          sys.argv[1:] = read_trace(O.replay_file)[0]['images']
+       except (IOError, OSError, ValueError) as e:
+          print('cannot read the events: %s'%e)
+          sys.exit(1)
+    elif O.stream:
+       F.start(O.stream, O.shared_stream)
+
     # verify input
     if len(sys.argv) == 1:
        # check if the standard input is a tty (not a pipe)
@@ -1581,6 +3316,7 @@ def main():
     # Initialize the library
     if not glfw.init():
         sys.exit(1)
+    startup_mark('glfw init')
 
     # Create a windowed mode window (hidden) and its OpenGL context
     glfw.window_hint(glfw.FOCUSED,  GL_TRUE);
@@ -1594,6 +3330,11 @@ def main():
 
     # Make the window's context current
     glfw.make_context_current(window)
+    startup_mark('window')
+
+    # swap the buffers with the vertical sync: at most one redraw per refresh
+    # (the replay runs as fast as possible)
+    glfw.swap_interval(0 if O.replay_file else 1)
 
     # event handlers
     glfw.set_key_callback(window, keyboard_callback)
@@ -1605,15 +3346,14 @@ def main():
     glfw.set_window_refresh_callback(window,display_refresh)
 #    glfw.set_char_callback (window, unicode_char_callback)
 
-    if not glut.INITIALIZED:
-        glut.glutInit([])
-
     toc('glfw init')
     tic()
 
     # read the image: this affects the global variables DD, D, and V
+    # (the decoding started in a thread before importing OpenGL)
     current_image_idx = change_image(0)
     V.reset_scale_bias()
+    startup_mark('wait image + textures')
 
     # resize the window 
     glfw.set_window_size(window, D.w,D.h)
@@ -1627,66 +3367,100 @@ def main():
     # reset this variable to 0
     V.window_has_been_resized_by_the_user=0
 
-    # show the window
-    glfw.show_window (window)
+    # show the window (the replay is invisible)
+    if not O.replay_file:
+       glfw.show_window (window)
 
     # compile and load the shader
-    use_shader_program('rgba')
+    P = use_shader_program('rgba')
 
-    global program 
     # set the values of the shader uniform variables (global)
-    shader_a= glGetUniformLocation(program, b"shader_a")
-    glUniform1f(shader_a,V.scale_param)
-    shader_b= glGetUniformLocation(program, b"shader_b")
-    glUniform1f(shader_b,V.bias_param)
-    shader_c= glGetUniformLocation(program, b"shader_c")
-    glUniform1i(shader_c,V.inv_param)
+    P.uniform1f(b"shader_a", V.scale_param)
+    P.uniform1f(b"shader_b", V.bias_param)
+    P.uniform1i(b"shader_c", V.inv_param)
 
     glDisable( GL_LIGHTING) # context lights by default
+    startup_mark('shader')
 
     toc('loadImage+data->RGBbitmap')
 
+    # the first frame (time to first pixel)
+    V.redisp = 1
+    draw_frame(window)
+    startup_mark('first frame')
+    if not O.replay_file:   # the replays don't show previews, their frames are reproducible
+       V.window = window
+    if O.startup_profile:
+       print_startup_profile()
+
+
+    if O.replay_file:
+       replay_trace(window, O.replay_file)
+       print(S.text())
+       glfw.set_window_should_close(window, 1)
+    elif O.record_file:
+       try:
+          E.start(O.record_file, glfw.get_window_size(window))
+       except (IOError, OSError) as e:
+          print('cannot record the events: %s'%e)
+
+    # the remaining shaders are compiled once the first frame is shown
+    precompiling = True
+
+    if O.reuse and not O.replay_file:
+       L.start()
 
     # Loop until the user closes the window
     while not glfw.window_should_close(window):
         #glfw.set_window_should_close(window,1) # only used for profiling
 
-        # Render here
-        if V.redisp:
-           # Try to resize the window if needed
-           # this process the window resize requests generated by the application
-           # the user window resize requests requests go directly to resize_callback
-           if V.resize and not (D.w,D.h) == glfw.get_framebuffer_size(window) and not V.window_has_been_resized_by_the_user:
-              # maximum window size is given by the primary monitor 
-              monsz = glfw.get_video_mode(glfw.get_primary_monitor())[0];
-              V.winx, V.winy = min(D.w, monsz[0]), min(D.h, monsz[1])
-              #if((V.winx,V.winy) == monsz):     # may leave window decoration outside screen
-              #   glfw.set_window_pos(window,0,0)
+        # the images sent by the next invocations (--reuse)
+        for filenames in L.pop():
+           drop_callback(window, filenames)
 
-              # resize the window and check the resulting size (may be smaller)
-              glfw.set_window_size(window,V.winx,V.winy)
-              V.winx, V.winy= glfw.get_window_size(window)
+        # the last frame received by --stream
+        frame = F.pop()
+        if frame:
+           show_stream_frame(frame)
 
-              # I know it's not been the user so I reset the variable to 0
-              V.window_has_been_resized_by_the_user=0
-              V.resize = 0
+        # apply the input events received since the last frame
+        process_input_batch(window)
 
-           if V.TOGGLE_FIT_TO_WINDOW_SIZE: V.update_zoom_position_to_fit_window()
+        # the full resolution of a reduced JPEG image, if the zoom needs it
+        update_reduced_image()
 
-           V.redisp = display(window)
-
-           # Swap front and back buffers
-           glfw.swap_buffers(window)
-           V.mute_wheel=0
-           V.mute_sweep=0
-           V.mute_keyboard=0
+        # Render here, otherwise compile the shaders ahead of time, 
+        # one per idle iteration, so cycling the palettes doesn't stall 
+        if not draw_frame(window) and precompiling and not U.pending:
+           precompiling = precompile_next_shader()
 
+        # throttled update of the window title
+        title_wait = update_window_title(window)
 
         # Poll for and process events
-        #glfw.poll_events()
-        glfw.wait_events()
-
+        # don't block while there are tiles to upload or shaders to compile
+        if U.pending or precompiling or I.pending():
+           glfw.poll_events()
+        elif D.loading and hasattr(glfw, 'wait_events_timeout'):
+           glfw.wait_events_timeout(0.02)   # until the full resolution is decoded
+        elif D.loading:
+           glfw.poll_events()
+        elif title_wait is not None and hasattr(glfw, 'wait_events_timeout'):
+           glfw.wait_events_timeout(title_wait)
+        elif F.source and not F.ended and not hasattr(glfw, 'post_empty_event') and hasattr(glfw, 'wait_events_timeout'):
+           glfw.wait_events_timeout(0.01)   # the stream thread can't wake us
+        elif L.sock and not hasattr(glfw, 'post_empty_event') and hasattr(glfw, 'wait_events_timeout'):
+           glfw.wait_events_timeout(0.25)   # the server thread can't wake us
+        else:
+           glfw.wait_events()
+
+    L.stop()
+    F.stop()
     glfw.terminate()
+    E.stop()
+
+    if O.stats_file:
+       S.dump(O.stats_file)
 
 
 if __name__ == '__main__': main()